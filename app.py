@@ -8,18 +8,20 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-from text_mood_detector import detect_mood_from_text
+import time
+
+# Start of this script run, for cold-start and rerun timings
+RUN_STARTED = time.perf_counter()
+
 from mood_mapper import get_genres_for_mood
-from spotify_connector import SpotifyConnector
+from gemini_client import get_model_pool, get_verdict_cache, verdict_key
+import metrics
+from concurrent.futures import ThreadPoolExecutor
 import json
-import time
 import webbrowser
 import os
 from dotenv import load_dotenv
 import google.generativeai as genai
-from spotipy.oauth2 import SpotifyOAuth
-import spotipy
-from textblob import TextBlob
 
 # Load environment variables
 load_dotenv()
@@ -32,28 +34,37 @@ if not GOOGLE_API_KEY:
 
 genai.configure(api_key=GOOGLE_API_KEY)
 
-# Initialize the model with error handling
-try:
-    models = genai.list_models()
-    # Prefer gemini-1.5-flash if available
-    model = None
-    preferred_model_name = "models/gemini-1.5-flash"
-    for m in models:
-        if m.name == preferred_model_name and hasattr(m, "supported_generation_methods") and "generateContent" in m.supported_generation_methods:
-            model = genai.GenerativeModel(m.name)
-            break
-    if not model:
+# Preferred model, also used until the background model lookup has finished
+PREFERRED_MODEL_NAME = "models/gemini-1.5-flash"
+
+def resolve_model_name():
+    """Pick a model that supports generateContent, preferring PREFERRED_MODEL_NAME."""
+    try:
+        models = [
+            m for m in genai.list_models()
+            if hasattr(m, "supported_generation_methods") and "generateContent" in m.supported_generation_methods
+        ]
+    except Exception as e:
+        print(f"Error listing Google AI models, using {PREFERRED_MODEL_NAME}: {str(e)}")
+        return PREFERRED_MODEL_NAME
+    names = [m.name for m in models]
+    if PREFERRED_MODEL_NAME in names:
+        return PREFERRED_MODEL_NAME
+    if names:
         # Fallback: use any model that supports generateContent
-        for m in models:
-            if hasattr(m, "supported_generation_methods") and "generateContent" in m.supported_generation_methods:
-                model = genai.GenerativeModel(m.name)
-                break
-    if not model:
-        st.error("No suitable model found that supports generateContent. Please check your API key and permissions.")
-        st.stop()
-except Exception as e:
-    st.error(f"Error initializing Google AI model: {str(e)}")
-    st.stop()
+        return names[0]
+    print(f"No model supporting generateContent found, using {PREFERRED_MODEL_NAME}")
+    return PREFERRED_MODEL_NAME
+
+@st.cache_resource
+def get_model_lookup():
+    """Resolve the model list once per process, in the background."""
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix='model-lookup').submit(resolve_model_name)
+
+def get_model_name():
+    """The resolved model name, or the preferred one while the lookup is still running."""
+    lookup = get_model_lookup()
+    return lookup.result() if lookup.done() else PREFERRED_MODEL_NAME
 
 # Configure Spotify
 SPOTIFY_CLIENT_ID = os.getenv('SPOTIFY_CLIENT_ID')
@@ -64,16 +75,44 @@ if not SPOTIFY_CLIENT_ID or not SPOTIFY_CLIENT_SECRET:
     st.error("Please set your SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET in the .env file")
     st.stop()
 
-sp = spotipy.Spotify(auth_manager=SpotifyOAuth(
-    client_id=SPOTIFY_CLIENT_ID,
-    client_secret=SPOTIFY_CLIENT_SECRET,
-    redirect_uri=SPOTIFY_REDIRECT_URI,
-    scope='playlist-modify-public'
-))
+@st.cache_resource
+def get_spotify_client():
+    """User-authorized Spotify client, created on first use."""
+    import spotipy
+    from spotipy.oauth2 import SpotifyOAuth
+    from spotify_connector import get_spotify_session
+
+    return spotipy.Spotify(
+        auth_manager=SpotifyOAuth(
+            client_id=SPOTIFY_CLIENT_ID,
+            client_secret=SPOTIFY_CLIENT_SECRET,
+            redirect_uri=SPOTIFY_REDIRECT_URI,
+            scope='playlist-modify-public'
+        ),
+        requests_session=get_spotify_session()
+    )
+
+@st.cache_resource
+def get_run_metrics():
+    """Process-wide startup and rerun timings."""
+    return {'cold_start_s': None, 'last_rerun_s': None, 'reruns': 0}
+
+def record_run_time():
+    """Record how long this script run took, the first one being the cold start."""
+    metrics = get_run_metrics()
+    elapsed = time.perf_counter() - RUN_STARTED
+    if metrics['cold_start_s'] is None:
+        metrics['cold_start_s'] = elapsed
+    else:
+        metrics['reruns'] += 1
+    metrics['last_rerun_s'] = elapsed
+    return metrics
 
 # Initialize Spotify connector with default songs
 @st.cache_resource
 def get_spotify_connector():
+    from spotify_connector import SpotifyConnector
+
     connector = SpotifyConnector()
     # Add default songs if not present
     if not hasattr(connector, 'default_songs'):
@@ -86,31 +125,75 @@ def get_spotify_connector():
             'romantic': ['Perfect - Ed Sheeran', 'All of Me - John Legend'],
             'anxious': ['Breathe Me - Sia', 'Fix You - Coldplay']
         }
+    # Keep per-mood candidate pools warm in the background when enabled
+    if os.getenv('SPOTIFY_WARM_POOLS', '').lower() in ('1', 'true', 'yes'):
+        connector.start_warmer()
     return connector
 
-# Load mood-genre mapping
-@st.cache_data
-def load_mood_genres():
-    with open('mood_genres.json', 'r') as f:
-        return json.load(f)
+# Bump when the mood prompt changes so cached verdicts are ignored
+ANALYZE_PROMPT_VERSION = "analyze-v1"
 
-def analyze_mood(text):
-    """Analyze the mood of the input text using Google's Generative AI."""
-    try:
-        prompt = f"Analyze the mood of this text and return a single word describing the primary emotion: {text}"
+@metrics.timed('gemini_analyze')
+def request_mood(text, model_name):
+    """Ask the model for the mood of the text. Raises on API errors."""
+    cache = get_verdict_cache()
+    key = verdict_key(text, model_name, ANALYZE_PROMPT_VERSION)
+    cached_mood = cache.get(key)
+    metrics.inc('cache_lookups_total', help_text='Cache lookups by cache and result', cache='analyze_verdicts', result='hits' if cached_mood is not None else 'misses')
+    if cached_mood is not None:
+        return cached_mood
+
+    prompt = f"Analyze the mood of this text and return a single word describing the primary emotion: {text}"
+    with get_model_pool(model_name).model() as model:
         response = model.generate_content(prompt)
-        if not response.text:
-            return "neutral"
-        return response.text.strip().lower()
-    except Exception as e:
-        st.error(f"Error analyzing mood: {str(e)}")
+    if not response.text:
         return "neutral"
+    mood = response.text.strip().lower()
+    cache.set(key, mood)
+    return mood
 
+@metrics.timed('sentiment')
 def get_sentiment_score(text):
     """Get the sentiment score of the text using TextBlob."""
+    from textblob import TextBlob
+
     analysis = TextBlob(text)
     return analysis.sentiment.polarity
 
+# Bounds for memoized mood/sentiment analysis
+ANALYSIS_CACHE_SIZE = int(os.getenv('ANALYSIS_CACHE_SIZE', '256'))
+ANALYSIS_CACHE_TTL = int(os.getenv('ANALYSIS_CACHE_TTL', '3600'))
+SESSION_ANALYSIS_CACHE_SIZE = 32
+
+@st.cache_data(max_entries=ANALYSIS_CACHE_SIZE, ttl=ANALYSIS_CACHE_TTL, show_spinner=False)
+def analyze_text_shared(text, model_name):
+    """Mood and sentiment for a text, shared across sessions. Failures raise and are not cached."""
+    return request_mood(text, model_name), get_sentiment_score(text)
+
+def analyze_text(text):
+    """
+    Mood and sentiment for the text, memoized so reruns and button clicks
+    don't repeat inference. Results are kept per session and across sessions,
+    keyed by the text and the model name.
+    """
+    model_name = get_model_name()
+    key = (model_name, text)
+    session_cache = st.session_state.setdefault('analysis_cache', {})
+    if key in session_cache:
+        return session_cache[key]
+
+    try:
+        result = analyze_text_shared(text, model_name)
+    except Exception as e:
+        st.error(f"Error analyzing mood: {str(e)}")
+        return "neutral", get_sentiment_score(text)
+
+    session_cache[key] = result
+    while len(session_cache) > SESSION_ANALYSIS_CACHE_SIZE:
+        session_cache.pop(next(iter(session_cache)))
+    return result
+
+@metrics.timed('app_create_playlist')
 def create_playlist(mood, sentiment_score):
     """Create a Spotify playlist based on mood and sentiment."""
     # Map mood to Spotify search query
@@ -132,6 +215,8 @@ def create_playlist(mood, sentiment_score):
     elif sentiment_score < -0.5:
         query += ' sad'
     
+    sp = get_spotify_client()
+    
     # Search for tracks
     results = sp.search(q=query, type='track', limit=20)
     track_uris = [track['uri'] for track in results['tracks']['items']]
@@ -168,6 +253,12 @@ def main():
         This app uses AI to understand your mood and suggest the perfect music.
         Just type how you're feeling, and we'll do the rest!
         """)
+        
+        with st.expander("⏱️ Performance"):
+            metrics = get_run_metrics()
+            if metrics['cold_start_s'] is not None:
+                st.caption(f"Cold start: {metrics['cold_start_s'] * 1000:.0f} ms")
+                st.caption(f"Last rerun: {metrics['last_rerun_s'] * 1000:.0f} ms ({metrics['reruns']} reruns)")
 
     # Main content
     st.title("🎵 How are you feeling today?")
@@ -182,9 +273,8 @@ def main():
     if user_input:
         with st.spinner("Analyzing your mood..."):
             try:
-                # Analyze mood
-                mood = analyze_mood(user_input)
-                sentiment_score = get_sentiment_score(user_input)
+                # Analyze mood (memoized across reruns)
+                mood, sentiment_score = analyze_text(user_input)
                 
                 # Display results
                 st.success(f"🎭 We detected that you're feeling **{mood.capitalize()}**")
@@ -287,4 +377,9 @@ if __name__ == "__main__":
         os.environ["STREAMLIT_BROWSER_OPENED"] = "1"
         webbrowser.open("http://localhost:8501")
     
-    main() 
\ No newline at end of file
+    # Start the model lookup in the background before the first render
+    get_model_lookup()
+    # Apply the METRICS_* settings, including those from .env, and expose /metrics on METRICS_PORT
+    metrics.start_from_env()
+    main()
+    record_run_time() 
\ No newline at end of file
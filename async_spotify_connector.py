@@ -0,0 +1,599 @@
+"""
+asyncio counterpart of SpotifyConnector.
+
+AsyncSpotifyConnector exposes the connector's operations as coroutines over
+one aiohttp connection pool per event loop, so a single loop can keep
+thousands of Spotify calls in flight without a thread per call. Credentials,
+endpoints, the mood-keyword ranking index, the response cache and the warm
+candidate pools are those of a wrapped SpotifyConnector, so sync and async
+callers see the same configuration and share cached lookups.
+
+Usage:
+    async with AsyncSpotifyConnector() as spotify:
+        results = await asyncio.gather(*(spotify.search_playlists_by_genre(genre, mood='happy') for genre in genres))
+"""
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+import weakref
+from typing import AsyncIterator, Dict, Iterable, List, Optional
+from urllib.parse import urlencode
+import aiohttp
+from spotipy.exceptions import SpotifyException
+from spotify_connector import RequestScheduler, SpotifyConnector, Track, TrackIndex, wants_next_page
+import metrics
+
+# Server errors retried with backoff, like the urllib3 Retry on the sync session;
+# POSTs are never resent, since a playlist create or write could be applied twice
+RETRY_STATUSES = (500, 502, 503, 504)
+RETRY_METHODS = frozenset(['GET', 'PUT', 'DELETE'])
+RETRY_ATTEMPTS = 3
+RETRY_BACKOFF = 0.3
+
+_sessions = weakref.WeakKeyDictionary()
+_pool_stats = weakref.WeakKeyDictionary()
+
+class _PoolStats:
+    """Request and connection counts for one session, collected through aiohttp tracing."""
+
+    def __init__(self):
+        self.requests = 0
+        self.connections_opened = 0
+        self.connections_reused = 0
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        config = aiohttp.TraceConfig()
+
+        async def request_start(session, context, params):
+            self.requests += 1
+
+        async def connection_opened(session, context, params):
+            self.connections_opened += 1
+
+        async def connection_reused(session, context, params):
+            self.connections_reused += 1
+
+        config.on_request_start.append(request_start)
+        config.on_connection_create_end.append(connection_opened)
+        config.on_connection_reuseconn.append(connection_reused)
+        return config
+
+def get_async_session() -> aiohttp.ClientSession:
+    """
+    Keep-alive aiohttp session shared by every async connector on the
+    running event loop.
+
+    Connections are pooled across hosts up to SPOTIFY_ASYNC_POOL_SIZE
+    (default 100); further requests wait for a free connection. Must be
+    called from a coroutine.
+    """
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=int(os.getenv('SPOTIFY_ASYNC_POOL_SIZE', '100')),
+            ttl_dns_cache=300
+        )
+        stats = _PoolStats()
+        session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=10),
+            trace_configs=[stats.trace_config()]
+        )
+        _sessions[loop] = session
+        _pool_stats[loop] = stats
+    return session
+
+async def close_async_session() -> None:
+    """Close the running loop's shared session, e.g. before the loop shuts down."""
+    loop = asyncio.get_running_loop()
+    _pool_stats.pop(loop, None)
+    session = _sessions.pop(loop, None)
+    if session is not None:
+        await session.close()
+
+def async_session_stats() -> Dict:
+    """Pool size, requests and connections opened or reused by the running loop's shared session."""
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        return {}
+    stats = _pool_stats[loop]
+    return {
+        'pool_size': session.connector.limit,
+        'requests': stats.requests,
+        'connections_opened': stats.connections_opened,
+        'connections_reused': stats.connections_reused
+    }
+
+class AsyncRequestScheduler:
+    """
+    Rate limiter for coroutines, with the same budget semantics as
+    RequestScheduler.
+
+    Each call reserves the next free send slot (`rate` per second, bursts up
+    to `burst`) and sleeps until it comes up, so thousands of waiting calls
+    cost one timer each rather than a polling loop. Background calls only
+    reserve a slot once no interactive call is waiting, woken by an event
+    rather than polling. A 429 pauses every call for the Retry-After period
+    (plus jitter); calls whose slot falls in the pause reserve a new one
+    after it. The scheduler can be shared by successive event loops, but not
+    by loops running at the same time.
+    """
+
+    INTERACTIVE = RequestScheduler.INTERACTIVE
+    BACKGROUND = RequestScheduler.BACKGROUND
+
+    def __init__(self, rate: float = 10.0, burst: int = 20, max_retries: int = 4, base_delay: float = 0.5):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self._interval = 1 / rate
+        self._tolerance = (self.burst - 1) * self._interval
+        # Theoretical arrival time of the next call; slots before it are taken
+        self._next_slot = 0.0
+        self._paused_until = 0.0
+        self._waiting = [0, 0]
+        self._idle = None
+        self._idle_loop = None
+        self.calls = 0
+        self.throttled = 0
+        self.delayed = 0
+        self.retries = 0
+        self.wait_time = 0.0
+
+    def _reserve(self, now: float) -> float:
+        slot = max(self._next_slot, now, self._paused_until + self._tolerance)
+        self._next_slot = slot + self._interval
+        return slot - self._tolerance
+
+    def _interactive_idle(self) -> asyncio.Event:
+        """Event set while no interactive call is waiting, created for the running loop."""
+        loop = asyncio.get_running_loop()
+        if self._idle_loop is not loop:
+            self._idle, self._idle_loop = asyncio.Event(), loop
+            if not self._waiting[self.INTERACTIVE]:
+                self._idle.set()
+        return self._idle
+
+    async def acquire(self, priority: int = INTERACTIVE) -> None:
+        """Wait until a request may be sent at this priority."""
+        started = time.monotonic()
+        idle = self._interactive_idle()
+        while priority == self.BACKGROUND and self._waiting[self.INTERACTIVE]:
+            await idle.wait()
+        self._waiting[priority] += 1
+        if priority == self.INTERACTIVE:
+            idle.clear()
+        try:
+            while True:
+                now = time.monotonic()
+                send_at = self._reserve(now)
+                if send_at > now:
+                    await asyncio.sleep(send_at - now)
+                if time.monotonic() >= self._paused_until:
+                    break
+        finally:
+            self._waiting[priority] -= 1
+            if not self._waiting[self.INTERACTIVE]:
+                idle.set()
+        self.calls += 1
+        waited = time.monotonic() - started
+        if waited > 0.001:
+            self.delayed += 1
+            self.wait_time += waited
+
+    def pause(self, seconds: float) -> None:
+        """Stop all calls for `seconds` and drain the bucket, e.g. after a 429."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def call(self, fn, *args, priority: int = INTERACTIVE, **kwargs):
+        """Await an API coroutine under the rate limit, retrying 429s after Retry-After with jittered backoff."""
+        for attempt in range(self.max_retries + 1):
+            await self.acquire(priority)
+            try:
+                return await fn(*args, **kwargs)
+            except SpotifyException as e:
+                if e.http_status != 429 or attempt == self.max_retries:
+                    raise
+                self.throttled += 1
+                self.retries += 1
+                metrics.inc('spotify_throttled_total', help_text='Spotify calls answered with 429')
+                retry_after = (e.headers or {}).get('Retry-After')
+                delay = float(retry_after) if retry_after else self.base_delay * 2 ** attempt
+                self.pause(delay + random.uniform(0, max(delay, self.base_delay) * 0.25))
+
+    def stats(self) -> Dict:
+        return {
+            'calls': self.calls,
+            'throttled': self.throttled,
+            'delayed': self.delayed,
+            'retries': self.retries,
+            'wait_time': self.wait_time,
+            'queued': max(0, round((self._next_slot - time.monotonic() - self._tolerance) * self.rate)),
+            'paused_for': max(0.0, self._paused_until - time.monotonic())
+        }
+
+_async_scheduler = None
+_async_scheduler_lock = threading.Lock()
+
+def get_async_request_scheduler() -> AsyncRequestScheduler:
+    """
+    Process-wide scheduler for async connectors, budgeted like
+    get_request_scheduler() (SPOTIFY_RATE_LIMIT, SPOTIFY_RATE_BURST).
+    Intended for a single event loop.
+    """
+    global _async_scheduler
+    with _async_scheduler_lock:
+        if _async_scheduler is None:
+            _async_scheduler = AsyncRequestScheduler(
+                rate=float(os.getenv('SPOTIFY_RATE_LIMIT', '10')),
+                burst=int(os.getenv('SPOTIFY_RATE_BURST', '20'))
+            )
+        return _async_scheduler
+
+class AsyncSpotifyConnector:
+    """
+    Coroutine versions of SpotifyConnector's search, track, playlist and
+    preview operations.
+
+    Requests go through the loop's shared aiohttp session and the async
+    scheduler. Tokens come from the wrapped connector's auth managers (on a
+    worker thread, only when the cached token is about to expire), so the
+    user authorization flow is the same as for SpotifyConnector. A connector
+    can be reused by successive event loops (e.g. repeated asyncio.run calls).
+    """
+
+    MAX_ITEMS_PER_REQUEST = SpotifyConnector.MAX_ITEMS_PER_REQUEST
+    LIVE_PLAYLISTS_PER_GENRE = SpotifyConnector.LIVE_PLAYLISTS_PER_GENRE
+    LIVE_TRACKS_PER_PLAYLIST = SpotifyConnector.LIVE_TRACKS_PER_PLAYLIST
+    PLAYLIST_PAGE_SIZE = SpotifyConnector.PLAYLIST_PAGE_SIZE
+    PLAYLIST_TRACK_FIELDS = SpotifyConnector.PLAYLIST_TRACK_FIELDS
+
+    # Tokens are renewed this many seconds before they expire
+    TOKEN_MARGIN = 60
+
+    def __init__(self, connector: Optional[SpotifyConnector] = None):
+        """
+        Args:
+            connector: SpotifyConnector whose configuration, auth, caches and
+                ranking index are used; one is created from the environment
+                if not given
+        """
+        self.connector = connector or SpotifyConnector()
+        self.scheduler = get_async_request_scheduler()
+        self._tokens = {}
+        self._token_lock = None
+        self._token_lock_loop = None
+
+    @property
+    def mood_keywords(self) -> Dict[str, List[str]]:
+        return self.connector.mood_keywords
+
+    @property
+    def playlist_index(self):
+        return self.connector.playlist_index
+
+    @property
+    def created_playlists(self) -> List[str]:
+        return self.connector.created_playlists
+
+    async def __aenter__(self) -> 'AsyncSpotifyConnector':
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        """Close the running loop's shared session; the next call opens a new one."""
+        await close_async_session()
+
+    def _fetch_token(self, user: bool) -> Dict:
+        if user:
+            return self.connector.get_user_token()
+        # Renews the client-credentials token if it has expired, then reads it back with its expiry
+        self.connector.auth_manager.get_access_token(as_dict=False)
+        return self.connector.auth_manager.cache_handler.get_cached_token()
+
+    def _token_refresh_lock(self) -> asyncio.Lock:
+        """Lock serializing token refreshes, created for the running loop."""
+        loop = asyncio.get_running_loop()
+        if self._token_lock_loop is not loop:
+            self._token_lock, self._token_lock_loop = asyncio.Lock(), loop
+        return self._token_lock
+
+    async def _access_token(self, user: bool) -> str:
+        token = self._tokens.get(user)
+        if token is None or token['expires_at'] - time.time() < self.TOKEN_MARGIN:
+            async with self._token_refresh_lock():
+                token = self._tokens.get(user)
+                if token is None or token['expires_at'] - time.time() < self.TOKEN_MARGIN:
+                    token = await asyncio.to_thread(self._fetch_token, user)
+                    if not token:
+                        raise Exception("Failed to get access token")
+                    self._tokens[user] = token
+        return token['access_token']
+
+    async def _request(
+        self,
+        method: str,
+        url: str,
+        params: Optional[Dict] = None,
+        payload: Optional[Dict] = None,
+        user: bool = False,
+        etag: Optional[str] = None,
+        priority: int = RequestScheduler.INTERACTIVE
+    ):
+        """
+        Send one Web API request under the shared rate limit, retrying server
+        errors with backoff.
+
+        Returns:
+            (status, body, etag) where status 304 means the ETag still matches
+        """
+        if not url.startswith('http'):
+            url = self.connector.sp.prefix + url
+        params = {key: value for key, value in (params or {}).items() if value is not None}
+
+        async def send():
+            headers = {'Authorization': f'Bearer {await self._access_token(user)}'}
+            if etag:
+                headers['If-None-Match'] = etag
+            for attempt in range(RETRY_ATTEMPTS + 1):
+                try:
+                    async with get_async_session().request(method, url, params=params, json=payload, headers=headers) as response:
+                        if response.status in RETRY_STATUSES and method in RETRY_METHODS and attempt < RETRY_ATTEMPTS:
+                            await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+                            continue
+                        data = await response.read()
+                        if response.status >= 400:
+                            raise SpotifyException(
+                                response.status,
+                                -1,
+                                f"{response.url}:\n {data.decode('utf-8', errors='replace')}",
+                                headers=response.headers
+                            )
+                        if response.status == 304:
+                            return 304, None, etag
+                        return response.status, json.loads(data) if data else None, response.headers.get('ETag')
+                except aiohttp.ClientConnectionError as e:
+                    # A POST is only resent if the connection failed before it went out
+                    resendable = method in RETRY_METHODS or isinstance(e, aiohttp.ClientConnectorError)
+                    if not resendable or attempt == RETRY_ATTEMPTS:
+                        raise
+                    await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+
+        return await self.scheduler.call(send, priority=priority)
+
+    async def _cached_get(
+        self,
+        url: str,
+        params: Optional[Dict] = None,
+        priority: int = RequestScheduler.INTERACTIVE
+    ) -> Dict:
+        """GET through the wrapped connector's response cache, under the same keys as its own lookups."""
+        params = {key: value for key, value in (params or {}).items() if value is not None}
+        key = url + '?' + urlencode(sorted(params.items()))
+        return await self.connector.response_cache.get_async(
+            key,
+            lambda etag: self._request('GET', url, params, etag=etag, priority=priority)
+        )
+
+    @metrics.timed('spotify_search')
+    async def search_playlists_by_genre(
+        self,
+        genre: str,
+        limit: int = 5,
+        mood: Optional[str] = None,
+        priority: int = RequestScheduler.INTERACTIVE
+    ) -> List[Dict]:
+        """
+        Search for playlists by genre, ranked by mood relevance like
+        SpotifyConnector.search_playlists_by_genre.
+
+        Returns:
+            List of playlist dictionaries, or [] if the search failed
+        """
+        try:
+            results = await self._cached_get('search', self.connector._search_params(genre), priority)
+            return self.connector._rank_search_results(results, limit, mood)
+        except Exception as e:
+            print(f"Error searching playlists: {str(e)}")
+            return []
+
+    async def iter_playlist_tracks(
+        self,
+        playlist_id: str,
+        limit: Optional[int] = None,
+        priority: int = RequestScheduler.INTERACTIVE
+    ) -> AsyncIterator[Track]:
+        """
+        Stream a playlist's tracks page by page as compact Track records,
+        fetching the next page while the caller works through the current one.
+        Paging stops once `limit` tracks have been yielded.
+        """
+        page_size = min(self.PLAYLIST_PAGE_SIZE, limit) if limit else self.PLAYLIST_PAGE_SIZE
+        params = {'market': self.connector.market, 'fields': self.PLAYLIST_TRACK_FIELDS, 'limit': page_size}
+        page = await self._cached_get(f'playlists/{playlist_id}/tracks', params, priority)
+        upcoming = None
+        yielded = 0
+        try:
+            while page is not None:
+                if wants_next_page(page, yielded + len(page['items']), limit):
+                    upcoming = asyncio.ensure_future(self._cached_get(page['next'], None, priority))
+                for item in page['items']:
+                    track = Track.from_item(item)
+                    if track:
+                        yield track
+                        yielded += 1
+                        if limit is not None and yielded >= limit:
+                            return
+                if upcoming is None and wants_next_page(page, yielded, limit):
+                    # Skipped items left the page short of the limit
+                    page = await self._cached_get(page['next'], None, priority)
+                else:
+                    page, upcoming = (await upcoming if upcoming else None), None
+        finally:
+            if upcoming is not None:
+                upcoming.cancel()
+
+    @metrics.timed('track_fetch')
+    async def get_playlist_tracks(
+        self,
+        playlist_id: str,
+        limit: int = 10,
+        priority: int = RequestScheduler.INTERACTIVE
+    ) -> List[Track]:
+        """Get up to `limit` tracks from a playlist, or [] if the lookup failed."""
+        tracks = self.iter_playlist_tracks(playlist_id, limit, priority)
+        try:
+            return [track async for track in tracks]
+        except Exception as e:
+            print(f"Error getting playlist tracks: {str(e)}")
+            return []
+        finally:
+            await tracks.aclose()
+
+    async def collect_mood_tracks(
+        self,
+        mood: str,
+        genres: Iterable[str],
+        tracks_per_playlist: int = LIVE_TRACKS_PER_PLAYLIST,
+        priority: int = RequestScheduler.INTERACTIVE
+    ) -> TrackIndex:
+        """
+        Search every genre concurrently, then fetch all found playlists' tracks
+        concurrently, deduplicated by URI in first-seen order.
+        """
+        all_tracks = TrackIndex()
+        searches = await asyncio.gather(*(
+            self.search_playlists_by_genre(genre, limit=self.LIVE_PLAYLISTS_PER_GENRE, mood=mood, priority=priority)
+            for genre in genres
+        ))
+        for tracks in await asyncio.gather(*(
+            self.get_playlist_tracks(found['id'], limit=tracks_per_playlist, priority=priority)
+            for playlists in searches for found in playlists
+        )):
+            all_tracks.update(tracks)
+        return all_tracks
+
+    @metrics.timed('create_playlist')
+    async def create_mood_playlist(
+        self,
+        mood: str,
+        playlist_name: Optional[str] = None,
+        playlist_description: Optional[str] = None
+    ) -> Optional[Dict]:
+        """
+        Create a playlist with songs matching the given mood, like
+        SpotifyConnector.create_mood_playlist.
+
+        Returns:
+            Dictionary with playlist details or None if creation failed
+        """
+        try:
+            genres = self.connector.mood_genres.get(mood, [])
+            if not genres:
+                print(f"No genres found for mood: {mood}")
+                return None
+
+            _, user, _ = await self._request('GET', 'me', user=True)
+            _, playlist, _ = await self._request('POST', f"users/{user['id']}/playlists", payload={
+                'name': playlist_name or f"{mood.capitalize()} Mood Playlist",
+                'public': True,
+                'description': playlist_description or f"Songs to match your {mood} mood"
+            }, user=True)
+
+            # Sample from the warm pool if there is one, otherwise search live
+            pool = self.connector.candidate_pools.get(mood)
+            if pool:
+                track_uris = [track.uri for track in random.sample(pool, min(len(pool), self.connector.warm_sample_size(genres)))]
+            else:
+                track_uris = (await self.collect_mood_tracks(mood, genres)).uris()[:self.connector.playlist_size]
+
+            playlist['tracks_added'] = 0
+            if track_uris:
+                result = await self.add_tracks_to_playlist(
+                    playlist['id'],
+                    track_uris,
+                    max_concurrency=self.connector.max_write_concurrency
+                )
+                playlist['tracks_added'] = result['added']
+                if result['snapshot_id']:
+                    playlist['snapshot_id'] = result['snapshot_id']
+
+            self.created_playlists.append(playlist['id'])
+            return playlist
+
+        except Exception as e:
+            print(f"Error creating mood playlist: {str(e)}")
+            return None
+
+    @metrics.timed('playlist_write')
+    async def add_tracks_to_playlist(
+        self,
+        playlist_id: str,
+        track_uris: List[str],
+        max_concurrency: int = 1
+    ) -> Dict:
+        """
+        Add tracks in chunks of at most MAX_ITEMS_PER_REQUEST. With
+        max_concurrency=1 chunks are appended in order; higher values send
+        chunks in parallel, in which case they may land in any order.
+
+        Returns:
+            Dictionary with the number of tracks added and failed, the number
+            of write requests, and the latest snapshot id
+        """
+        chunks = [
+            track_uris[i:i + self.MAX_ITEMS_PER_REQUEST]
+            for i in range(0, len(track_uris), self.MAX_ITEMS_PER_REQUEST)
+        ]
+        slots = asyncio.Semaphore(max(1, max_concurrency))
+
+        async def add(chunk):
+            async with slots:
+                try:
+                    _, body, _ = await self._request('POST', f'playlists/{playlist_id}/items', payload={'uris': chunk}, user=True)
+                    return body['snapshot_id']
+                except Exception as e:
+                    print(f"Error adding {len(chunk)} tracks to playlist: {str(e)}")
+                    return None
+
+        if max_concurrency <= 1:
+            snapshots = [await add(chunk) for chunk in chunks]
+        else:
+            snapshots = await asyncio.gather(*(add(chunk) for chunk in chunks))
+
+        added = sum(len(chunk) for chunk, snapshot in zip(chunks, snapshots) if snapshot)
+        successful = [snapshot for snapshot in snapshots if snapshot]
+        return {
+            'added': added,
+            'failed': len(track_uris) - added,
+            'requests': len(chunks),
+            'snapshot_id': successful[-1] if successful else None
+        }
+
+    async def delete_playlist(self, playlist_id: str) -> bool:
+        """Unfollow (delete) a playlist. Returns True if deletion was successful."""
+        try:
+            await self._request('DELETE', f'playlists/{playlist_id}/followers', user=True)
+            if playlist_id in self.created_playlists:
+                self.created_playlists.remove(playlist_id)
+            return True
+        except Exception as e:
+            print(f"Error deleting playlist: {e}")
+            return False
+
+    async def get_track_preview(self, track_id: str) -> Optional[str]:
+        """The preview URL for a track, or None if it has none or the lookup failed."""
+        try:
+            _, track, _ = await self._request('GET', f'tracks/{track_id}')
+            return track.get('preview_url')
+        except Exception as e:
+            print(f"Error getting track preview: {e}")
+            return None
@@ -0,0 +1,357 @@
+"""
+Offline benchmarks for the mood-to-playlist pipeline.
+
+Runs keyword detection across input lengths, detect_mood_from_text with a
+stubbed ML backend, the mood-to-genre lookup and create_mood_playlist against
+an in-process stand-in for the Spotify transport. No network access or API
+keys are needed.
+
+Usage:
+    python benchmark.py [--iterations N] [--output results.json] [--compare baseline.json]
+
+Each benchmark reports throughput, p50/p95/p99 latency and peak traced
+memory. Results are written as JSON (by default to benchmark_results/,
+named after the current commit) so runs on different commits can be compared.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+from unittest import mock
+
+# Keep the benchmark hermetic: no disk caches, no warm pools from earlier runs
+os.environ.update({
+    'SPOTIFY_CLIENT_ID': os.getenv('SPOTIFY_CLIENT_ID') or 'benchmark',
+    'SPOTIFY_CLIENT_SECRET': os.getenv('SPOTIFY_CLIENT_SECRET') or 'benchmark',
+    'SPOTIFY_POOL_PATH': '',
+    'SPOTIFY_CACHE_PATH': '',
+    'LLM_CACHE_PATH': ''
+})
+
+import requests
+import spotipy
+import text_mood_detector
+from cache import TieredCache, TTLCache
+from gemini_client import CircuitBreaker, RequestCoalescer
+from mood_mapper import get_genres_for_mood
+from spotify_connector import RequestScheduler, SpotifyConnector
+from transport import Cassette, CassetteSession
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_results')
+
+SAMPLE_SENTENCES = [
+    "I'm feeling really happy and excited about the weekend.",
+    "Today was long and tiring, and I just want some quiet time.",
+    "I miss the old days when we used to listen to records together.",
+    "Everything is going wrong and I'm so frustrated with work.",
+    "Spending the evening with someone I love, candles and soft music.",
+    "Nervous about tomorrow's interview, I can't stop worrying.",
+    "Just a regular afternoon, nothing special going on."
+]
+
+def make_text(words: int, offset: int = 0) -> str:
+    """Text of roughly `words` words built from the sample sentences."""
+    parts, count, i = [], 0, offset
+    while count < words:
+        sentence = SAMPLE_SENTENCES[i % len(SAMPLE_SENTENCES)]
+        parts.append(sentence)
+        count += len(sentence.split())
+        i += 1
+    return ' '.join(parts)
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, math.ceil(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def summarize(latencies: List[float], peak_bytes: int) -> Dict:
+    """Throughput, latency percentiles (milliseconds) and peak memory for one benchmark."""
+    ordered = sorted(latencies)
+    total = sum(ordered)
+    return {
+        'iterations': len(ordered),
+        'throughput_per_s': len(ordered) / total if total else 0.0,
+        'mean_ms': total / len(ordered) * 1000 if ordered else 0.0,
+        'p50_ms': percentile(ordered, 50) * 1000,
+        'p95_ms': percentile(ordered, 95) * 1000,
+        'p99_ms': percentile(ordered, 99) * 1000,
+        'peak_memory_kb': peak_bytes / 1024
+    }
+
+def measure(fn: Callable[[int], object], iterations: int, warmup: int = 3, memory_iterations: int = 20) -> Dict:
+    """
+    Time `fn(i)` for each iteration, then rerun a few iterations under
+    tracemalloc for peak memory so tracing overhead doesn't skew latency.
+    """
+    for i in range(warmup):
+        fn(i)
+    latencies = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        fn(warmup + i)
+        latencies.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        for i in range(min(iterations, memory_iterations)):
+            fn(warmup + iterations + i)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return summarize(latencies, peak)
+
+class FakeResponse:
+    """The parts of a requests.Response the connector reads."""
+
+    def __init__(self, body: Dict, url: str):
+        self.status_code = 200
+        self.url = url
+        self.text = ''
+        self.headers = {}
+        self._body = body
+
+    def json(self) -> Dict:
+        return self._body
+
+class FakeSpotifySession:
+    """
+    In-process stand-in for the Spotify Web API read endpoints: genre search
+    and paginated playlist tracks, with an optional fixed per-request latency.
+    """
+
+    prefix = 'https://api.spotify.com/v1/'
+
+    def __init__(self, playlists_per_search: int = 20, tracks_per_playlist: int = 100, latency: float = 0.0):
+        self.playlists_per_search = playlists_per_search
+        self.tracks_per_playlist = tracks_per_playlist
+        self.latency = latency
+        self.requests = 0
+
+    def get(self, url: str, params: Optional[Dict] = None, headers: Optional[Dict] = None, timeout: Optional[float] = None) -> FakeResponse:
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        path, _, query = url.replace(self.prefix, '').partition('?')
+        params = dict(params or {})
+        for pair in query.split('&') if query else ():
+            key, _, value = pair.partition('=')
+            params[key] = value
+
+        if path == 'search':
+            genre = params['q'].split('"')[1]
+            items = [{
+                'id': f'{genre}-{i}',
+                'name': f'{genre.title()} {("Chill", "Happy Hits", "Sad Songs", "Party", "Focus")[i % 5]}',
+                'description': 'upbeat, calm and emotional picks'
+            } for i in range(self.playlists_per_search)]
+            return FakeResponse({'playlists': {'items': items}}, url)
+
+        playlist_id = path.split('/')[1]
+        offset = int(params.get('offset', 0))
+        limit = int(params.get('limit', 100))
+        end = min(self.tracks_per_playlist, offset + limit)
+        items = [{'track': {
+            'uri': f'spotify:track:{playlist_id}-{i}',
+            'id': f'{playlist_id}-{i}',
+            'name': f'Track {i}',
+            'artists': [{'id': f'artist-{i % 50}'}],
+            'duration_ms': 200000,
+            'popularity': i % 100
+        }} for i in range(offset, end)]
+        next_url = f'{self.prefix}{path}?offset={end}&limit={limit}' if end < self.tracks_per_playlist else None
+        return FakeResponse({'items': items, 'next': next_url}, url)
+
+class FakeUserClient:
+    """Stand-in for the user-scoped spotipy client used for playlist writes."""
+
+    def current_user(self) -> Dict:
+        return {'id': 'benchmark-user'}
+
+    def user_playlist_create(self, user: str, name: str, public: bool = True, description: str = '') -> Dict:
+        return {'id': 'benchmark-playlist', 'name': name, 'external_urls': {'spotify': ''}}
+
+    def playlist_add_items(self, playlist_id: str, items: List[str]) -> Dict:
+        return {'snapshot_id': 'benchmark-snapshot'}
+
+def make_connector(session: FakeSpotifySession, user_session=None) -> SpotifyConnector:
+    """
+    Connector reading through `session`. Writes go to a FakeUserClient, or
+    through `user_session` (e.g. a replaying cassette) when one is given.
+    """
+    connector = SpotifyConnector()
+    connector.sp.prefix = getattr(session, 'prefix', connector.sp.prefix)
+    connector.session = session
+    connector.auth_manager = mock.Mock(**{'get_access_token.return_value': 'benchmark'})
+    if user_session is None:
+        connector.sp_user = FakeUserClient()
+    else:
+        prefix = connector.sp_user.prefix
+        connector.sp_user = spotipy.Spotify(auth='benchmark', requests_session=user_session, requests_timeout=10)
+        connector.sp_user.prefix = prefix
+    connector.get_user_token = lambda: {'access_token': 'benchmark'}
+    connector.scheduler = RequestScheduler(rate=1e9, burst=1e9)
+    return connector
+
+def stub_ml(latency: float):
+    """
+    Patch the ML fallback with a fake model answering after `latency` seconds,
+    with a fresh in-memory verdict cache and circuit breaker.
+    """
+    def classify_one(text):
+        time.sleep(latency)
+        return 'neutral'
+
+    def classify_batch(texts):
+        time.sleep(latency)
+        return ['neutral'] * len(texts)
+
+    coalescer = RequestCoalescer(classify_batch, classify_one, max_wait=0.001)
+    cache = TieredCache(TTLCache(max_size=100000, ttl=None))
+    return [
+        mock.patch.object(text_mood_detector, '_ml_coalescer', coalescer),
+        mock.patch.object(text_mood_detector, 'get_verdict_cache', lambda: cache),
+        mock.patch.object(text_mood_detector, 'ML_BREAKER', CircuitBreaker())
+    ]
+
+def run_benchmarks(
+    iterations: int = 200,
+    ml_latency: float = 0.005,
+    network_latency: float = 0.0,
+    cassette_path: Optional[str] = None
+) -> Dict:
+    results = {}
+
+    for words in (10, 100, 1000):
+        text = make_text(words)
+        results[f'keyword_based_detection/{words}_words'] = measure(
+            lambda i: text_mood_detector.keyword_based_detection(text), iterations
+        )
+
+    patches = stub_ml(ml_latency)
+    for patch in patches:
+        patch.start()
+    try:
+        # Unique low-confidence texts so every call misses the verdict cache and reaches the stub
+        results['detect_mood_from_text/ml_miss'] = measure(
+            lambda i: text_mood_detector.detect_mood_from_text(f"note {i}: I am feeling happy today"), iterations
+        )
+        results['detect_mood_from_text/ml_cached'] = measure(
+            lambda i: text_mood_detector.detect_mood_from_text("note 0: I am feeling happy today"), iterations
+        )
+    finally:
+        for patch in reversed(patches):
+            patch.stop()
+
+    moods = ['happy', 'sad', 'relaxed', 'unknown']
+    results['get_genres_for_mood'] = measure(lambda i: get_genres_for_mood(moods[i % len(moods)]), iterations * 10)
+
+    if cassette_path:
+        # Replay recorded Spotify traffic, at the recorded latency unless one is given
+        cassette = Cassette(cassette_path, Cassette.REPLAY, latency=network_latency or None)
+        session = CassetteSession(requests.Session(), cassette)
+        connector = make_connector(session, user_session=session)
+    else:
+        session = FakeSpotifySession(latency=network_latency)
+        connector = make_connector(session)
+
+    def cold(i):
+        connector.response_cache.clear()
+        connector.create_mood_playlist('happy')
+
+    playlist_iterations = max(1, iterations // 10)
+    results['create_mood_playlist/cold_cache'] = measure(cold, playlist_iterations, warmup=1, memory_iterations=3)
+    results['create_mood_playlist/warm_cache'] = measure(
+        lambda i: connector.create_mood_playlist('happy'), playlist_iterations, warmup=1, memory_iterations=3
+    )
+
+    # Spotify reads one cold playlist creation makes
+    if isinstance(session, FakeSpotifySession):
+        session.requests = 0
+        cold(0)
+        results['create_mood_playlist/cold_cache']['requests_per_call'] = session.requests
+    return results
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """Benchmarks whose p50 latency grew by more than `threshold` (a fraction) over the baseline."""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous or not previous.get('p50_ms'):
+            continue
+        change = current['p50_ms'] / previous['p50_ms'] - 1
+        print(f"{name:45s} p50 {previous['p50_ms']:9.3f} -> {current['p50_ms']:9.3f} ms ({change:+.1%})")
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=200, help='timed iterations per benchmark')
+    parser.add_argument('--ml-latency-ms', type=float, default=5.0, help='simulated Gemini latency')
+    parser.add_argument('--network-latency-ms', type=float, default=0.0, help='simulated Spotify request latency')
+    parser.add_argument('--output', help='where to write the JSON results')
+    parser.add_argument('--cassette', help='replay Spotify traffic from this recorded cassette instead of the in-process stand-in')
+    parser.add_argument('--compare', help='baseline JSON results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10, help='p50 slowdown that counts as a regression')
+    args = parser.parse_args(argv)
+
+    commit = git_commit()
+    results = run_benchmarks(args.iterations, args.ml_latency_ms / 1000, args.network_latency_ms / 1000, args.cassette)
+    report = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'commit': commit,
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'iterations': args.iterations,
+            'ml_latency_ms': args.ml_latency_ms,
+            'network_latency_ms': args.network_latency_ms,
+            'cassette': args.cassette
+        },
+        'results': results
+    }
+
+    for name, result in results.items():
+        print(
+            f"{name:45s} {result['throughput_per_s']:12.1f}/s  p50 {result['p50_ms']:9.3f}  "
+            f"p95 {result['p95_ms']:9.3f}  p99 {result['p99_ms']:9.3f} ms  peak {result['peak_memory_kb']:9.1f} KiB"
+        )
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit or datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    directory = os.path.dirname(output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(results, json.load(file)['results'], args.threshold)
+        if regressions:
+            print(f"Regressions over {args.threshold:.0%}: {', '.join(regressions)}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,275 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+import metrics
+
+class TTLCache:
+    """
+    In-process LRU cache with a per-entry time-to-live.
+
+    Entries older than `ttl` seconds are treated as missing, and the least
+    recently used entry is evicted once `max_size` is exceeded.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: Optional[float] = 3600):
+        self.max_size = max(1, max_size)
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, stored_at = entry
+                if self.ttl is None or time.time() - stored_at < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.evictions += 1
+            self.misses += 1
+            return default
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (value, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict:
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+class SQLiteCache:
+    """
+    On-disk key/value cache backed by SQLite, so entries survive restarts.
+
+    Values are stored as JSON. Entries older than `ttl` seconds are dropped on
+    read, and the least recently used entries are deleted once the table
+    grows past `max_size` rows.
+    """
+
+    def __init__(self, path: str, max_size: int = 10000, ttl: Optional[float] = None):
+        self.path = path
+        self.max_size = max(1, max_size)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "stored_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            try:
+                row = self._conn.execute(
+                    "SELECT value, stored_at FROM cache WHERE key = ?", (key,)
+                ).fetchone()
+                now = time.time()
+                if row is not None:
+                    value, stored_at = row
+                    if self.ttl is None or now - stored_at < self.ttl:
+                        self._conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+                        self._conn.commit()
+                        self.hits += 1
+                        return json.loads(value)
+                    self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                    self._conn.commit()
+                    self.evictions += 1
+            except sqlite3.Error as e:
+                print(f"Error reading cache {self.path}: {e}")
+            self.misses += 1
+            return default
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            try:
+                now = time.time()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, stored_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value), now, now)
+                )
+                overflow = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - self.max_size
+                if overflow > 0:
+                    self._conn.execute(
+                        "DELETE FROM cache WHERE key IN "
+                        "(SELECT key FROM cache ORDER BY accessed_at ASC LIMIT ?)",
+                        (overflow,)
+                    )
+                    self.evictions += overflow
+                self._conn.commit()
+            except sqlite3.Error as e:
+                print(f"Error writing cache {self.path}: {e}")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM cache")
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def stats(self) -> Dict:
+        return {
+            'size': len(self),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+class TieredCache:
+    """
+    Two-tier cache: an in-process TTLCache in front of an optional SQLiteCache.
+
+    Reads check memory first, then disk, promoting disk hits into memory.
+    Writes go to both tiers.
+    """
+
+    def __init__(self, memory: TTLCache, disk: Optional[SQLiteCache] = None):
+        self.memory = memory
+        self.disk = disk
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = self.memory.get(key)
+        if value is not None:
+            return value
+        if self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.set(key, value)
+                return value
+        return default
+
+    def set(self, key: str, value: Any) -> None:
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    def clear(self) -> None:
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self) -> Dict:
+        memory = self.memory.stats()
+        disk = self.disk.stats() if self.disk is not None else None
+        disk_hits = disk['hits'] if disk else 0
+        return {
+            'hits': memory['hits'] + disk_hits,
+            'misses': disk['misses'] if disk else memory['misses'],
+            'evictions': memory['evictions'] + (disk['evictions'] if disk else 0),
+            'memory': memory,
+            'disk': disk
+        }
+
+class ResponseCache:
+    """
+    Cache for HTTP GET responses with a freshness TTL, an LRU size bound, an
+    optional on-disk tier and ETag revalidation.
+
+    Entries younger than `ttl` seconds are served without a request. Older
+    entries that carry an ETag are revalidated by calling `fetch` with that
+    ETag; a 304 answer refreshes the entry instead of downloading it again.
+    """
+
+    def __init__(self, ttl: float = 3600, max_size: int = 512, path: Optional[str] = None, disk_max_size: int = 10000, name: str = 'response'):
+        self.ttl = ttl
+        self.name = name
+        disk = SQLiteCache(path, max_size=disk_max_size) if path else None
+        # Stale entries are kept (within the size bounds) so they can be revalidated
+        self.store = TieredCache(TTLCache(max_size=max_size, ttl=None), disk)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+        metrics.inc('cache_lookups_total', help_text='Cache lookups by cache and result', cache=self.name, result=name)
+
+    def get(self, key: str, fetch) -> Any:
+        """
+        Get a response body, calling fetch(etag) -> (status, body, etag) when
+        the cached copy is missing or stale.
+        """
+        entry, fresh = self._lookup(key)
+        if fresh:
+            return entry['body']
+        return self._update(key, entry, *fetch(entry.get('etag') if entry is not None else None))
+
+    async def get_async(self, key: str, fetch) -> Any:
+        """get() for coroutine fetchers: awaits fetch(etag) -> (status, body, etag)."""
+        entry, fresh = self._lookup(key)
+        if fresh:
+            return entry['body']
+        return self._update(key, entry, *await fetch(entry.get('etag') if entry is not None else None))
+
+    def _lookup(self, key: str):
+        entry = self.store.get(key)
+        if entry is not None and time.time() - entry['fetched_at'] < self.ttl:
+            self._count('hits')
+            return entry, True
+        return entry, False
+
+    def _update(self, key: str, entry: Optional[Dict], status: int, body: Any, etag: Optional[str]) -> Any:
+        now = time.time()
+        if status == 304 and entry is not None:
+            self._count('revalidated')
+            entry = dict(entry, fetched_at=now)
+        else:
+            self._count('misses')
+            entry = {'body': body, 'etag': etag, 'fetched_at': now}
+        self.store.set(key, entry)
+        return entry['body']
+
+    def clear(self) -> None:
+        self.store.clear()
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.revalidated + self.misses
+        return {
+            'hits': self.hits,
+            'revalidated': self.revalidated,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.revalidated) / lookups if lookups else 0.0,
+            'store': self.store.stats()
+        }
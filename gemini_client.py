@@ -0,0 +1,335 @@
+import asyncio
+import concurrent.futures
+import hashlib
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+import google.generativeai as genai
+from cache import SQLiteCache, TTLCache, TieredCache
+from transport import wrap_model
+
+class ModelPool:
+    """
+    Lazily created, thread-safe pool of Gemini GenerativeModel instances.
+
+    Models are only built when a caller needs one and no idle instance is
+    available, up to `size` instances. Callers beyond that wait for an idle
+    model instead of constructing a new one, so setup cost is paid at most
+    `size` times per process.
+    """
+
+    def __init__(self, model_name: str, generation_config: Optional[Dict] = None, size: Optional[int] = None):
+        self.model_name = model_name
+        self.generation_config = dict(generation_config or {})
+        self.size = max(1, size or int(os.getenv('GEMINI_POOL_SIZE', '4')))
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self.instantiations = 0
+
+    def _create(self):
+        model = genai.GenerativeModel(
+            model_name=self.model_name,
+            generation_config=self.generation_config or None
+        )
+        # Recorded or replayed when CASSETTE_MODE is set
+        return wrap_model(model, self.model_name, self.generation_config)
+
+    def acquire(self, timeout: Optional[float] = None):
+        """Take an idle model, building one if the pool is not yet full."""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            create = self.instantiations < self.size
+            if create:
+                self.instantiations += 1
+
+        if create:
+            try:
+                return self._create()
+            except Exception:
+                with self._lock:
+                    self.instantiations -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No idle {self.model_name} model available after {timeout} seconds")
+
+    def release(self, model) -> None:
+        """Return a model to the pool for reuse."""
+        self._idle.put(model)
+
+    @contextmanager
+    def model(self, timeout: Optional[float] = None):
+        """Context manager that borrows a model and always returns it."""
+        model = self.acquire(timeout)
+        try:
+            yield model
+        finally:
+            self.release(model)
+
+    def stats(self) -> Dict:
+        return {
+            'model_name': self.model_name,
+            'size': self.size,
+            'instantiations': self.instantiations,
+            'idle': self._idle.qsize()
+        }
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_model_pool(model_name: str, generation_config: Optional[Dict] = None, size: Optional[int] = None) -> ModelPool:
+    """
+    Get the process-wide pool for a model name and generation config.
+
+    The pool is created on first use and shared by every caller asking for
+    the same model and config afterwards.
+    """
+    key = (model_name, tuple(sorted((generation_config or {}).items())))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ModelPool(model_name, generation_config, size)
+            _pools[key] = pool
+        return pool
+
+def model_instantiations() -> int:
+    """Total number of GenerativeModel instances built in this process."""
+    with _pools_lock:
+        return sum(pool.instantiations for pool in _pools.values())
+
+_verdict_cache = None
+_verdict_cache_lock = threading.Lock()
+
+def verdict_key(text: str, model_name: str, prompt_version: str) -> str:
+    """
+    Cache key for a model verdict: a hash of the normalized text, model name
+    and prompt version, so case and whitespace differences share an entry.
+    """
+    normalized = ' '.join(text.lower().split())
+    return hashlib.sha256(f"{model_name}\x00{prompt_version}\x00{normalized}".encode('utf-8')).hexdigest()
+
+def get_verdict_cache() -> TieredCache:
+    """
+    Get the process-wide cache of model verdicts.
+
+    Both tiers expire entries after LLM_CACHE_TTL seconds. The memory tier
+    holds LLM_CACHE_SIZE entries and the disk tier LLM_CACHE_DISK_SIZE; the
+    disk tier lives at LLM_CACHE_PATH and is disabled when that is empty.
+    """
+    global _verdict_cache
+    with _verdict_cache_lock:
+        if _verdict_cache is None:
+            ttl = float(os.getenv('LLM_CACHE_TTL', '86400'))
+            path = os.getenv('LLM_CACHE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'llm_verdicts.sqlite3'))
+            disk = None
+            if path:
+                try:
+                    disk = SQLiteCache(path, max_size=int(os.getenv('LLM_CACHE_DISK_SIZE', '50000')), ttl=ttl)
+                except Exception as e:
+                    print(f"Error opening verdict cache {path}: {e}")
+            _verdict_cache = TieredCache(TTLCache(max_size=int(os.getenv('LLM_CACHE_SIZE', '1024')), ttl=ttl), disk)
+        return _verdict_cache
+
+class RequestCoalescer:
+    """
+    Asyncio front end that merges concurrent classification requests.
+
+    Texts arriving within `max_wait` seconds of each other are sent together
+    through `classify_batch`, identical in-flight texts share one request, and
+    at most `max_concurrency` batches run at once. `classify_batch` returns a
+    list aligned with its input; any None entry (or a batch that fails
+    outright) is retried with `classify_one`. Both callables are blocking and
+    run in worker threads.
+    """
+
+    def __init__(
+        self,
+        classify_batch: Callable[[List[str]], List[Optional[str]]],
+        classify_one: Callable[[str], str],
+        max_batch_size: int = 16,
+        max_wait: float = 0.005,
+        max_concurrency: int = 4,
+        key: Callable[[str], str] = lambda text: ' '.join(text.lower().split())
+    ):
+        self.classify_batch = classify_batch
+        self.classify_one = classify_one
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait
+        self.max_concurrency = max(1, max_concurrency)
+        self.key = key
+        self._pending = []
+        self._inflight = {}
+        self._timer = None
+        self._semaphore = None
+        self._loop = None
+        self._loop_lock = threading.Lock()
+        self.requests = 0
+        self.coalesced = 0
+        self.batches = 0
+        self.fallbacks = 0
+
+    async def classify(self, text: str) -> str:
+        """Classify one text, sharing the request with matching in-flight texts."""
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        self.requests += 1
+        key = self.key(text)
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+
+        future = loop.create_future()
+        self._inflight[key] = future
+        self._pending.append((key, text))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await asyncio.shield(future)
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.get_running_loop().create_task(self._run_batch(batch))
+
+    async def _run_batch(self, batch) -> None:
+        loop = asyncio.get_running_loop()
+        texts = [text for _, text in batch]
+        async with self._semaphore:
+            self.batches += 1
+            try:
+                labels = await loop.run_in_executor(None, self.classify_batch, texts)
+                if labels is None or len(labels) != len(texts):
+                    raise ValueError("Batched answer could not be parsed")
+            except Exception as e:
+                if len(texts) == 1:
+                    # A single-item batch is already a single call; don't repeat it
+                    labels = [e]
+                else:
+                    print(f"Batched classification failed, falling back to single calls: {e}")
+                    labels = [None] * len(texts)
+
+            retry = [i for i, label in enumerate(labels) if label is None]
+            self.fallbacks += len(retry)
+            results = await asyncio.gather(
+                *(loop.run_in_executor(None, self.classify_one, texts[i]) for i in retry),
+                return_exceptions=True
+            )
+            for i, result in zip(retry, results):
+                labels[i] = result
+
+        for (key, _), label in zip(batch, labels):
+            future = self._inflight.pop(key)
+            if isinstance(label, BaseException):
+                future.set_exception(label)
+            else:
+                future.set_result(label)
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name='request-coalescer', daemon=True).start()
+            return self._loop
+
+    def submit(self, text: str) -> concurrent.futures.Future:
+        """Schedule a classification from synchronous code and return its future."""
+        return asyncio.run_coroutine_threadsafe(self.classify(text), self._ensure_loop())
+
+    def classify_sync(self, text: str, timeout: Optional[float] = None) -> str:
+        """Blocking entry point for synchronous callers, run on a background loop."""
+        return self.submit(text).result(timeout)
+
+    def stats(self) -> Dict:
+        return {
+            'requests': self.requests,
+            'coalesced': self.coalesced,
+            'batches': self.batches,
+            'fallbacks': self.fallbacks,
+            'pending': len(self._pending),
+            'inflight': len(self._inflight)
+        }
+
+class CircuitBreaker:
+    """
+    Stops calling a failing upstream and probes it again later.
+
+    After `failure_threshold` consecutive failures the breaker opens and
+    allow() refuses calls for `reset_timeout` seconds. It then lets a single
+    probe through (half-open): a success closes the breaker, a failure opens
+    it again.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self.consecutive_failures = 0
+        self.trips = 0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        """Whether a call may go to the upstream right now."""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._state = self.HALF_OPEN
+            if self._state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._state = self.CLOSED
+            self._probing = False
+            self.consecutive_failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.consecutive_failures += 1
+            if self._state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self.trips += 1
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+    def stats(self) -> Dict:
+        return {
+            'state': self.state,
+            'consecutive_failures': self.consecutive_failures,
+            'trips': self.trips,
+            'rejected': self.rejected
+        }
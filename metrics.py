@@ -0,0 +1,242 @@
+"""
+Lightweight per-stage timing and counters, exported in Prometheus text format.
+
+Metrics are off unless METRICS_ENABLED is set; while off, timer() hands back a
+shared no-op context manager and inc() returns immediately, so instrumented
+code pays roughly one global lookup per call. When on, results can be scraped
+from a local endpoint (serve(), or METRICS_PORT via start_from_env()) or
+written to a file (write(), or METRICS_FILE at exit).
+
+METRICS_ENABLED and METRICS_FILE are read at import and again by
+start_from_env(), so settings loaded from .env after this module was
+imported still take effect.
+"""
+import atexit
+import bisect
+import functools
+import inspect
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+# Latency buckets in seconds, from in-process lookups up to slow API calls
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+STAGE_SECONDS = 'mood_stage_duration_seconds'
+STAGE_CALLS = 'mood_stage_calls_total'
+STAGE_ERRORS = 'mood_stage_errors_total'
+
+def _enabled_in_env() -> bool:
+    return os.getenv('METRICS_ENABLED', '').lower() in ('1', 'true', 'yes')
+
+_enabled = _enabled_in_env()
+_lock = threading.Lock()
+_families = {}
+_server = None
+_dump_path = None
+
+_HELP = {
+    STAGE_SECONDS: 'Time spent in each pipeline stage',
+    STAGE_CALLS: 'Calls to each pipeline stage',
+    STAGE_ERRORS: 'Calls to each pipeline stage that raised'
+}
+
+def enabled() -> bool:
+    return _enabled
+
+def enable() -> None:
+    global _enabled
+    _enabled = True
+
+def disable() -> None:
+    global _enabled
+    _enabled = False
+
+def reset() -> None:
+    """Forget every recorded value."""
+    with _lock:
+        _families.clear()
+
+def _family(name: str, kind: str, help_text: Optional[str]) -> Dict:
+    family = _families.get(name)
+    if family is None:
+        family = _families[name] = {'type': kind, 'help': help_text or _HELP.get(name, name), 'samples': {}}
+    return family
+
+def inc(name: str, amount: float = 1, help_text: Optional[str] = None, **labels) -> None:
+    """Add to a counter; a no-op while metrics are disabled."""
+    if not _enabled:
+        return
+    key = tuple(sorted(labels.items()))
+    with _lock:
+        samples = _family(name, 'counter', help_text)['samples']
+        samples[key] = samples.get(key, 0) + amount
+
+def observe(name: str, value: float, help_text: Optional[str] = None, buckets: Tuple[float, ...] = DEFAULT_BUCKETS, **labels) -> None:
+    """Record a value in a histogram; a no-op while metrics are disabled."""
+    if not _enabled:
+        return
+    key = tuple(sorted(labels.items()))
+    with _lock:
+        family = _family(name, 'histogram', help_text)
+        family.setdefault('buckets', buckets)
+        sample = family['samples'].get(key)
+        if sample is None:
+            sample = family['samples'][key] = [[0] * len(family['buckets']), 0.0, 0]
+        index = bisect.bisect_left(family['buckets'], value)
+        if index < len(family['buckets']):
+            sample[0][index] += 1
+        sample[1] += value
+        sample[2] += 1
+
+class _NoopTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NOOP_TIMER = _NoopTimer()
+
+class _StageTimer:
+    __slots__ = ('stage', 'started')
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe(STAGE_SECONDS, time.perf_counter() - self.started, stage=self.stage)
+        inc(STAGE_CALLS, stage=self.stage)
+        if exc_type is not None:
+            inc(STAGE_ERRORS, stage=self.stage)
+        return False
+
+def timer(stage: str):
+    """Context manager timing one pipeline stage, counting its calls and errors."""
+    return _StageTimer(stage) if _enabled else _NOOP_TIMER
+
+def timed(stage: str):
+    """Decorator form of timer(); coroutine functions are timed until they return."""
+    def decorate(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                if not _enabled:
+                    return await fn(*args, **kwargs)
+                with _StageTimer(stage):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _StageTimer(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def _labels(key: Tuple, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        for name in sorted(_families):
+            family = _families[name]
+            lines.append(f"# HELP {name} {family['help']}")
+            lines.append(f"# TYPE {name} {family['type']}")
+            for key in sorted(family['samples']):
+                sample = family['samples'][key]
+                if family['type'] == 'counter':
+                    lines.append(f'{name}{_labels(key)} {_number(sample)}')
+                    continue
+                counts, total, count = sample
+                cumulative = 0
+                for bound, bucket_count in zip(family['buckets'], counts):
+                    cumulative += bucket_count
+                    lines.append(f'{name}_bucket{_labels(key, ("le", _number(float(bound))))} {cumulative}')
+                lines.append(f'{name}_bucket{_labels(key, ("le", "+Inf"))} {count}')
+                lines.append(f'{name}_sum{_labels(key)} {_number(total)}')
+                lines.append(f'{name}_count{_labels(key)} {count}')
+    return '\n'.join(lines) + '\n'
+
+def write(path: str) -> None:
+    """Dump the current metrics to a file, replacing it atomically."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w') as file:
+        file.write(render())
+    os.replace(temporary, path)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def serve(port: int = 9464, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """Serve /metrics on a background thread; started once per process."""
+    global _server
+    with _lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name='metrics', daemon=True).start()
+        return _server
+
+def _dump_at_exit() -> None:
+    """Write the metrics to METRICS_FILE when the process exits; registered once."""
+    global _dump_path
+    path = os.getenv('METRICS_FILE')
+    with _lock:
+        if not path or _dump_path is not None:
+            return
+        _dump_path = path
+    atexit.register(write, path)
+
+def start_from_env() -> None:
+    """
+    Apply METRICS_ENABLED, METRICS_FILE and METRICS_PORT from the current
+    environment: enable metrics, dump them to the file at exit and serve
+    the endpoint on the port.
+    """
+    if _enabled_in_env():
+        enable()
+    if not _enabled:
+        return
+    _dump_at_exit()
+    port = os.getenv('METRICS_PORT')
+    if port:
+        try:
+            serve(int(port))
+        except OSError as e:
+            print(f"Error starting metrics endpoint on port {port}: {e}")
+
+if _enabled:
+    _dump_at_exit()
@@ -1,42 +1,95 @@
 import json
-from typing import List
+import os
+import threading
+import time
+from types import MappingProxyType
+from typing import List, Mapping, Tuple
 from pathlib import Path
+import metrics
 
+# Path to the JSON file in the same directory
+MOOD_GENRES_PATH = Path(__file__).parent / "mood_genres.json"
+
+# How often (seconds) the file's mtime is checked for hot reloading
+RELOAD_CHECK_INTERVAL = 2.0
+
+_mood_genres = MappingProxyType({})
+_loaded_mtime = None
+_checked_at = None
+_lock = threading.Lock()
+
+def _parse_mood_genres(data) -> Mapping[str, Tuple[str, ...]]:
+    """Check that the decoded JSON is a mapping of mood -> list of genre names, raising ValueError if not."""
+    if not isinstance(data, dict):
+        raise ValueError(f"expected an object of moods, got {type(data).__name__}")
+    for mood, genres in data.items():
+        if not isinstance(genres, list) or not all(isinstance(genre, str) for genre in genres):
+            raise ValueError(f"genres for {mood!r} must be a list of strings")
+    return MappingProxyType({mood.lower(): tuple(genres) for mood, genres in data.items()})
+
+def load_mood_genres() -> Mapping[str, Tuple[str, ...]]:
+    """
+    Get the shared, immutable mood-to-genre mapping.
+
+    The JSON file is read once and kept in memory as a read-only mapping of
+    mood -> tuple of genres. Its mtime is checked at most every
+    RELOAD_CHECK_INTERVAL seconds and the mapping is reloaded only when the
+    file has changed, so lookups normally never touch the filesystem.
+
+    Returns:
+        Mapping[str, Tuple[str, ...]]: The current mood-to-genre mapping
+    """
+    global _mood_genres, _loaded_mtime, _checked_at
+
+    now = time.monotonic()
+    if _checked_at is not None and now - _checked_at < RELOAD_CHECK_INTERVAL:
+        return _mood_genres
+
+    with _lock:
+        if _checked_at is not None and now - _checked_at < RELOAD_CHECK_INTERVAL:
+            return _mood_genres
+
+        try:
+            mtime = os.stat(MOOD_GENRES_PATH).st_mtime_ns
+            if mtime != _loaded_mtime:
+                with open(MOOD_GENRES_PATH, 'r') as file:
+                    data = json.load(file)
+                _mood_genres = _parse_mood_genres(data)
+                _loaded_mtime = mtime
+                metrics.inc('mood_genres_reloads_total', help_text='Loads of the mood-to-genre mapping')
+        except (FileNotFoundError, ValueError) as e:
+            # Keep serving the last good mapping; ValueError covers bad JSON and a bad shape
+            print(f"Error loading mood genres: {e}")
+
+        # Only mark the check done once the mapping is in place, so concurrent
+        # first callers wait on the lock instead of seeing an empty mapping
+        _checked_at = now
+        return _mood_genres
+
+@metrics.timed('genre_lookup')
 def get_genres_for_mood(mood: str) -> List[str]:
     """
     Maps a given mood to appropriate music genres based on the JSON mapping.
-    
+
     Args:
         mood (str): The mood to map to music genres
-        
+
     Returns:
         List[str]: A list of music genres that match the given mood
     """
-    # Get the path to the JSON file in the same directory
-    json_path = Path(__file__).parent / "mood_genres.json"
-    
-    try:
-        # Load the mood-to-genre mapping from JSON
-        with open(json_path, 'r') as file:
-            mood_to_genres = json.load(file)
-        
-        # Convert mood to lowercase for case-insensitive matching
-        mood = mood.lower()
-        
-        # Return matching genres or default to pop if mood not found
-        return mood_to_genres.get(mood, ["pop"])
-    
-    except (FileNotFoundError, json.JSONDecodeError) as e:
-        print(f"Error loading mood genres: {e}")
-        return ["pop"]
+    # Convert mood to lowercase for case-insensitive matching
+    genres = load_mood_genres().get(mood.lower())
+
+    # Return matching genres or default to pop if mood not found
+    return list(genres) if genres is not None else ["pop"]
 
 # Test cases
 if __name__ == "__main__":
     test_moods = ["happy", "sad", "angry", "unknown"]
-    
+
     print("Testing mood-to-genre mapping:")
     print("-" * 30)
-    
+
     for mood in test_moods:
         genres = get_genres_for_mood(mood)
         print(f"Mood: {mood}")
@@ -1,17 +1,596 @@
 import os
+import requests
 import spotipy
+from urllib3.exceptions import NewConnectionError
+from urllib3.util.retry import Retry
 from spotipy.oauth2 import SpotifyClientCredentials, SpotifyOAuth
-from typing import List, Dict, Optional
+from spotipy.cache_handler import CacheFileHandler, MemoryCacheHandler
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
 from dotenv import load_dotenv
 import time
 import webbrowser
 import json
+import threading
+import random
+import heapq
+import secrets
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import parse_qs, urlencode, urlparse
+import http.server
+from spotipy.exceptions import SpotifyException
+from cache import ResponseCache, SQLiteCache
+from mood_mapper import load_mood_genres
+from transport import wrap_session
+import metrics
+
+class PooledAdapter(requests.adapters.HTTPAdapter):
+    """HTTPAdapter that tracks in-flight requests so pool saturation can be reported."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.requests = 0
+
+    def send(self, *args, **kwargs):
+        with self._lock:
+            self.in_flight += 1
+            self.requests += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            return super().send(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_spotify_session() -> requests.Session:
+    """
+    Shared keep-alive session used by every Spotify client in the process.
+
+    Connections are pooled per host (SPOTIFY_POOL_SIZE, default 16) and reused
+    over HTTP/1.1; when the pool is exhausted callers wait for a free
+    connection instead of opening throwaway ones. Server errors on idempotent
+    requests are retried like spotipy's defaults; 429s are left to the
+    RequestScheduler.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            pool_size = int(os.getenv('SPOTIFY_POOL_SIZE', '16'))
+            retry = Retry(
+                total=3,
+                connect=None,
+                read=False,
+                # allowed_methods stays at urllib3's idempotent default: POSTs (playlist
+                # creation and writes) are never resent here, as that could duplicate them
+                status=3,
+                backoff_factor=0.3,
+                # 429s are left to the RequestScheduler so the whole process backs off;
+                # urllib3 would otherwise retry them itself whenever Retry-After is sent
+                status_forcelist=(500, 502, 503, 504),
+                respect_retry_after_header=False
+            )
+            adapter = PooledAdapter(
+                pool_connections=4,
+                pool_maxsize=pool_size,
+                pool_block=True,
+                max_retries=retry
+            )
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            # Recorded or replayed when CASSETTE_MODE is set
+            _session = wrap_session(session)
+        return _session
+
+def session_stats() -> Dict:
+    """Pool saturation and connection reuse for the shared Spotify session."""
+    adapter = get_spotify_session().get_adapter('https://')
+    connections = 0
+    pooled_requests = 0
+    idle = 0
+    for key in adapter.poolmanager.pools.keys():
+        pool = adapter.poolmanager.pools[key]
+        connections += pool.num_connections
+        pooled_requests += pool.num_requests
+        idle += sum(1 for conn in list(pool.pool.queue) if conn is not None)
+    return {
+        'pool_size': adapter._pool_maxsize,
+        'requests': adapter.requests,
+        'in_flight': adapter.in_flight,
+        'peak_in_flight': adapter.peak_in_flight,
+        'saturation': adapter.in_flight / adapter._pool_maxsize,
+        'connections_opened': connections,
+        'connections_reused': max(0, pooled_requests - connections),
+        'idle_connections': idle
+    }
+
+class RequestScheduler:
+    """
+    Token-bucket scheduler shared by every thread making Spotify API calls.
+    
+    Calls spend one token each from a bucket refilled at `rate` per second
+    (bursts up to `burst`). Interactive calls are served before background
+    prefetch calls. A 429 pauses the whole bucket for the Retry-After period
+    (plus jitter) before the call is retried, so threads don't hammer the API
+    in a retry storm.
+    """
+
+    INTERACTIVE = 0
+    BACKGROUND = 1
+
+    def __init__(self, rate: float = 10.0, burst: int = 20, max_retries: int = 4, base_delay: float = 0.5):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self._cond = threading.Condition()
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._waiting = [0, 0]
+        self.calls = 0
+        self.throttled = 0
+        self.delayed = 0
+        self.retries = 0
+        self.wait_time = 0.0
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, priority: int = INTERACTIVE) -> None:
+        """Block until a request may be sent at this priority."""
+        started = time.monotonic()
+        with self._cond:
+            self._waiting[priority] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    yielding = priority == self.BACKGROUND and self._waiting[self.INTERACTIVE] > 0
+                    if now >= self._paused_until and self._tokens >= 1 and not yielding:
+                        self._tokens -= 1
+                        break
+                    wait = max(self._paused_until - now, (1 - self._tokens) / self.rate, 0.01)
+                    self._cond.wait(wait)
+            finally:
+                self._waiting[priority] -= 1
+                self._cond.notify_all()
+            self.calls += 1
+            waited = time.monotonic() - started
+            if waited > 0.001:
+                self.delayed += 1
+                self.wait_time += waited
+
+    def pause(self, seconds: float) -> None:
+        """Stop all calls for `seconds` and drain the bucket, e.g. after a 429."""
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+            self._cond.notify_all()
+
+    def call(self, fn, *args, priority: int = INTERACTIVE, **kwargs):
+        """Run an API call under the rate limit, retrying 429s after Retry-After with jittered backoff."""
+        for attempt in range(self.max_retries + 1):
+            self.acquire(priority)
+            try:
+                return fn(*args, **kwargs)
+            except SpotifyException as e:
+                if e.http_status != 429 or attempt == self.max_retries:
+                    raise
+                with self._cond:
+                    self.throttled += 1
+                    self.retries += 1
+                metrics.inc('spotify_throttled_total', help_text='Spotify calls answered with 429')
+                retry_after = (e.headers or {}).get('Retry-After')
+                delay = float(retry_after) if retry_after else self.base_delay * 2 ** attempt
+                self.pause(delay + random.uniform(0, max(delay, self.base_delay) * 0.25))
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                'calls': self.calls,
+                'throttled': self.throttled,
+                'delayed': self.delayed,
+                'retries': self.retries,
+                'wait_time': self.wait_time,
+                'tokens': self._tokens,
+                'paused_for': max(0.0, self._paused_until - time.monotonic())
+            }
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_request_scheduler() -> RequestScheduler:
+    """
+    Process-wide Spotify request scheduler, so every connector and thread
+    shares one budget (SPOTIFY_RATE_LIMIT requests/second, bursts of
+    SPOTIFY_RATE_BURST).
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler(
+                rate=float(os.getenv('SPOTIFY_RATE_LIMIT', '10')),
+                burst=int(os.getenv('SPOTIFY_RATE_BURST', '20'))
+            )
+        return _scheduler
+
+# Per-host limits on in-flight Spotify requests, shared by every connector
+_host_slots = {}
+_host_slots_lock = threading.Lock()
+
+@contextmanager
+def host_slot(host: str, limit: int):
+    """Hold one of `limit` concurrent request slots for a host."""
+    with _host_slots_lock:
+        slots = _host_slots.get(host)
+        if slots is None:
+            slots = threading.BoundedSemaphore(limit)
+            _host_slots[host] = slots
+    with slots:
+        yield
+
+def request_not_sent(error: Exception) -> bool:
+    """Whether a request failed before reaching the server, so resending it cannot apply it twice."""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError) and error.args:
+        return isinstance(getattr(error.args[0], 'reason', None), NewConnectionError)
+    return False
+
+class TokenManager:
+    """
+    In-memory user token backed by the OAuth manager's on-disk token cache.
+    
+    get() answers from memory while the token is valid, and a background
+    timer refreshes it `refresh_margin` seconds before it expires, so
+    user-scoped calls never wait on token acquisition. It also works as a
+    spotipy auth_manager.
+    """
+
+    def __init__(self, oauth_manager: SpotifyOAuth, refresh_margin: float = 300):
+        self.oauth_manager = oauth_manager
+        self.refresh_margin = refresh_margin
+        self._token = None
+        self._lock = threading.Lock()
+        self._timer = None
+        self.refreshes = 0
+
+    def _fresh(self, token: Optional[Dict]) -> bool:
+        return bool(token) and token['expires_at'] - time.time() > 60
+
+    def get(self) -> Optional[Dict]:
+        """Return a valid token, loading it from disk or refreshing it only when needed."""
+        token = self._token
+        if self._fresh(token):
+            return token
+        with self._lock:
+            token = self._token or self.oauth_manager.cache_handler.get_cached_token()
+            if token and not self._fresh(token) and token.get('refresh_token'):
+                token = self.oauth_manager.refresh_access_token(token['refresh_token'])
+                self.refreshes += 1
+            if not self._fresh(token):
+                return None
+            self._store(token)
+            return token
+
+    def set(self, token: Dict) -> None:
+        """Adopt a newly issued token."""
+        with self._lock:
+            self._store(token)
+
+    def _store(self, token: Dict) -> None:
+        self._token = token
+        if self._timer is not None:
+            self._timer.cancel()
+        if token.get('refresh_token'):
+            delay = max(0.0, token['expires_at'] - time.time() - self.refresh_margin)
+            self._timer = threading.Timer(delay, self._refresh_in_background)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _refresh_in_background(self) -> None:
+        try:
+            with self._lock:
+                token = self.oauth_manager.refresh_access_token(self._token['refresh_token'])
+                self.refreshes += 1
+                self._store(token)
+        except Exception as e:
+            print(f"Error refreshing Spotify token: {e}")
+
+    def get_access_token(self, as_dict: bool = True):
+        """spotipy auth_manager interface."""
+        token = self.get()
+        if as_dict or not token:
+            return token
+        return token['access_token']
+
+def wait_for_authorization_code(redirect_uri: str, timeout: float, state: Optional[str] = None) -> Optional[str]:
+    """
+    Listen on the redirect URI for Spotify's callback and return the code as
+    soon as it arrives. Returns None if the port is unavailable or nothing
+    arrives within `timeout` seconds; raises if the user denied access.
+
+    Only requests to the redirect path carrying a code or an error, and the
+    `state` sent with the authorization request, end the wait; anything else
+    (a favicon fetch, a health probe, a forged callback) is refused.
+    """
+    parsed = urlparse(redirect_uri)
+    callback_path = parsed.path or '/'
+    result = {}
+
+    class CallbackHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            request = urlparse(self.path)
+            query = parse_qs(request.query)
+            code = query.get('code', [None])[0]
+            error = query.get('error', [None])[0]
+            if request.path != callback_path or not (code or error):
+                self.send_error(404)
+                return
+            if state is not None and query.get('state', [None])[0] != state:
+                self.send_error(400, 'State mismatch')
+                return
+            result['code'] = code
+            result['error'] = error
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            self.end_headers()
+            self.wfile.write(b"<html><body>Authorization complete. You can close this window.</body></html>")
+
+        def log_message(self, *args):
+            pass
+
+    try:
+        server = http.server.HTTPServer((parsed.hostname or '127.0.0.1', parsed.port or 80), CallbackHandler)
+    except OSError:
+        return None
+
+    deadline = time.monotonic() + timeout
+    try:
+        while not result and time.monotonic() < deadline:
+            server.timeout = max(0.1, deadline - time.monotonic())
+            server.handle_request()
+    finally:
+        server.server_close()
+
+    if result.get('error'):
+        raise Exception(result['error'])
+    return result.get('code')
+
+class Track(NamedTuple):
+    """Compact, hashable track record kept instead of the raw playlist-item JSON."""
+    uri: str
+    id: Optional[str]
+    name: str
+    artist_ids: Tuple[str, ...]
+    duration_ms: int
+    popularity: int
+
+    @classmethod
+    def from_item(cls, item: Dict) -> Optional['Track']:
+        """Build a record from a playlist item (or a bare track object); None if it has no playable track."""
+        track = item.get('track', item) if item else None
+        if not track or not track.get('uri') or item.get('is_local') or track.get('is_local'):
+            return None
+        return cls(
+            uri=track['uri'],
+            id=track.get('id'),
+            name=track.get('name') or '',
+            artist_ids=tuple(artist['id'] for artist in track.get('artists') or () if artist.get('id')),
+            duration_ms=track.get('duration_ms') or 0,
+            popularity=track.get('popularity') or 0
+        )
+
+def wants_next_page(page: Dict, tracks: int, limit: Optional[int]) -> bool:
+    """
+    Whether the page after `page` is needed to reach `limit` tracks. Checked
+    with the page's item count to prefetch, and again with the tracks
+    actually yielded, since local files and removed tracks are skipped.
+    """
+    return bool(page.get('next')) and (limit is None or tracks < limit)
+
+class TrackIndex:
+    """Insertion-ordered dedup index of tracks keyed by URI."""
 
-class SpotifyConnector:
     def __init__(self):
-        """Initialize Spotify connection using environment variables."""
+        self._tracks = {}
+
+    def add(self, track: Track) -> bool:
+        """Add a track unless its URI is already indexed. Returns True if it was new."""
+        if track.uri in self._tracks:
+            return False
+        self._tracks[track.uri] = track
+        return True
+
+    def update(self, tracks: Iterable[Track]) -> None:
+        for track in tracks:
+            self.add(track)
+
+    def uris(self) -> List[str]:
+        return list(self._tracks)
+
+    def __contains__(self, uri: str) -> bool:
+        return uri in self._tracks
+
+    def __iter__(self):
+        return iter(self._tracks.values())
+
+    def __len__(self) -> int:
+        return len(self._tracks)
+
+class PlaylistIndex:
+    """
+    Inverted index from mood keywords to the playlists whose name or
+    description contains them, built incrementally from search results.
+
+    Each playlist's text is matched against the keyword vocabulary when it is
+    indexed, so scoring a mood is a lookup per keyword instead of substring
+    checks over every result on every call. A playlist seen again replaces
+    its entry, and the least recently seen playlist is dropped once
+    `max_size` are indexed.
+    """
+
+    def __init__(self, mood_keywords: Dict[str, List[str]], max_size: int = 5000):
+        self.mood_keywords = {mood: tuple(keywords) for mood, keywords in mood_keywords.items()}
+        self.vocabulary = tuple(sorted({keyword for keywords in self.mood_keywords.values() for keyword in keywords}))
+        self.max_size = max(1, max_size)
+        self._postings = {keyword: set() for keyword in self.vocabulary}
+        # playlist id -> (first-seen order, playlist, matched keywords), least recently seen first
+        self._playlists = OrderedDict()
+        self._added = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def _unindex(self, playlist_id: str) -> Tuple[int, Dict, Tuple[str, ...]]:
+        entry = self._playlists.pop(playlist_id)
+        for keyword in entry[2]:
+            self._postings[keyword].discard(playlist_id)
+        return entry
+
+    def add(self, playlists: Iterable[Dict]) -> None:
+        """Index playlists, replacing earlier entries for the same ids with the latest data."""
+        for playlist in playlists:
+            playlist_id = playlist.get('id')
+            if not playlist_id:
+                continue
+            text = f"{playlist.get('name') or ''}\n{playlist.get('description') or ''}".lower()
+            matched = tuple(keyword for keyword in self.vocabulary if keyword in text)
+            with self._lock:
+                if playlist_id in self._playlists:
+                    order = self._unindex(playlist_id)[0]
+                else:
+                    order = self._added
+                    self._added += 1
+                self._playlists[playlist_id] = (order, playlist, matched)
+                for keyword in matched:
+                    self._postings[keyword].add(playlist_id)
+                while len(self._playlists) > self.max_size:
+                    self._unindex(next(iter(self._playlists)))
+                    self.evictions += 1
+
+    def scores(self, mood: str) -> Counter:
+        """Number of the mood's keywords each indexed playlist matches (zero scores omitted)."""
+        scores = Counter()
+        with self._lock:
+            for keyword in self.mood_keywords.get(mood, ()):
+                scores.update(self._postings[keyword])
+        return scores
+
+    def top(self, mood: str, k: int, playlist_ids: Optional[List[str]] = None) -> List[Dict]:
+        """
+        The k most relevant playlists for a mood, ties kept in their original
+        order. Ranks `playlist_ids` if given (unmatched ones score zero),
+        otherwise every indexed playlist that matches at least one keyword.
+        """
+        scores = self.scores(mood)
+        with self._lock:
+            if playlist_ids is None:
+                candidates = [(self._playlists[playlist_id][0], playlist_id) for playlist_id in scores]
+            else:
+                candidates = [(position, playlist_id) for position, playlist_id in enumerate(playlist_ids) if playlist_id in self._playlists]
+            best = heapq.nsmallest(k, candidates, key=lambda candidate: (-scores[candidate[1]], candidate[0]))
+            return [self._playlists[playlist_id][1] for _, playlist_id in best]
+
+    def __contains__(self, playlist_id: str) -> bool:
+        return playlist_id in self._playlists
+
+    def __len__(self) -> int:
+        return len(self._playlists)
+
+class CandidatePoolStore:
+    """
+    Per-mood pools of candidate tracks, kept in memory and optionally in a
+    SQLite file so they survive restarts. Tracks are stored as compact rows.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_age: float = 7200):
+        self.max_age = max_age
+        self._pools = {}
+        self._lock = threading.Lock()
+        self._disk = None
+        if path:
+            try:
+                self._disk = SQLiteCache(path, max_size=1000)
+            except Exception as e:
+                print(f"Error opening candidate pool store {path}: {e}")
+
+    def put(self, mood: str, tracks: Iterable[Track]) -> None:
+        entry = (time.time(), tuple(tracks))
+        with self._lock:
+            self._pools[mood] = entry
+        if self._disk is not None:
+            self._disk.set(f'pool:{mood}', {'built_at': entry[0], 'tracks': [list(track) for track in entry[1]]})
+
+    def get(self, mood: str) -> Optional[Tuple[Track, ...]]:
+        """The mood's pool if it is younger than max_age, else None."""
+        with self._lock:
+            entry = self._pools.get(mood)
+        if entry is None and self._disk is not None:
+            stored = self._disk.get(f'pool:{mood}')
+            if stored:
+                entry = (stored['built_at'], tuple(Track(row[0], row[1], row[2], tuple(row[3]), row[4], row[5]) for row in stored['tracks']))
+                with self._lock:
+                    self._pools[mood] = entry
+        if entry is None or time.time() - entry[0] > self.max_age or not entry[1]:
+            return None
+        return entry[1]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            now = time.time()
+            return {mood: {'tracks': len(tracks), 'age': now - built_at} for mood, (built_at, tracks) in self._pools.items()}
+
+class SpotifyConnector:
+    # Spotify accepts at most this many items per playlist write
+    MAX_ITEMS_PER_REQUEST = 100
+    
+    # Playlists found per genre and tracks taken from each when a playlist is built live
+    LIVE_PLAYLISTS_PER_GENRE = 5
+    LIVE_TRACKS_PER_PLAYLIST = 10
+    
+    # Largest page the playlist-items endpoint returns, and the only fields Track needs
+    PLAYLIST_PAGE_SIZE = 100
+    PLAYLIST_TRACK_FIELDS = 'next,items(is_local,track(uri,id,name,duration_ms,popularity,is_local,artists(id)))'
+
+    def __init__(self, max_workers: Optional[int] = None):
+        """
+        Initialize Spotify connection using environment variables.
+
+        Args:
+            max_workers: Threads used to fan out search and track requests
+                (SPOTIFY_MAX_WORKERS, default 8); 1 runs them serially
+        """
         load_dotenv()
         
+        self.max_workers = max(1, max_workers or int(os.getenv('SPOTIFY_MAX_WORKERS', '8')))
+        self.max_connections_per_host = int(os.getenv('SPOTIFY_MAX_CONNECTIONS_PER_HOST', '8'))
+        self.max_write_concurrency = int(os.getenv('SPOTIFY_WRITE_CONCURRENCY', '1'))
+        # Tracks per mood playlist; unset, a warm pool gives as many as a live search could
+        self.playlist_size = int(os.getenv('SPOTIFY_PLAYLIST_SIZE', '0')) or None
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='spotify')
+        # Separate pool for next-page prefetches so fan-out workers never wait on their own queue
+        self._prefetch_executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='spotify-prefetch')
+        
+        # Optional market for searches and playlist lookups, part of every cache key
+        self.market = os.getenv('SPOTIFY_MARKET') or None
+        
+        # Cache for search and playlist-track responses; set SPOTIFY_CACHE_PATH for a disk tier
+        self.response_cache = ResponseCache(
+            ttl=float(os.getenv('SPOTIFY_CACHE_TTL', '3600')),
+            max_size=int(os.getenv('SPOTIFY_CACHE_SIZE', '512')),
+            path=os.getenv('SPOTIFY_CACHE_PATH') or None,
+            name='spotify'
+        )
+        
         # Get Spotify credentials from environment variables
         client_id = os.getenv('SPOTIFY_CLIENT_ID')
         client_secret = os.getenv('SPOTIFY_CLIENT_SECRET')
@@ -24,15 +603,20 @@ class SpotifyConnector:
             )
         
         try:
+            # Shared keep-alive session, also used directly for cached GETs
+            self.session = get_spotify_session()
+            
             # Initialize Spotify client with client credentials for searching
-            auth_manager = SpotifyClientCredentials(
+            self.auth_manager = SpotifyClientCredentials(
                 client_id=client_id,
-                client_secret=client_secret
+                client_secret=client_secret,
+                cache_handler=MemoryCacheHandler(),
+                requests_session=self.session
             )
             self.sp = spotipy.Spotify(
-                auth_manager=auth_manager,
-                requests_timeout=10,
-                retries=3
+                auth_manager=self.auth_manager,
+                requests_session=self.session,
+                requests_timeout=10
             )
             
             # Initialize OAuth for user-specific operations
@@ -47,12 +631,42 @@ class SpotifyConnector:
                     'user-read-private',
                     'user-read-email'
                 ]),
-                show_dialog=True
+                show_dialog=True,
+                cache_handler=self._token_cache_handler(),
+                requests_session=get_spotify_session()
             )
             
-            # Load mood-genre mapping
-            with open('mood_genres.json', 'r') as f:
-                self.mood_genres = json.load(f)
+            # Shared rate-limit budget for every API call
+            self.scheduler = get_request_scheduler()
+            
+            # Warm per-mood candidate pools, filled by start_warmer()
+            self.candidate_pools = CandidatePoolStore(
+                path=os.getenv('SPOTIFY_POOL_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'mood_pools.sqlite3')) or None,
+                max_age=float(os.getenv('SPOTIFY_POOL_MAX_AGE', '7200'))
+            )
+            self._warmer = None
+            self._warmer_stop = threading.Event()
+            
+            # In-memory token with background refresh for user-scoped calls
+            self.token_manager = TokenManager(self.oauth_manager)
+            self.auth_timeout = float(os.getenv('SPOTIFY_AUTH_TIMEOUT', '120'))
+            
+            # User-scoped client for playlist writes, sharing the same connection pool
+            self.sp_user = spotipy.Spotify(
+                auth_manager=self.token_manager,
+                requests_session=get_spotify_session(),
+                requests_timeout=10
+            )
+            
+            # Alternative Web API and accounts hosts, e.g. the local stand-in in spotify_stub_server.py
+            api_url = os.getenv('SPOTIFY_API_URL')
+            if api_url:
+                self.sp.prefix = self.sp_user.prefix = api_url.rstrip('/') + '/'
+            accounts_url = os.getenv('SPOTIFY_ACCOUNTS_URL')
+            if accounts_url:
+                for manager in (self.auth_manager, self.oauth_manager):
+                    manager.OAUTH_TOKEN_URL = accounts_url.rstrip('/') + '/api/token'
+                    manager.OAUTH_AUTHORIZE_URL = accounts_url.rstrip('/') + '/authorize'
             
             # Mood-specific keywords for playlist filtering
             self.mood_keywords = {
@@ -66,6 +680,9 @@ class SpotifyConnector:
                 'neutral': ['background', 'study', 'work', 'focus', 'chill']
             }
             
+            # Mood relevance index over every playlist seen in search results
+            self.playlist_index = PlaylistIndex(self.mood_keywords, max_size=int(os.getenv('SPOTIFY_INDEX_SIZE', '5000')))
+            
             # Store created playlists for cleanup
             self.created_playlists = []
             
@@ -75,27 +692,126 @@ class SpotifyConnector:
                 "Please verify your credentials and internet connection."
             )
 
+    @property
+    def mood_genres(self):
+        """Shared mood-genre mapping from mood_mapper, reloaded when the file changes."""
+        return load_mood_genres()
+
+    @staticmethod
+    def _token_cache_handler():
+        """
+        Where the user token is persisted between runs: SPOTIFY_TOKEN_CACHE_PATH,
+        by default inside the .cache directory (which shadows spotipy's default
+        .cache file). An empty value keeps the token in memory only.
+        """
+        path = os.getenv('SPOTIFY_TOKEN_CACHE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'spotify_token.json'))
+        if not path:
+            return MemoryCacheHandler()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        return CacheFileHandler(cache_path=path)
+
+    def _fan_out(self, fn, items: List) -> List:
+        """
+        Run fn over items on the worker pool, with at most
+        max_connections_per_host requests in flight per host.
+        Results are returned in the same order as items.
+        """
+        if self.max_workers <= 1 or len(items) <= 1:
+            return [fn(item) for item in items]
+
+        host = urlparse(self.sp.prefix).netloc
+
+        def run(item):
+            with host_slot(host, self.max_connections_per_host):
+                return fn(item)
+
+        return list(self._executor.map(run, items))
+
+    def _get_json(
+        self,
+        url: str,
+        params: Optional[Dict] = None,
+        etag: Optional[str] = None,
+        priority: int = RequestScheduler.INTERACTIVE
+    ):
+        """
+        GET a Web API resource through the shared session with a
+        client-credentials token, scheduled under the shared rate limit.
+        
+        Returns:
+            (status, body, etag) where status 304 means the ETag still matches
+        """
+        if not url.startswith('http'):
+            url = self.sp.prefix + url
+
+        def fetch():
+            # Renews the token through the auth manager if it has expired
+            headers = {'Authorization': f'Bearer {self.auth_manager.get_access_token(as_dict=False)}'}
+            if etag:
+                headers['If-None-Match'] = etag
+            response = self.session.get(
+                url,
+                params=params,
+                headers=headers,
+                timeout=self.sp.requests_timeout
+            )
+            if response.status_code >= 400:
+                raise SpotifyException(
+                    response.status_code,
+                    -1,
+                    f"{response.url}:\n {response.text}",
+                    headers=response.headers
+                )
+            return response
+
+        response = self.scheduler.call(fetch, priority=priority)
+        if response.status_code == 304:
+            return 304, None, etag
+        return response.status_code, response.json(), response.headers.get('ETag')
+
+    def _cached_get(
+        self,
+        url: str,
+        params: Optional[Dict] = None,
+        priority: int = RequestScheduler.INTERACTIVE
+    ) -> Dict:
+        """GET a Web API resource through the response cache, keyed by URL and query (including market)."""
+        params = {key: value for key, value in (params or {}).items() if value is not None}
+        key = url + '?' + urlencode(sorted(params.items()))
+        return self.response_cache.get(key, lambda etag: self._get_json(url, params, etag, priority))
+
+    def cache_stats(self) -> Dict:
+        """Hit, revalidation and miss counts for cached search and playlist lookups."""
+        return self.response_cache.stats()
+
     def get_user_token(self):
-        """Get user token with proper error handling and retry mechanism."""
+        """
+        Get user token with proper error handling and retry mechanism.
+        
+        A valid token is returned straight from memory. The first time, the
+        authorization page is opened and a local listener on the redirect URI
+        finishes authorization as soon as the callback arrives.
+        """
         max_retries = 3
         retry_delay = 2  # seconds
         
         for attempt in range(max_retries):
             try:
-                token_info = self.oauth_manager.get_access_token()
+                token_info = self.token_manager.get()
                 if not token_info:
                     # If no token exists, get a new one
-                    auth_url = self.oauth_manager.get_authorize_url()
+                    state = secrets.token_urlsafe(16)
+                    auth_url = self.oauth_manager.get_authorize_url(state=state)
                     print(f"\nPlease authorize the application by visiting this URL:")
                     print(auth_url)
                     print("\nAfter authorization, you will be redirected to the callback URL.")
                     webbrowser.open(auth_url)
                     
-                    # Wait for the user to complete authorization
+                    # Wait for the redirect, or for another process to store a token
                     print("\nWaiting for authorization...")
-                    time.sleep(10)  # Give user time to complete authorization
-                    
-                    token_info = self.oauth_manager.get_access_token()
+                    token_info = self._wait_for_token(state)
                     if not token_info:
                         raise Exception("Authorization failed or was denied")
                 
@@ -113,11 +829,50 @@ class SpotifyConnector:
                 else:
                     raise e
 
+    def _wait_for_token(self, state: Optional[str] = None) -> Optional[Dict]:
+        """Complete authorization from the local callback, falling back to polling the token cache."""
+        code = wait_for_authorization_code(self.oauth_manager.redirect_uri, self.auth_timeout, state)
+        if code:
+            token_info = self.oauth_manager.get_access_token(code, check_cache=False)
+            self.token_manager.set(token_info)
+            return token_info
+        
+        # The redirect port is taken (e.g. by Streamlit); wait for the token to be cached
+        deadline = time.monotonic() + self.auth_timeout
+        while time.monotonic() < deadline:
+            token_info = self.token_manager.get()
+            if token_info:
+                return token_info
+            time.sleep(0.5)
+        return None
+
+    def _search_params(self, genre: str) -> Dict:
+        return {
+            'q': f'genre:"{genre}"',
+            'type': 'playlist',
+            'limit': 50,  # Get more results to filter
+            'market': self.market
+        }
+
+    def _rank_search_results(self, results: Dict, limit: int, mood: Optional[str]) -> List[Dict]:
+        """Index a search response's playlists and return the `limit` most relevant to the mood."""
+        # Search results can contain nulls for removed playlists
+        playlists = [playlist for playlist in results['playlists']['items'] if playlist]
+        self.playlist_index.add(playlists)
+        
+        # Rank playlists by mood relevance from the index
+        if mood and mood in self.mood_keywords:
+            return self.playlist_index.top(mood, limit, [playlist['id'] for playlist in playlists])
+        
+        return playlists[:limit]
+
+    @metrics.timed('spotify_search')
     def search_playlists_by_genre(
         self, 
         genre: str, 
         limit: int = 5,
-        mood: Optional[str] = None
+        mood: Optional[str] = None,
+        priority: int = RequestScheduler.INTERACTIVE
     ) -> List[Dict]:
         """
         Search for playlists by genre with mood-specific filtering.
@@ -126,49 +881,28 @@ class SpotifyConnector:
             genre: The genre to search for
             limit: Maximum number of playlists to return
             mood: Optional mood to filter playlists by relevance
+            priority: Scheduler priority; use BACKGROUND for prefetching
             
         Returns:
             List of playlist dictionaries with mood relevance scores
         """
         try:
             # Search for playlists with the genre
-            results = self.sp.search(
-                q=f'genre:"{genre}"',
-                type='playlist',
-                limit=50  # Get more results to filter
-            )
-            
-            playlists = results['playlists']['items']
-            
-            # Filter and rank playlists based on mood relevance
-            if mood and mood in self.mood_keywords:
-                ranked_playlists = []
-                keywords = self.mood_keywords[mood]
-                
-                for playlist in playlists:
-                    # Calculate relevance score based on name and description
-                    name = playlist['name'].lower()
-                    description = playlist.get('description', '').lower()
-                    
-                    # Count keyword matches
-                    score = sum(1 for keyword in keywords if keyword in name or keyword in description)
-                    
-                    # Add playlist with score
-                    ranked_playlists.append({
-                        'playlist': playlist,
-                        'score': score
-                    })
-                
-                # Sort by relevance score
-                ranked_playlists.sort(key=lambda x: x['score'], reverse=True)
-                playlists = [item['playlist'] for item in ranked_playlists]
-            
-            return playlists[:limit]
+            results = self._cached_get('search', self._search_params(genre), priority=priority)
+            return self._rank_search_results(results, limit, mood)
             
         except Exception as e:
             print(f"Error searching playlists: {str(e)}")
             return []
 
+    def best_playlists_for_mood(self, mood: str, limit: int = 5) -> List[Dict]:
+        """
+        The most relevant playlists for a mood among those already indexed,
+        without making a search call. Empty until searches have warmed the index.
+        """
+        return self.playlist_index.top(mood, limit)
+
+    @metrics.timed('create_playlist')
     def create_mood_playlist(
         self, 
         mood: str,
@@ -199,30 +933,36 @@ class SpotifyConnector:
                 return None
             
             # Create playlist
-            user_id = self.sp.current_user()['id']
+            user_id = self.scheduler.call(self.sp_user.current_user)['id']
             playlist_name = playlist_name or f"{mood.capitalize()} Mood Playlist"
             playlist_description = playlist_description or f"Songs to match your {mood} mood"
             
-            playlist = self.sp.user_playlist_create(
+            playlist = self.scheduler.call(
+                self.sp_user.user_playlist_create,
                 user_id,
                 playlist_name,
                 public=True,
                 description=playlist_description
             )
             
-            # Search for playlists in each genre
-            all_tracks = set()
-            for genre in genres:
-                playlists = self.search_playlists_by_genre(genre, mood=mood)
-                
-                for playlist in playlists:
-                    tracks = self.get_playlist_tracks(playlist['id'])
-                    all_tracks.update(tracks)
+            # Sample from the warm pool if there is one, otherwise search live
+            pool = self.candidate_pools.get(mood)
+            if pool:
+                track_uris = [track.uri for track in random.sample(pool, min(len(pool), self.warm_sample_size(genres)))]
+            else:
+                track_uris = self.collect_mood_tracks(mood, genres).uris()[:self.playlist_size]
             
-            # Add tracks to the playlist
-            if all_tracks:
-                track_uris = [track['uri'] for track in all_tracks]
-                self.sp.playlist_add_items(playlist['id'], track_uris)
+            # Add tracks to the playlist in API-sized chunks
+            playlist['tracks_added'] = 0
+            if track_uris:
+                result = self.add_tracks_to_playlist(
+                    playlist['id'],
+                    track_uris,
+                    max_concurrency=self.max_write_concurrency
+                )
+                playlist['tracks_added'] = result['added']
+                if result['snapshot_id']:
+                    playlist['snapshot_id'] = result['snapshot_id']
             
             # Store playlist for cleanup
             self.created_playlists.append(playlist['id'])
@@ -233,28 +973,213 @@ class SpotifyConnector:
             print(f"Error creating mood playlist: {str(e)}")
             return None
 
-    def get_playlist_tracks(self, playlist_id: str, limit: int = 10) -> List[Dict]:
+    def warm_sample_size(self, genres: Iterable[str]) -> int:
+        """
+        Tracks to sample from a warm pool for a playlist of these genres:
+        playlist_size if set, otherwise the most a live search could add, so
+        the playlist is the same size whether or not the pool was warm.
+        """
+        return self.playlist_size or len(list(genres)) * self.LIVE_PLAYLISTS_PER_GENRE * self.LIVE_TRACKS_PER_PLAYLIST
+
+    def collect_mood_tracks(
+        self,
+        mood: str,
+        genres: Iterable[str],
+        tracks_per_playlist: int = LIVE_TRACKS_PER_PLAYLIST,
+        priority: int = RequestScheduler.INTERACTIVE
+    ) -> TrackIndex:
+        """
+        Search every genre concurrently, then fetch all found playlists' tracks
+        concurrently, deduplicated by URI in first-seen order.
+        """
+        all_tracks = TrackIndex()
+        searches = self._fan_out(
+            lambda genre: self.search_playlists_by_genre(genre, limit=self.LIVE_PLAYLISTS_PER_GENRE, mood=mood, priority=priority),
+            list(genres)
+        )
+        playlist_ids = [found['id'] for playlists in searches for found in playlists]
+        for tracks in self._fan_out(
+            lambda playlist_id: self.get_playlist_tracks(playlist_id, limit=tracks_per_playlist, priority=priority),
+            playlist_ids
+        ):
+            all_tracks.update(tracks)
+        return all_tracks
+
+    def warm_mood_pool(self, mood: str, tracks_per_playlist: int = 50) -> int:
+        """Rebuild one mood's candidate pool with background-priority requests. Returns its size."""
+        genres = self.mood_genres.get(mood, [])
+        tracks = list(self.collect_mood_tracks(mood, genres, tracks_per_playlist, RequestScheduler.BACKGROUND))
+        if tracks:
+            self.candidate_pools.put(mood, tracks)
+        return len(tracks)
+
+    def start_warmer(self, interval: Optional[float] = None) -> None:
+        """
+        Start a background thread that rebuilds every mood's candidate pool
+        now and then every `interval` seconds (SPOTIFY_POOL_REFRESH, default 3600).
+        """
+        if self._warmer is not None and self._warmer.is_alive():
+            return
+        interval = interval or float(os.getenv('SPOTIFY_POOL_REFRESH', '3600'))
+        self._warmer_stop.clear()
+
+        def run():
+            while not self._warmer_stop.is_set():
+                for mood in list(self.mood_genres):
+                    if self._warmer_stop.is_set():
+                        break
+                    try:
+                        self.warm_mood_pool(mood)
+                    except Exception as e:
+                        print(f"Error warming {mood} pool: {str(e)}")
+                self._warmer_stop.wait(interval)
+
+        self._warmer = threading.Thread(target=run, name='mood-pool-warmer', daemon=True)
+        self._warmer.start()
+
+    def stop_warmer(self) -> None:
+        self._warmer_stop.set()
+
+    def _add_chunk(self, playlist_id: str, uris: List[str], max_retries: int) -> str:
+        """
+        Add one chunk of tracks, retrying connections that never went out.
+        Returns the snapshot id. 429s are retried by the scheduler, which
+        pauses every caller, not here.
+        """
+        delay = 1.0
+        for attempt in range(max_retries + 1):
+            try:
+                return self.scheduler.call(self.sp_user.playlist_add_items, playlist_id, uris)['snapshot_id']
+            except Exception as e:
+                # Writes aren't idempotent: a timeout or a 5xx (e.g. a gateway's
+                # 502/504) may arrive after the tracks were added, and resending
+                # would duplicate them. Only a request that never went out is safe.
+                if not request_not_sent(e) or attempt == max_retries:
+                    raise
+                time.sleep(delay)
+                delay *= 2
+
+    @metrics.timed('playlist_write')
+    def add_tracks_to_playlist(
+        self,
+        playlist_id: str,
+        track_uris: List[str],
+        max_concurrency: int = 1,
+        max_retries: int = 3
+    ) -> Dict:
         """
-        Get tracks from a playlist with mood relevance filtering.
+        Add tracks to a playlist in chunks of at most MAX_ITEMS_PER_REQUEST.
+        
+        With max_concurrency=1 chunks are appended one after another, each
+        retried in place before the next is sent, so the playlist keeps the
+        order of track_uris. Higher values send chunks in parallel for speed,
+        in which case chunks may land in any order. Only failed chunks are retried.
         
         Args:
             playlist_id: The Spotify playlist ID
-            limit: Maximum number of tracks to return
+            track_uris: Track URIs to add
+            max_concurrency: Maximum number of chunk requests in flight
+            max_retries: Retries per chunk for connections that never went out; 429s are retried by the scheduler
             
         Returns:
-            List of track dictionaries
+            Dictionary with the number of tracks added and failed, the number
+            of write requests, and the latest snapshot id
         """
-        try:
-            results = self.sp.playlist_tracks(playlist_id)
-            tracks = results['items']
-            
-            # Get more tracks if available
-            while results['next'] and len(tracks) < limit:
-                results = self.sp.next(results)
-                tracks.extend(results['items'])
+        chunks = [
+            track_uris[i:i + self.MAX_ITEMS_PER_REQUEST]
+            for i in range(0, len(track_uris), self.MAX_ITEMS_PER_REQUEST)
+        ]
+        slots = threading.BoundedSemaphore(max(1, max_concurrency))
+
+        def add(chunk):
+            with slots:
+                try:
+                    return self._add_chunk(playlist_id, chunk, max_retries)
+                except Exception as e:
+                    print(f"Error adding {len(chunk)} tracks to playlist: {str(e)}")
+                    return None
+
+        if max_concurrency <= 1:
+            snapshots = [add(chunk) for chunk in chunks]
+        else:
+            snapshots = self._fan_out(add, chunks)
+
+        added = sum(len(chunk) for chunk, snapshot in zip(chunks, snapshots) if snapshot)
+        successful = [snapshot for snapshot in snapshots if snapshot]
+        return {
+            'added': added,
+            'failed': len(track_uris) - added,
+            'requests': len(chunks),
+            'snapshot_id': successful[-1] if successful else None
+        }
+
+    def iter_playlist_tracks(
+        self,
+        playlist_id: str,
+        limit: Optional[int] = None,
+        priority: int = RequestScheduler.INTERACTIVE
+    ) -> Iterator[Track]:
+        """
+        Stream a playlist's tracks page by page as compact Track records.
+        
+        Only the fields a Track needs are requested, and the next page is
+        fetched in the background while the caller works through the current
+        one. Paging stops as soon as `limit` tracks have been yielded or the
+        caller stops iterating. Local files and removed tracks are skipped.
+        
+        Args:
+            playlist_id: The Spotify playlist ID
+            limit: Maximum number of tracks to yield; None for the whole playlist
+            priority: Scheduler priority; use BACKGROUND for prefetching
             
-            return tracks[:limit]
+        Yields:
+            Track records in playlist order
+        """
+        page_size = min(self.PLAYLIST_PAGE_SIZE, limit) if limit else self.PLAYLIST_PAGE_SIZE
+        params = {'market': self.market, 'fields': self.PLAYLIST_TRACK_FIELDS, 'limit': page_size}
+        page = self._cached_get(f'playlists/{playlist_id}/tracks', params, priority)
+        upcoming = None
+        yielded = 0
+        try:
+            while page is not None:
+                if wants_next_page(page, yielded + len(page['items']), limit):
+                    upcoming = self._prefetch_executor.submit(self._cached_get, page['next'], None, priority)
+                for item in page['items']:
+                    track = Track.from_item(item)
+                    if track:
+                        yield track
+                        yielded += 1
+                        if limit is not None and yielded >= limit:
+                            return
+                if upcoming is None and wants_next_page(page, yielded, limit):
+                    # Skipped items left the page short of the limit
+                    page = self._cached_get(page['next'], None, priority)
+                else:
+                    page, upcoming = (upcoming.result() if upcoming else None), None
+        finally:
+            if upcoming is not None:
+                upcoming.cancel()
+
+    @metrics.timed('track_fetch')
+    def get_playlist_tracks(
+        self,
+        playlist_id: str,
+        limit: int = 10,
+        priority: int = RequestScheduler.INTERACTIVE
+    ) -> List[Track]:
+        """
+        Get up to `limit` tracks from a playlist as compact Track records.
+        
+        Args:
+            playlist_id: The Spotify playlist ID
+            limit: Maximum number of tracks to return
+            priority: Scheduler priority; use BACKGROUND for prefetching
             
+        Returns:
+            List of Track records
+        """
+        try:
+            return list(self.iter_playlist_tracks(playlist_id, limit, priority))
         except Exception as e:
             print(f"Error getting playlist tracks: {str(e)}")
             return []
@@ -271,15 +1196,12 @@ class SpotifyConnector:
         """
         try:
             # Get user token
-            token_info = self.oauth_manager.get_access_token()
+            token_info = self.get_user_token()
             if not token_info:
                 raise Exception("Failed to get access token")
             
-            # Create Spotify client with user token
-            sp_user = spotipy.Spotify(auth=token_info['access_token'])
-            
-            # Unfollow (delete) the playlist
-            sp_user.current_user_unfollow_playlist(playlist_id)
+            # Unfollow (delete) the playlist with the shared user client
+            self.scheduler.call(self.sp_user.current_user_unfollow_playlist, playlist_id)
             
             # Remove from created_playlists if it exists
             if playlist_id in self.created_playlists:
@@ -316,7 +1238,7 @@ class SpotifyConnector:
             Optional[str]: Preview URL if available, None otherwise
         """
         try:
-            track = self.sp.track(track_id)
+            track = self.scheduler.call(self.sp.track, track_id)
             return track.get('preview_url')
         except Exception as e:
             print(f"Error getting track preview: {e}")
@@ -351,7 +1273,7 @@ if __name__ == "__main__":
                         print("\nFetching tracks...")
                         tracks = connector.get_playlist_tracks(playlist['id'], limit=3)
                         for track in tracks:
-                            print(f"- {track['name']} by {', '.join(track['artists'])}")
+                            print(f"- {track.name}")
             else:
                 print("No playlists found!")
     
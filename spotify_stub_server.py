@@ -0,0 +1,437 @@
+"""
+Local stand-in for the Spotify Web API, for offline and load testing.
+
+Serves the endpoints SpotifyConnector uses (search, playlist tracks, current
+user, playlist creation, playlist writes, unfollow, single track and the
+accounts token/authorize endpoints) over a synthetic catalog generated on
+the fly. Latency, pagination, 429 throttling with Retry-After and the
+100-item write cap behave like the real service.
+
+Point a connector at it with:
+    SPOTIFY_API_URL=http://127.0.0.1:8800/v1/
+    SPOTIFY_ACCOUNTS_URL=http://127.0.0.1:8800
+
+Usage:
+    python spotify_stub_server.py [--port 8800] [--latency-ms 50] [--rate-limit 30]
+    python spotify_stub_server.py --load-test 200 --concurrency 16
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlencode, urlparse
+
+# Spotify's limit on items per playlist write
+MAX_ITEMS_PER_WRITE = 100
+
+PLAYLIST_THEMES = [
+    'Happy Hits', 'Chill Vibes', 'Sad Songs', 'Party Anthems', 'Deep Focus',
+    'Throwback Classics', 'Love Songs', 'Calm Evening', 'Upbeat Morning', 'Heartbreak'
+]
+
+class SyntheticCatalog:
+    """
+    Deterministic catalog of `tracks` tracks and `playlists_per_genre`
+    playlists per searched genre, each with `tracks_per_playlist` tracks.
+    Nothing is stored per track; records are generated from their ids.
+    """
+
+    def __init__(self, tracks: int = 100000, playlists_per_genre: int = 50, tracks_per_playlist: int = 200):
+        self.tracks = max(1, tracks)
+        self.playlists_per_genre = playlists_per_genre
+        self.tracks_per_playlist = tracks_per_playlist
+        self._playlists = {}
+        self._lock = threading.Lock()
+
+    def track(self, number: int) -> Dict:
+        track_id = f't{number:09d}'
+        return {
+            'id': track_id,
+            'uri': f'spotify:track:{track_id}',
+            'name': f'Track {number}',
+            'artists': [{'id': f'a{number % 5000:06d}', 'name': f'Artist {number % 5000}'}],
+            'duration_ms': 150000 + number % 120000,
+            'popularity': number % 100,
+            'preview_url': None,
+            'is_local': False
+        }
+
+    def track_by_id(self, track_id: str) -> Optional[Dict]:
+        if not (track_id.startswith('t') and track_id[1:].isdigit()):
+            return None
+        number = int(track_id[1:])
+        return self.track(number) if number < self.tracks else None
+
+    def playlist(self, genre: str, index: int) -> Dict:
+        playlist_id = f'p{zlib.crc32(f"{genre}:{index}".encode()):08x}{index:04d}'
+        with self._lock:
+            self._playlists[playlist_id] = self.tracks_per_playlist
+        theme = PLAYLIST_THEMES[index % len(PLAYLIST_THEMES)]
+        return {
+            'id': playlist_id,
+            'uri': f'spotify:playlist:{playlist_id}',
+            'name': f'{genre.title()} {theme}',
+            'description': f'{theme.lower()} for {genre} fans',
+            'tracks': {'total': self.tracks_per_playlist}
+        }
+
+    def search_playlists(self, genre: str, offset: int, limit: int) -> Tuple[List[Dict], int]:
+        end = min(self.playlists_per_genre, offset + limit)
+        return [self.playlist(genre, index) for index in range(offset, end)], self.playlists_per_genre
+
+    def playlist_tracks(self, playlist_id: str, offset: int, limit: int) -> Optional[Tuple[List[Dict], int]]:
+        with self._lock:
+            total = self._playlists.get(playlist_id)
+        if total is None:
+            return None
+        seed = zlib.crc32(playlist_id.encode())
+        end = min(total, offset + limit)
+        items = [{
+            'added_at': '2024-01-01T00:00:00Z',
+            'is_local': False,
+            'track': self.track((seed + position * 7919) % self.tracks)
+        } for position in range(offset, end)]
+        return items, total
+
+class StubSpotifyServer:
+    """
+    Threaded HTTP server implementing the stand-in API.
+
+    Every request waits `latency` seconds (plus up to `jitter`). With
+    `rate_limit` set, requests beyond that many per second (with a burst of
+    the same size) are answered with 429 and a Retry-After header.
+    """
+
+    def __init__(
+        self,
+        catalog: Optional[SyntheticCatalog] = None,
+        host: str = '127.0.0.1',
+        port: int = 0,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        rate_limit: Optional[float] = None
+    ):
+        self.catalog = catalog or SyntheticCatalog()
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self._tokens = rate_limit or 0.0
+        self._refilled_at = time.monotonic()
+        self._lock = threading.Lock()
+        self.user_playlists = {}
+        self.counts = Counter()
+        self._httpd = ThreadingHTTPServer((host, port), _make_handler(self))
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def api_url(self) -> str:
+        return f'{self.base_url}/v1/'
+
+    @property
+    def accounts_url(self) -> str:
+        return self.base_url
+
+    def start(self) -> 'StubSpotifyServer':
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='spotify-stub', daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        """Serve on the calling thread until interrupted."""
+        try:
+            self._httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._httpd.server_close()
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> 'StubSpotifyServer':
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def throttle(self) -> Optional[int]:
+        """Take a request token; returns the Retry-After seconds when none is left."""
+        if not self.rate_limit:
+            return None
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate_limit, self._tokens + (now - self._refilled_at) * self.rate_limit)
+            self._refilled_at = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return None
+            return max(1, math.ceil((1 - self._tokens) / self.rate_limit))
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self.counts[name] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self.counts)
+
+def _make_handler(server: StubSpotifyServer):
+    catalog = server.catalog
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Headers and body go out in separate writes; without this, keep-alive
+        # requests stall on Nagle plus delayed ACKs
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status: int, body: Optional[Dict] = None, headers: Optional[Dict] = None) -> None:
+            payload = json.dumps(body).encode() if body is not None else b''
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _error(self, status: int, message: str, headers: Optional[Dict] = None) -> None:
+            server.count(f'status_{status}')
+            self._send(status, {'error': {'status': status, 'message': message}}, headers)
+
+        def _body(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            return self.rfile.read(length) if length else b''
+
+        def _paging(self, url: str, items: List[Dict], offset: int, limit: int, total: int, query: Dict) -> Dict:
+            def page_url(page_offset):
+                return f'{url}?{urlencode(dict(query, offset=page_offset, limit=limit))}'
+            return {
+                'href': page_url(offset),
+                'items': items,
+                'limit': limit,
+                'offset': offset,
+                'total': total,
+                'next': page_url(offset + limit) if offset + limit < total else None,
+                'previous': page_url(max(0, offset - limit)) if offset else None
+            }
+
+        def _handle(self, method: str) -> None:
+            body = self._body()
+            parsed = urlparse(self.path)
+            query = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+            parts = [part for part in parsed.path.split('/') if part]
+
+            delay = server.latency + random.uniform(0, server.jitter) if server.jitter else server.latency
+            if delay:
+                time.sleep(delay)
+
+            # Accounts service: token exchange and an authorize page that approves immediately
+            if parts == ['api', 'token'] and method == 'POST':
+                server.count('token')
+                return self._send(200, {
+                    'access_token': f'stub-{random.getrandbits(32):08x}',
+                    'token_type': 'Bearer',
+                    'expires_in': 3600,
+                    'scope': 'playlist-modify-public playlist-modify-private',
+                    'refresh_token': 'stub-refresh'
+                })
+            if parts == ['authorize'] and method == 'GET':
+                server.count('authorize')
+                target = f"{query.get('redirect_uri', '')}?{urlencode({'code': 'stub-code', 'state': query.get('state', '')})}"
+                return self._send(302, headers={'Location': target})
+
+            if not parts or parts[0] != 'v1':
+                return self._error(404, 'Not found')
+            if not self.headers.get('Authorization', '').startswith('Bearer '):
+                return self._error(401, 'No token provided')
+            retry_after = server.throttle()
+            if retry_after is not None:
+                return self._error(429, 'API rate limit exceeded', {'Retry-After': str(retry_after)})
+
+            route = parts[1:]
+            url = f'{server.api_url}{"/".join(route)}'
+            offset = int(query.get('offset', 0))
+            limit = min(int(query.get('limit', 20)), 50 if route == ['search'] else 100)
+
+            if route == ['search'] and method == 'GET':
+                server.count('search')
+                genre = query.get('q', '').replace('genre:', '').strip('"') or 'pop'
+                items, total = catalog.search_playlists(genre, offset, limit)
+                return self._send(200, {'playlists': self._paging(url, items, offset, limit, total, query)})
+
+            if route == ['me'] and method == 'GET':
+                server.count('me')
+                return self._send(200, {'id': 'stub-user', 'display_name': 'Stub User'})
+
+            if len(route) == 3 and route[0] == 'users' and route[2] == 'playlists' and method == 'POST':
+                server.count('create_playlist')
+                data = json.loads(body or b'{}')
+                playlist_id = f'u{random.getrandbits(64):016x}'
+                playlist = {
+                    'id': playlist_id,
+                    'uri': f'spotify:playlist:{playlist_id}',
+                    'name': data.get('name', ''),
+                    'description': data.get('description', ''),
+                    'public': data.get('public', True),
+                    'owner': {'id': route[1]},
+                    'external_urls': {'spotify': f'{server.base_url}/playlist/{playlist_id}'}
+                }
+                with server._lock:
+                    server.user_playlists[playlist_id] = {'playlist': playlist, 'uris': [], 'snapshot': 0}
+                return self._send(201, playlist)
+
+            if len(route) == 3 and route[0] == 'playlists' and route[2] in ('tracks', 'items'):
+                playlist_id = route[1]
+                if method == 'POST':
+                    server.count('add_items')
+                    data = json.loads(body or b'[]')
+                    uris = data.get('uris', []) if isinstance(data, dict) else data
+                    if 'uris' in query:
+                        uris = query['uris'].split(',')
+                    if len(uris) > MAX_ITEMS_PER_WRITE:
+                        return self._error(400, f'You can add a maximum of {MAX_ITEMS_PER_WRITE} tracks per request.')
+                    with server._lock:
+                        stored = server.user_playlists.get(playlist_id)
+                        if stored is not None:
+                            stored['uris'].extend(uris)
+                            stored['snapshot'] += 1
+                            snapshot_id = f"{playlist_id}-{stored['snapshot']}"
+                    # Answer outside the lock: _error() counts the status under it
+                    if stored is None:
+                        return self._error(404, 'Not found')
+                    return self._send(201, {'snapshot_id': snapshot_id})
+                if method == 'GET':
+                    server.count('playlist_tracks')
+                    with server._lock:
+                        stored = server.user_playlists.get(playlist_id)
+                        uris = list(stored['uris']) if stored else None
+                    if uris is not None:
+                        items = [{'is_local': False, 'track': catalog.track_by_id(uri.rsplit(':', 1)[-1])} for uri in uris[offset:offset + limit]]
+                        total = len(uris)
+                    else:
+                        found = catalog.playlist_tracks(playlist_id, offset, limit)
+                        if found is None:
+                            return self._error(404, 'Not found')
+                        items, total = found
+                    return self._send(200, self._paging(url, items, offset, limit, total, query))
+
+            if len(route) == 3 and route[0] == 'playlists' and route[2] == 'followers' and method == 'DELETE':
+                server.count('unfollow')
+                with server._lock:
+                    server.user_playlists.pop(route[1], None)
+                return self._send(200)
+
+            if len(route) == 2 and route[0] == 'tracks' and method == 'GET':
+                server.count('track')
+                track = catalog.track_by_id(route[1])
+                return self._send(200, track) if track else self._error(404, 'Not found')
+
+            return self._error(404, 'Not found')
+
+        def do_GET(self):
+            self._handle('GET')
+
+        def do_POST(self):
+            self._handle('POST')
+
+        def do_DELETE(self):
+            self._handle('DELETE')
+
+    return Handler
+
+def load_test(server: StubSpotifyServer, playlists: int, concurrency: int) -> Dict:
+    """
+    Create `playlists` mood playlists against the stand-in from `concurrency`
+    threads sharing one connector, and summarize their latency.
+    """
+    import os
+    from concurrent.futures import ThreadPoolExecutor
+
+    os.environ.update({
+        'SPOTIFY_API_URL': server.api_url,
+        'SPOTIFY_ACCOUNTS_URL': server.accounts_url,
+        'SPOTIFY_CLIENT_ID': os.getenv('SPOTIFY_CLIENT_ID') or 'stub',
+        'SPOTIFY_CLIENT_SECRET': os.getenv('SPOTIFY_CLIENT_SECRET') or 'stub',
+        'SPOTIFY_POOL_PATH': '',
+        'SPOTIFY_CACHE_PATH': '',
+        'SPOTIFY_TOKEN_CACHE_PATH': ''
+    })
+    from benchmark import summarize
+    from spotify_connector import SpotifyConnector
+
+    connector = SpotifyConnector()
+    connector.token_manager.set(connector.oauth_manager.get_access_token('stub-code', as_dict=True, check_cache=False))
+    moods = list(connector.mood_keywords)
+
+    def create(i):
+        start = time.perf_counter()
+        playlist = connector.create_mood_playlist(moods[i % len(moods)])
+        return time.perf_counter() - start, playlist is not None
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(create, range(playlists)))
+    elapsed = time.perf_counter() - started
+
+    summary = summarize([latency for latency, _ in results], 0)
+    del summary['peak_memory_kb']
+    summary.update({
+        'succeeded': sum(ok for _, ok in results),
+        'wall_time_s': elapsed,
+        'playlists_per_s': playlists / elapsed if elapsed else 0.0,
+        'server': server.stats(),
+        'scheduler': connector.scheduler.stats()
+    })
+    return summary
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Local Spotify Web API stand-in')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8800)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='added to every request')
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='random extra latency per request')
+    parser.add_argument('--rate-limit', type=float, help='requests per second before answering 429')
+    parser.add_argument('--tracks', type=int, default=100000, help='catalog size')
+    parser.add_argument('--playlists-per-genre', type=int, default=50)
+    parser.add_argument('--tracks-per-playlist', type=int, default=200)
+    parser.add_argument('--load-test', type=int, metavar='PLAYLISTS', help='create this many playlists against the stand-in and exit')
+    parser.add_argument('--concurrency', type=int, default=8, help='load-test threads')
+    args = parser.parse_args(argv)
+
+    server = StubSpotifyServer(
+        SyntheticCatalog(args.tracks, args.playlists_per_genre, args.tracks_per_playlist),
+        host=args.host,
+        port=0 if args.load_test else args.port,
+        latency=args.latency_ms / 1000,
+        jitter=args.jitter_ms / 1000,
+        rate_limit=args.rate_limit
+    )
+
+    if args.load_test:
+        with server:
+            print(json.dumps(load_test(server, args.load_test, args.concurrency), indent=2))
+        return
+
+    print(f"Serving the Spotify stand-in at {server.api_url}")
+    print(f"  SPOTIFY_API_URL={server.api_url}")
+    print(f"  SPOTIFY_ACCOUNTS_URL={server.accounts_url}")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+"""
+Batch mood tagging for archived posts.
+
+Reads JSONL or CSV from a file or stdin, detects each record's mood across a
+process pool and attaches the matching genres. Results are streamed out in
+input order. At most a few chunks per worker are in flight at once, so memory
+stays bounded whatever the input size.
+
+Usage:
+    python tag_moods.py posts.jsonl -o tagged.jsonl --checkpoint tagged.ckpt
+    cat posts.csv | python tag_moods.py --format csv --keyword-only > tagged.csv
+
+With --checkpoint, progress is recorded after every chunk, and rerunning the
+same command resumes after the last completed chunk, or starts over if the
+output file has since been lost. Throughput and an ETA (for file input) are
+reported on stderr.
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+class ByteCountingReader:
+    """Line iterator over a binary stream that tracks how many bytes were consumed."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.consumed = 0
+
+    def __iter__(self) -> Iterator[str]:
+        for line in self.stream:
+            self.consumed += len(line)
+            yield line.decode('utf-8', errors='replace')
+
+def read_records(reader: ByteCountingReader, fmt: str, text_field: str) -> Iterator[Tuple[Dict, str]]:
+    """Yield (record, text) pairs; unparseable JSON lines yield an error record and no text."""
+    if fmt == 'csv':
+        for row in csv.DictReader(reader):
+            yield row, row.get(text_field) or ''
+        return
+    for line in reader:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield {'error': f'invalid JSON: {e}'}, None
+            continue
+        if not isinstance(record, dict):
+            record = {text_field: record}
+        yield record, str(record.get(text_field) or '')
+
+_ml_threads = None
+
+def tag_chunk(texts: List[str], keyword_only: bool, ml_concurrency: int) -> List[Tuple[str, List[str]]]:
+    """
+    Worker entry point: (mood, genres) for each text in a chunk.
+
+    Keyword-only chunks are scored in one vectorized pass. Otherwise texts
+    go through detect_mood_from_text on a thread pool, so low-confidence
+    texts share batched, cached Gemini calls within the worker.
+    """
+    global _ml_threads
+    from mood_mapper import get_genres_for_mood
+    from text_mood_detector import detect_mood_from_text, detect_moods
+
+    if keyword_only:
+        moods = [str(mood) for mood in detect_moods(texts)[0]]
+    else:
+        if _ml_threads is None:
+            _ml_threads = ThreadPoolExecutor(max_workers=ml_concurrency, thread_name_prefix='tag-ml')
+        moods = list(_ml_threads.map(detect_mood_from_text, texts))
+
+    genres = {}
+    return [(mood, genres.setdefault(mood, get_genres_for_mood(mood))) for mood in moods]
+
+class Checkpoint:
+    """Records done and output bytes written, saved atomically after every chunk."""
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.records = 0
+        self.output_bytes = 0
+        if path and os.path.exists(path):
+            with open(path) as file:
+                state = json.load(file)
+            self.records = state['records']
+            self.output_bytes = state['output_bytes']
+
+    def save(self, records: int, output_bytes: int) -> None:
+        self.records, self.output_bytes = records, output_bytes
+        if not self.path:
+            return
+        temporary = f'{self.path}.tmp'
+        with open(temporary, 'w') as file:
+            json.dump({'records': records, 'output_bytes': output_bytes}, file)
+        os.replace(temporary, self.path)
+
+class Progress:
+    """Throughput and ETA reporting on stderr, at most every `interval` seconds."""
+
+    def __init__(self, reader: ByteCountingReader, total_bytes: Optional[int], interval: float, start_bytes: int = 0):
+        self.reader = reader
+        self.total_bytes = total_bytes
+        self.interval = interval
+        self.started = time.monotonic()
+        self.start_bytes = start_bytes
+        self.reported = self.started
+
+    def line(self, records: int) -> str:
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        text = f"{records} records in {elapsed:.1f}s ({records / elapsed:.0f}/s)"
+        consumed = self.reader.consumed - self.start_bytes
+        if self.total_bytes and consumed > 0:
+            remaining = max(0, self.total_bytes - self.reader.consumed)
+            text += f", {self.reader.consumed / self.total_bytes:.1%} read, ETA {remaining / (consumed / elapsed):.0f}s"
+        return text
+
+    def update(self, records: int) -> None:
+        now = time.monotonic()
+        if self.interval and now - self.reported >= self.interval:
+            self.reported = now
+            print(self.line(records), file=sys.stderr, flush=True)
+
+def chunks(records: Iterator[Tuple[Dict, str]], size: int) -> Iterator[List[Tuple[Dict, str]]]:
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def tag_stream(
+    chunk_iter: Iterator[List[Tuple[Dict, str]]],
+    workers: int,
+    keyword_only: bool,
+    ml_concurrency: int,
+    max_in_flight: int
+) -> Iterator[Tuple[List[Tuple[Dict, str]], List[Tuple[str, List[str]]]]]:
+    """Yield (chunk, results) in input order, keeping at most max_in_flight chunks dispatched."""
+    if workers == 0:
+        for chunk in chunk_iter:
+            yield chunk, tag_chunk([text or '' for _, text in chunk], keyword_only, ml_concurrency)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for chunk in chunk_iter:
+            pending.append((chunk, pool.submit(tag_chunk, [text or '' for _, text in chunk], keyword_only, ml_concurrency)))
+            if len(pending) >= max_in_flight:
+                chunk, future = pending.popleft()
+                yield chunk, future.result()
+        while pending:
+            chunk, future = pending.popleft()
+            yield chunk, future.result()
+
+class Writer:
+    """Writes tagged records as JSONL or CSV, counting bytes for the checkpoint."""
+
+    def __init__(self, stream, fmt: str, offset: int):
+        self.stream = stream
+        self.fmt = fmt
+        self.bytes = offset
+        self.columns = None
+        self.header_written = offset > 0
+
+    def write(self, record: Dict, mood: Optional[str], genres: List[str]) -> None:
+        if self.fmt == 'csv':
+            row = dict(record, mood=mood or '', genres='|'.join(genres))
+            if self.columns is None:
+                self.columns = list(row)
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=self.columns, extrasaction='ignore')
+            if not self.header_written:
+                writer.writeheader()
+                self.header_written = True
+            writer.writerow(row)
+            data = buffer.getvalue()
+        else:
+            data = json.dumps(dict(record, mood=mood, genres=genres), ensure_ascii=False) + '\n'
+        encoded = data.encode('utf-8')
+        self.stream.write(encoded)
+        self.bytes += len(encoded)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Tag posts with mood and genres in bulk')
+    parser.add_argument('input', nargs='?', default='-', help='JSONL or CSV file, or - for stdin')
+    parser.add_argument('-o', '--output', default='-', help='output file, or - for stdout')
+    parser.add_argument('--format', choices=('jsonl', 'csv'), help='input/output format (default: from the file extension, else jsonl)')
+    parser.add_argument('--text-field', default='text', help='field holding the post text')
+    parser.add_argument('--keyword-only', action='store_true', help='skip the Gemini fallback')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='worker processes; 0 runs in-process')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='records per dispatched chunk')
+    parser.add_argument('--ml-concurrency', type=int, default=16, help='concurrent detections per worker with the Gemini fallback')
+    parser.add_argument('--checkpoint', help='progress file; rerunning with it resumes where the last run stopped')
+    parser.add_argument('--report-interval', type=float, default=5.0, help='seconds between progress reports; 0 disables them')
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ('csv' if args.input.lower().endswith('.csv') else 'jsonl')
+    checkpoint = Checkpoint(args.checkpoint)
+    if checkpoint.records and args.output != '-':
+        written = os.path.getsize(args.output) if os.path.exists(args.output) else None
+        if written is None or written < checkpoint.output_bytes:
+            # Resuming would leave a gap of NUL bytes where the lost records were
+            print(f"{args.output} is missing or shorter than the checkpoint recorded; starting over", file=sys.stderr)
+            checkpoint.save(0, 0)
+    if checkpoint.records and args.output == '-':
+        print("Resuming to stdout: records before the checkpoint are not repeated", file=sys.stderr)
+
+    source = sys.stdin.buffer if args.input == '-' else open(args.input, 'rb')
+    if args.output == '-':
+        sink = sys.stdout.buffer
+    else:
+        sink = open(args.output, 'r+b' if checkpoint.records and os.path.exists(args.output) else 'wb')
+        # Drop anything written after the last checkpoint
+        sink.truncate(checkpoint.output_bytes if checkpoint.records else 0)
+        sink.seek(0, os.SEEK_END)
+
+    reader = ByteCountingReader(source)
+    records = read_records(reader, fmt, args.text_field)
+    for _ in range(checkpoint.records):
+        if next(records, None) is None:
+            break
+
+    total_bytes = os.path.getsize(args.input) if args.input != '-' else None
+    progress = Progress(reader, total_bytes, args.report_interval, start_bytes=reader.consumed)
+    writer = Writer(sink, fmt, checkpoint.output_bytes if checkpoint.records else 0)
+    resumed = done = checkpoint.records
+    workers = max(0, args.workers)
+
+    try:
+        stream = tag_stream(
+            chunks(records, max(1, args.chunk_size)),
+            workers,
+            args.keyword_only,
+            args.ml_concurrency,
+            max_in_flight=max(1, workers) * 2
+        )
+        for chunk, results in stream:
+            for (record, text), (mood, genres) in zip(chunk, results):
+                if text is None:
+                    writer.write(record, None, [])
+                else:
+                    writer.write(record, mood, genres)
+            sink.flush()
+            done += len(chunk)
+            checkpoint.save(done, writer.bytes)
+            progress.update(done - resumed)
+    finally:
+        if source is not sys.stdin.buffer:
+            source.close()
+        if sink is not sys.stdout.buffer:
+            sink.close()
+
+    print(f"Done: {progress.line(done - resumed)}, {done} in total", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
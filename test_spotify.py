@@ -65,7 +65,7 @@ def main():
                 tracks = connector.get_playlist_tracks(playlist['id'])
                 print(f"Found {len(tracks)} tracks:")
                 for i, track in enumerate(tracks[:5], 1):  # Show first 5 tracks
-                    print(f"{i}. {track['name']} by {', '.join(track['artists'])}")
+                    print(f"{i}. {track.name}")
                 if len(tracks) > 5:
                     print(f"... and {len(tracks) - 5} more tracks")
                 
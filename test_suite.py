@@ -1,5 +1,23 @@
+import asyncio
+import csv
+import socket
 import unittest
-from text_mood_detector import detect_mood_from_text
+import urllib.request
+import threading
+from unittest import mock
+import os
+import tempfile
+import text_mood_detector
+import metrics
+import mood_mapper
+import time
+from spotipy.exceptions import SpotifyException
+import spotify_connector
+from spotify_connector import CandidatePoolStore, PlaylistIndex, RequestScheduler, SpotifyConnector, TokenManager, Track, wait_for_authorization_code
+import json
+from cache import SQLiteCache, TTLCache, TieredCache
+from gemini_client import CircuitBreaker, ModelPool, RequestCoalescer, verdict_key
+from text_mood_detector import detect_mood_from_text, detect_moods, keyword_based_detection, KEYWORD_MATCHER
 
 class TestMoodDetection(unittest.TestCase):
     def test_happy_mood(self):
@@ -121,5 +139,1160 @@ class TestMoodDetection(unittest.TestCase):
         for text in test_cases:
             self.assertEqual(detect_mood_from_text(text), "happy")
 
+class TestKeywordMatcher(unittest.TestCase):
+    def test_multi_word_phrases(self):
+        """Test that multi-word phrases are matched as single keywords"""
+        self.assertEqual(KEYWORD_MATCHER.count("I can't wait for tonight")['excited'], (1, 0))
+        self.assertEqual(KEYWORD_MATCHER.count("Remembering the good old days")['nostalgic'], (1, 0))
+        self.assertEqual(KEYWORD_MATCHER.count("Business\nas   usual")['neutral'], (1, 0))
+
+    def test_word_boundaries(self):
+        """Test that keywords only match whole words"""
+        counts = KEYWORD_MATCHER.count("Sadness is not overjoyed")
+        self.assertEqual(counts['sad'], (0, 0))
+        self.assertEqual(counts['happy'], (1, 0))
+
+    def test_exclusion_counts(self):
+        """Test that exclusions are counted per mood in the same pass"""
+        counts = KEYWORD_MATCHER.count("happy happy but anxious")
+        self.assertEqual(counts['happy'], (2, 1))
+        self.assertEqual(counts['anxious'], (1, 2))
+        self.assertEqual(counts['sad'], (0, 3))
+
+class TestBatchDetection(unittest.TestCase):
+    def test_matches_scalar_detection(self):
+        """Test that batch scoring matches keyword_based_detection for every input"""
+        texts = [
+            "", "   ", "12345",
+            "I'm feeling amazing today!",
+            "I'm feeling happy and sad at the same time",
+            "Remembering the good old days",
+            "I can't wait, I'm so excited and a bit nervous",
+            "Neither good nor bad",
+            "I'm worried about the exam tomorrow",
+        ]
+        moods, confidences = detect_moods(texts, batch_size=4)
+        self.assertEqual(len(moods), len(texts))
+        for text, mood, confidence in zip(texts, moods, confidences):
+            self.assertEqual((mood, confidence), keyword_based_detection(text))
+
+    def test_empty_batch(self):
+        """Test that an empty batch returns empty arrays"""
+        moods, confidences = detect_moods([])
+        self.assertEqual(len(moods), 0)
+        self.assertEqual(len(confidences), 0)
+
+class TestModelPool(unittest.TestCase):
+    def test_models_are_reused(self):
+        """Test that repeated calls reuse one model instead of building new ones"""
+        with mock.patch('gemini_client.genai.GenerativeModel') as factory:
+            pool = ModelPool("test-model", size=2)
+            for _ in range(5):
+                with pool.model() as model:
+                    model.generate_content("hello")
+            self.assertEqual(factory.call_count, 1)
+            self.assertEqual(pool.instantiations, 1)
+
+    def test_pool_size_is_bounded_across_threads(self):
+        """Test that concurrent callers never build more models than the pool size"""
+        with mock.patch('gemini_client.genai.GenerativeModel') as factory:
+            pool = ModelPool("test-model", size=3)
+            barrier = threading.Barrier(8)
+
+            def worker():
+                barrier.wait()
+                for _ in range(20):
+                    with pool.model(timeout=5):
+                        pass
+
+            threads = [threading.Thread(target=worker) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertLessEqual(factory.call_count, 3)
+            self.assertEqual(pool.stats()['idle'], pool.instantiations)
+
+class TestVerdictCache(unittest.TestCase):
+    def test_lru_eviction(self):
+        """Test that the memory tier evicts the least recently used entry"""
+        cache = TTLCache(max_size=2, ttl=None)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_ttl_expiry(self):
+        """Test that expired entries are treated as misses"""
+        cache = TTLCache(max_size=10, ttl=60)
+        with mock.patch('cache.time.time', return_value=1000.0):
+            cache.set('a', 1)
+        with mock.patch('cache.time.time', return_value=1061.0):
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_disk_tier_survives_restart(self):
+        """Test that verdicts written to disk are found by a new process-level cache"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'verdicts.sqlite3')
+            first = TieredCache(TTLCache(), SQLiteCache(path))
+            first.set('key', 'happy')
+            first.disk.close()
+
+            second = TieredCache(TTLCache(), SQLiteCache(path, max_size=1))
+            self.assertEqual(second.get('key'), 'happy')
+            self.assertEqual(second.stats()['disk']['hits'], 1)
+            second.disk.close()
+
+    def test_key_normalizes_text(self):
+        """Test that case and whitespace differences share a cache key"""
+        self.assertEqual(verdict_key("I'm  Happy", 'm', 'v1'), verdict_key("i'm happy ", 'm', 'v1'))
+        self.assertNotEqual(verdict_key("I'm happy", 'm', 'v1'), verdict_key("I'm happy", 'm', 'v2'))
+
+    def test_repeat_text_skips_model(self):
+        """Test that ml_based_detection answers repeats from the cache"""
+        cache = TieredCache(TTLCache())
+        pool = mock.MagicMock()
+        pool.model.return_value.__enter__.return_value.generate_content.return_value.text = "Sad\n"
+        with mock.patch.object(text_mood_detector, 'get_verdict_cache', return_value=cache), \
+                mock.patch.object(text_mood_detector, 'get_model_pool', return_value=pool), \
+                mock.patch.object(text_mood_detector, 'ML_BREAKER', CircuitBreaker()):
+            self.assertEqual(text_mood_detector.ml_based_detection("Rainy day"), 'sad')
+            self.assertEqual(text_mood_detector.ml_based_detection("rainy  day"), 'sad')
+        self.assertEqual(pool.model.call_count, 1)
+
+    def test_unparseable_answers_are_not_cached(self):
+        """Test that an answer that is not a mood falls back to neutral without being cached"""
+        cache = TieredCache(TTLCache())
+        pool = mock.MagicMock()
+        pool.model.return_value.__enter__.return_value.generate_content.return_value.text = "Happy."
+        with mock.patch.object(text_mood_detector, 'get_verdict_cache', return_value=cache), \
+                mock.patch.object(text_mood_detector, 'get_model_pool', return_value=pool), \
+                mock.patch.object(text_mood_detector, 'ML_BREAKER', CircuitBreaker()):
+            self.assertEqual(text_mood_detector.ml_based_detection("Sunny walk"), 'neutral')
+            calls = pool.model.call_count
+            self.assertEqual(text_mood_detector.ml_based_detection("sunny  walk"), 'neutral')
+        self.assertEqual(pool.model.call_count, 2 * calls)
+        self.assertIsNone(cache.get(verdict_key("Sunny walk", text_mood_detector.ML_MODEL_NAME, text_mood_detector.ML_PROMPT_VERSION)))
+
+class TestRequestCoalescer(unittest.TestCase):
+    def run_concurrently(self, coalescer, texts):
+        async def run():
+            return await asyncio.gather(*(coalescer.classify(text) for text in texts))
+        return asyncio.run(run())
+
+    def test_concurrent_texts_share_one_batch(self):
+        """Test that concurrent requests are sent as one batch and duplicates are merged"""
+        batches = []
+
+        def classify_batch(texts):
+            batches.append(list(texts))
+            return [text.split()[0].lower() for text in texts]
+
+        coalescer = RequestCoalescer(classify_batch, mock.Mock(), max_wait=0.01)
+        labels = self.run_concurrently(coalescer, ["Happy day", "Sad night", "happy  DAY"])
+        self.assertEqual(labels, ['happy', 'sad', 'happy'])
+        self.assertEqual(batches, [["Happy day", "Sad night"]])
+        self.assertEqual(coalescer.stats()['coalesced'], 1)
+
+    def test_unparsed_items_fall_back_to_single_calls(self):
+        """Test that items missing from the batched answer are classified one by one"""
+        classify_one = mock.Mock(return_value='neutral')
+        coalescer = RequestCoalescer(lambda texts: ['happy', None], classify_one, max_wait=0.01)
+        labels = self.run_concurrently(coalescer, ["one", "two"])
+        self.assertEqual(labels, ['happy', 'neutral'])
+        classify_one.assert_called_once_with("two")
+
+    def test_failed_batch_falls_back_to_single_calls(self):
+        """Test that a batch that raises is retried item by item"""
+        def classify_batch(texts):
+            raise ValueError("unparseable")
+
+        coalescer = RequestCoalescer(classify_batch, lambda text: text, max_wait=0.01)
+        self.assertEqual(self.run_concurrently(coalescer, ["a", "b"]), ['a', 'b'])
+        self.assertEqual(coalescer.stats()['fallbacks'], 2)
+
+    def test_sync_entry_point(self):
+        """Test that synchronous callers get results through the background loop"""
+        coalescer = RequestCoalescer(lambda texts: ['calm'] * len(texts), mock.Mock(), max_wait=0)
+        self.assertEqual(coalescer.classify_sync("anything", timeout=5), 'calm')
+
+    def test_batch_answer_parsing(self):
+        """Test that numbered batch answers map back to their texts"""
+        pool = mock.MagicMock()
+        pool.model.return_value.__enter__.return_value.generate_content.return_value.text = "1: Sad\n3. bored\n2 - happy"
+        with mock.patch.object(text_mood_detector, 'get_model_pool', return_value=pool):
+            labels = text_mood_detector._ml_classify_batch(["a", "b", "c"])
+        self.assertEqual(labels, ['sad', 'happy', None])
+
+class TestDeadlineAndBreaker(unittest.TestCase):
+    def test_breaker_opens_and_probes(self):
+        """Test that the breaker opens after repeated failures and probes once after the cooldown"""
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+        with mock.patch('gemini_client.time.monotonic', return_value=100.0):
+            breaker.record_failure()
+            self.assertTrue(breaker.allow())
+            breaker.record_failure()
+            self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+            self.assertFalse(breaker.allow())
+        with mock.patch('gemini_client.time.monotonic', return_value=131.0):
+            self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+            self.assertTrue(breaker.allow())
+            self.assertFalse(breaker.allow())
+            breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_slow_model_returns_keyword_verdict(self):
+        """Test that a slow ML answer is abandoned in favour of the keyword verdict"""
+        release = threading.Event()
+        coalescer = RequestCoalescer(lambda texts: [release.wait(5) and 'sad'] * len(texts), mock.Mock(), max_wait=0)
+        text = "I'm feeling happy today"
+        keyword_mood, _ = keyword_based_detection(text)
+        with mock.patch.object(text_mood_detector, 'get_verdict_cache', return_value=TieredCache(TTLCache())), \
+                mock.patch.object(text_mood_detector, 'get_ml_coalescer', return_value=coalescer), \
+                mock.patch.object(text_mood_detector, 'ML_BREAKER', CircuitBreaker()) as breaker:
+            self.assertEqual(detect_mood_from_text(text, timeout=0.05), keyword_mood)
+            self.assertEqual(breaker.consecutive_failures, 1)
+        release.set()
+
+    def test_open_breaker_skips_model(self):
+        """Test that an open breaker short-circuits without calling the model"""
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+        breaker.record_failure()
+        coalescer = mock.Mock()
+        with mock.patch.object(text_mood_detector, 'get_verdict_cache', return_value=TieredCache(TTLCache())), \
+                mock.patch.object(text_mood_detector, 'get_ml_coalescer', return_value=coalescer), \
+                mock.patch.object(text_mood_detector, 'ML_BREAKER', breaker):
+            self.assertEqual(text_mood_detector.ml_based_detection("Rainy day"), 'neutral')
+        coalescer.submit.assert_not_called()
+
+class TestAnalysisMemo(unittest.TestCase):
+    def setUp(self):
+        env = {'GOOGLE_API_KEY': 'key', 'SPOTIFY_CLIENT_ID': 'id', 'SPOTIFY_CLIENT_SECRET': 'secret'}
+        with mock.patch.dict(os.environ, env):
+            import app
+        self.app = app
+        app.analyze_text_shared.clear()
+        self.model = mock.Mock()
+        self.model.generate_content.return_value = mock.Mock(text='Happy')
+        pool = mock.MagicMock()
+        pool.model.return_value.__enter__.return_value = self.model
+        verdicts = mock.Mock()
+        verdicts.get.return_value = None
+        for name, value in (('get_model_pool', lambda model_name: pool), ('get_verdict_cache', lambda: verdicts),
+                            ('get_model_name', lambda: 'models/test'), ('get_sentiment_score', lambda text: 0.5)):
+            patcher = mock.patch.object(app, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_repeated_text_skips_the_model(self):
+        """Test that analyzing the same text again is answered without a model call"""
+        self.assertEqual(self.app.analyze_text("what a day"), ('happy', 0.5))
+        self.assertEqual(self.app.analyze_text("what a day"), ('happy', 0.5))
+        self.assertEqual(self.model.generate_content.call_count, 1)
+        self.app.st.session_state.clear()
+        self.assertEqual(self.app.analyze_text("what a day"), ('happy', 0.5))
+        self.assertEqual(self.model.generate_content.call_count, 1)
+        self.app.analyze_text("another day")
+        self.assertEqual(self.model.generate_content.call_count, 2)
+
+class TestMoodMapper(unittest.TestCase):
+    def test_genre_lookup(self):
+        """Test that known moods map to their genres and unknown moods default to pop"""
+        self.assertIn("upbeat pop", mood_mapper.get_genres_for_mood("Happy"))
+        self.assertEqual(mood_mapper.get_genres_for_mood("unknown"), ["pop"])
+
+    def test_mapping_is_immutable(self):
+        """Test that the shared mapping cannot be modified by callers"""
+        mapping = mood_mapper.load_mood_genres()
+        self.assertIsInstance(mapping['sad'], tuple)
+        with self.assertRaises(TypeError):
+            mapping['sad'] = ('pop',)
+
+    def test_hot_reload_on_mtime_change(self):
+        """Test that the file is only re-read after its mtime changes"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'mood_genres.json')
+            with open(path, 'w') as f:
+                json.dump({'happy': ['disco']}, f)
+            with mock.patch.object(mood_mapper, 'MOOD_GENRES_PATH', path), \
+                    mock.patch.object(mood_mapper, 'RELOAD_CHECK_INTERVAL', 0), \
+                    mock.patch.object(mood_mapper, '_checked_at', None), \
+                    mock.patch.object(mood_mapper, '_loaded_mtime', None), \
+                    mock.patch.object(mood_mapper, '_mood_genres', {}):
+                self.assertEqual(mood_mapper.get_genres_for_mood('happy'), ['disco'])
+                with mock.patch('builtins.open', side_effect=AssertionError("re-read")):
+                    self.assertEqual(mood_mapper.get_genres_for_mood('happy'), ['disco'])
+
+                with open(path, 'w') as f:
+                    json.dump({'happy': ['funk']}, f)
+                os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10**9))
+                self.assertEqual(mood_mapper.get_genres_for_mood('happy'), ['funk'])
+
+    def test_bad_shape_keeps_last_good_mapping(self):
+        """Test that valid JSON that isn't a mood -> genre list mapping leaves the last good mapping in place"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'mood_genres.json')
+            with open(path, 'w') as f:
+                json.dump({'happy': ['disco']}, f)
+            with mock.patch.object(mood_mapper, 'MOOD_GENRES_PATH', path), \
+                    mock.patch.object(mood_mapper, 'RELOAD_CHECK_INTERVAL', 0), \
+                    mock.patch.object(mood_mapper, '_checked_at', None), \
+                    mock.patch.object(mood_mapper, '_loaded_mtime', None), \
+                    mock.patch.object(mood_mapper, '_mood_genres', {}), \
+                    mock.patch('sys.stdout'):
+                self.assertEqual(mood_mapper.get_genres_for_mood('happy'), ['disco'])
+                for step, bad in enumerate((['happy', 'disco'], {'happy': 'funk'}, {'happy': [1]}), 1):
+                    with open(path, 'w') as f:
+                        json.dump(bad, f)
+                    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + step * 10**9))
+                    self.assertEqual(mood_mapper.get_genres_for_mood('happy'), ['disco'])
+
+def make_connector(**kwargs):
+    """Build a SpotifyConnector with dummy credentials and a mocked API client."""
+    env = {'SPOTIFY_CLIENT_ID': 'id', 'SPOTIFY_CLIENT_SECRET': 'secret', 'SPOTIFY_POOL_PATH': ''}
+    with mock.patch.dict(os.environ, env):
+        connector = SpotifyConnector(**kwargs)
+    connector.sp = mock.MagicMock()
+    connector.sp.prefix = 'https://api.spotify.com/v1/'
+    connector.session = mock.MagicMock()
+    connector.auth_manager = mock.Mock()
+    connector.auth_manager.get_access_token.return_value = 'token'
+    connector.sp_user = mock.MagicMock()
+    connector.scheduler = RequestScheduler(rate=1000, burst=1000)
+    return connector
+
+def fake_response(body=None, status=200, etag=None):
+    """Minimal stand-in for a requests.Response returned by the Spotify session."""
+    response = mock.Mock(status_code=status, url='https://api.spotify.com/v1/x', text='')
+    response.json.return_value = body
+    response.headers = {'ETag': etag} if etag else {}
+    return response
+
+class TestSpotifyConnector(unittest.TestCase):
+    def test_fan_out_keeps_order(self):
+        """Test that concurrent requests come back in input order"""
+        connector = make_connector(max_workers=4)
+
+        def slow_echo(item):
+            time.sleep(0.05 * (4 - item))
+            return item
+
+        self.assertEqual(connector._fan_out(slow_echo, [0, 1, 2, 3]), [0, 1, 2, 3])
+
+    def test_fan_out_runs_concurrently(self):
+        """Test that requests overlap instead of running one after another"""
+        connector = make_connector(max_workers=8)
+        start = time.monotonic()
+        connector._fan_out(lambda item: time.sleep(0.1), list(range(8)))
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    def test_single_worker_runs_serially(self):
+        """Test that max_workers=1 keeps the serial execution mode"""
+        connector = make_connector(max_workers=1)
+        threads = connector._fan_out(lambda item: threading.current_thread(), [1, 2])
+        self.assertEqual(threads, [threading.current_thread()] * 2)
+
+    def test_tracks_added_in_ordered_chunks(self):
+        """Test that large track lists are split into 100-item writes in order"""
+        connector = make_connector()
+        connector.sp_user.playlist_add_items.side_effect = lambda playlist_id, uris: {'snapshot_id': uris[0]}
+        uris = [f'spotify:track:{i}' for i in range(250)]
+        result = connector.add_tracks_to_playlist('pl', uris)
+        calls = [call.args[1] for call in connector.sp_user.playlist_add_items.call_args_list]
+        self.assertEqual(calls, [uris[:100], uris[100:200], uris[200:]])
+        self.assertEqual(result, {'added': 250, 'failed': 0, 'requests': 3, 'snapshot_id': uris[200]})
+
+    def test_only_failed_chunks_are_retried(self):
+        """Test that a throttled chunk is retried without resending the others"""
+        connector = make_connector()
+        responses = [
+            {'snapshot_id': 's1'},
+            SpotifyException(429, -1, 'rate limited', headers={'Retry-After': '0'}),
+            {'snapshot_id': 's2'},
+        ]
+        connector.sp_user.playlist_add_items.side_effect = responses
+        uris = [f'spotify:track:{i}' for i in range(150)]
+        with mock.patch('spotify_connector.time.sleep'):
+            result = connector.add_tracks_to_playlist('pl', uris)
+        calls = [call.args[1] for call in connector.sp_user.playlist_add_items.call_args_list]
+        self.assertEqual(calls, [uris[:100], uris[100:], uris[100:]])
+        self.assertEqual(result['added'], 150)
+        self.assertEqual(result['snapshot_id'], 's2')
+
+    def test_throttled_chunks_are_retried_only_by_the_scheduler(self):
+        """Test that a throttled write is retried up to the scheduler's limit, not once more per chunk retry"""
+        connector = make_connector()
+        connector.scheduler = RequestScheduler(rate=1000, burst=1000, base_delay=0)
+        connector.sp_user.playlist_add_items.side_effect = SpotifyException(429, -1, 'rate limited', headers={'Retry-After': '0'})
+        with mock.patch('spotify_connector.time.sleep') as sleep:
+            result = connector.add_tracks_to_playlist('pl', ['spotify:track:x'] * 10)
+        self.assertEqual(connector.sp_user.playlist_add_items.call_count, connector.scheduler.max_retries + 1)
+        self.assertEqual(result['failed'], 10)
+        sleep.assert_not_called()
+
+    def test_permanent_failures_are_reported(self):
+        """Test that chunks rejected by the API are counted as failed, not retried"""
+        connector = make_connector()
+        connector.sp_user.playlist_add_items.side_effect = SpotifyException(400, -1, 'bad uri')
+        result = connector.add_tracks_to_playlist('pl', ['spotify:track:x'] * 120, max_concurrency=2)
+        self.assertEqual(connector.sp_user.playlist_add_items.call_count, 2)
+        self.assertEqual((result['added'], result['failed']), (0, 120))
+
+    def test_writes_are_not_resent_after_a_timeout(self):
+        """Test that a write that may have been applied is not resent, but one that never went out is"""
+        from urllib3.exceptions import MaxRetryError, NewConnectionError
+        connector = make_connector()
+        connector.sp_user.playlist_add_items.side_effect = spotify_connector.requests.exceptions.ReadTimeout()
+        result = connector.add_tracks_to_playlist('pl', ['spotify:track:x'] * 10)
+        self.assertEqual(connector.sp_user.playlist_add_items.call_count, 1)
+        self.assertEqual(result['failed'], 10)
+
+        refused = spotify_connector.requests.exceptions.ConnectionError(MaxRetryError(None, '/', NewConnectionError(None, 'refused')))
+        connector.sp_user.playlist_add_items.reset_mock()
+        connector.sp_user.playlist_add_items.side_effect = [refused, {'snapshot_id': 's1'}]
+        with mock.patch('spotify_connector.time.sleep'):
+            result = connector.add_tracks_to_playlist('pl', ['spotify:track:x'] * 10)
+        self.assertEqual(connector.sp_user.playlist_add_items.call_count, 2)
+        self.assertEqual(result['added'], 10)
+
+    def test_server_errors_on_writes_are_not_resent(self):
+        """Test that a write answered with a 5xx is sent exactly once, since it may have been applied"""
+        connector = make_connector()
+        connector.sp_user.playlist_add_items.side_effect = SpotifyException(503, -1, 'unavailable')
+        with mock.patch('spotify_connector.time.sleep'):
+            result = connector.add_tracks_to_playlist('pl', ['spotify:track:x'] * 10)
+        self.assertEqual(connector.sp_user.playlist_add_items.call_count, 1)
+        self.assertEqual((result['added'], result['failed']), (0, 10))
+
+    def test_search_results_are_cached(self):
+        """Test that repeating a genre search is served from the response cache"""
+        connector = make_connector()
+        body = {'playlists': {'items': [{'id': 'p1', 'name': 'Chill', 'description': ''}]}}
+        connector.session.get.return_value = fake_response(body)
+        first = connector.search_playlists_by_genre('jazz', mood='relaxed')
+        second = connector.search_playlists_by_genre('jazz', mood='relaxed')
+        self.assertEqual(first, second)
+        self.assertEqual(connector.session.get.call_count, 1)
+        self.assertEqual(connector.cache_stats()['hit_rate'], 0.5)
+
+    def test_mood_ranking_uses_playlist_index(self):
+        """Test that search results are ranked from the index and the warm index answers without a search"""
+        connector = make_connector()
+        items = [
+            {'id': 'p1', 'name': 'Focus Beats', 'description': ''},
+            None,
+            {'id': 'p2', 'name': 'Chill & Calm', 'description': 'peaceful meditation'},
+            {'id': 'p3', 'name': 'Relaxing Jazz', 'description': ''}
+        ]
+        connector.session.get.return_value = fake_response({'playlists': {'items': items}})
+        ranked = connector.search_playlists_by_genre('jazz', limit=3, mood='relaxed')
+        self.assertEqual([playlist['id'] for playlist in ranked], ['p2', 'p3', 'p1'])
+
+        calls = connector.session.get.call_count
+        self.assertEqual([playlist['id'] for playlist in connector.best_playlists_for_mood('relaxed')], ['p2', 'p3'])
+        self.assertEqual([playlist['id'] for playlist in connector.best_playlists_for_mood('neutral')], ['p1', 'p2'])
+        self.assertEqual(connector.session.get.call_count, calls)
+
+    def test_playlist_index_refreshes_and_is_bounded(self):
+        """Test that a re-added playlist replaces its stale entry and the least recently seen is evicted"""
+        index = PlaylistIndex({'happy': ['happy'], 'sad': ['sad']}, max_size=2)
+        index.add([{'id': 'p1', 'name': 'Happy Hits', 'tracks': {'total': 10}}, {'id': 'p2', 'name': 'Sad Songs'}])
+        index.add([{'id': 'p1', 'name': 'Sad Classics', 'tracks': {'total': 40}}])
+        self.assertEqual(index.top('happy', 5), [])
+        self.assertEqual([playlist['tracks']['total'] for playlist in index.top('sad', 5) if playlist['id'] == 'p1'], [40])
+
+        index.add([{'id': 'p3', 'name': 'Happy Days'}])
+        self.assertEqual(len(index), 2)
+        self.assertNotIn('p2', index)
+        self.assertEqual([playlist['id'] for playlist in index.top('sad', 5)], ['p1'])
+        self.assertEqual(index.evictions, 1)
+
+    def test_market_is_part_of_the_cache_key(self):
+        """Test that lookups for different markets are cached separately"""
+        connector = make_connector()
+        connector.session.get.return_value = fake_response({'items': [], 'next': None})
+        connector.get_playlist_tracks('p1')
+        connector.market = 'SE'
+        connector.get_playlist_tracks('p1')
+        self.assertEqual(connector.session.get.call_count, 2)
+        self.assertEqual(connector.session.get.call_args.kwargs['params']['market'], 'SE')
+
+    def test_playlist_tracks_stream_with_fields_and_stop_early(self):
+        """Test that tracks stream page by page with a fields filter and paging stops with the caller"""
+        connector = make_connector()
+        pages = {
+            'playlists/p1/tracks': {'items': [{'track': {'uri': 'spotify:track:1'}}, {'track': {'uri': 'spotify:track:2'}}], 'next': 'https://next/2'},
+            'https://next/2': {'items': [{'track': {'uri': 'spotify:track:3'}}], 'next': 'https://next/3'},
+            'https://next/3': {'items': [{'track': {'uri': 'spotify:track:4'}}], 'next': None}
+        }
+        connector.session.get.side_effect = lambda url, **kwargs: fake_response(pages[url.replace(connector.sp.prefix, '')])
+
+        stream = connector.iter_playlist_tracks('p1')
+        self.assertEqual(next(stream).uri, 'spotify:track:1')
+        params = connector.session.get.call_args_list[0].kwargs['params']
+        self.assertEqual(params['fields'], SpotifyConnector.PLAYLIST_TRACK_FIELDS)
+        stream.close()
+        self.assertLessEqual(connector.session.get.call_count, 2)
+
+        tracks = connector.get_playlist_tracks('p1', limit=3)
+        self.assertEqual([track.uri for track in tracks], ['spotify:track:1', 'spotify:track:2', 'spotify:track:3'])
+        self.assertEqual([track.uri for track in connector.iter_playlist_tracks('p1')][-1], 'spotify:track:4')
+
+    def test_skipped_items_do_not_shorten_the_limit(self):
+        """Test that local or removed items in a full first page are made up from the next page"""
+        connector = make_connector()
+        first = [{'track': {'uri': f'spotify:track:{i}'}} for i in range(8)]
+        pages = {
+            'playlists/p1/tracks': {'items': first + [{'track': None}, {'is_local': True, 'track': {'uri': 'spotify:local:x'}}], 'next': 'https://next/2'},
+            'https://next/2': {'items': [{'track': {'uri': f'spotify:track:{i}'}} for i in range(8, 18)], 'next': None}
+        }
+        connector.session.get.side_effect = lambda url, **kwargs: fake_response(pages[url.replace(connector.sp.prefix, '')])
+        tracks = connector.get_playlist_tracks('p1', limit=10)
+        self.assertEqual([track.uri for track in tracks], [f'spotify:track:{i}' for i in range(10)])
+
+    def test_stale_entries_are_revalidated_with_etag(self):
+        """Test that an expired entry is revalidated with If-None-Match and reused on 304"""
+        connector = make_connector()
+        connector.response_cache.ttl = 0
+        body = {'items': [{'track': {'uri': 'spotify:track:1'}}], 'next': None}
+        connector.session.get.side_effect = [fake_response(body, etag='"v1"'), fake_response(status=304)]
+        connector.get_playlist_tracks('p1')
+        tracks = connector.get_playlist_tracks('p1')
+        self.assertEqual([track.uri for track in tracks], ['spotify:track:1'])
+        self.assertEqual(connector.session.get.call_args.kwargs['headers']['If-None-Match'], '"v1"')
+        self.assertEqual(connector.cache_stats()['revalidated'], 1)
+
+    def test_track_records_are_compact(self):
+        """Test that playlist items become hashable records and unplayable items are skipped"""
+        item = {
+            'added_at': '2024-01-01',
+            'track': {
+                'uri': 'spotify:track:1', 'id': '1', 'name': 'Song',
+                'artists': [{'id': 'a1', 'name': 'Artist'}],
+                'duration_ms': 1000, 'popularity': 50, 'album': {'images': []}
+            }
+        }
+        self.assertEqual(Track.from_item(item), Track('spotify:track:1', '1', 'Song', ('a1',), 1000, 50))
+        self.assertIsNone(Track.from_item({'track': None}))
+        self.assertIsNone(Track.from_item({'is_local': True, 'track': {'uri': 'spotify:local:x'}}))
+        hash(Track.from_item(item))
+
+    def test_playlist_tracks_are_deduplicated_by_uri(self):
+        """Test that create_mood_playlist adds each track URI once, in first-seen order"""
+        connector = make_connector()
+        connector.get_user_token = mock.Mock(return_value={'access_token': 'token'})
+        connector.sp_user.current_user.return_value = {'id': 'user'}
+        connector.sp_user.user_playlist_create.return_value = {'id': 'new'}
+        connector.sp_user.playlist_add_items.return_value = {'snapshot_id': 'snap'}
+
+        def get(url, params=None, **kwargs):
+            if url.endswith('/search'):
+                genre = params['q']
+                return fake_response({'playlists': {'items': [{'id': genre, 'name': genre, 'description': ''}]}})
+            uris = ['spotify:track:shared', f'spotify:track:{len(url)}']
+            return fake_response({'items': [{'track': {'uri': uri}} for uri in uris], 'next': None})
+
+        connector.session.get.side_effect = get
+        with mock.patch('spotify_connector.load_mood_genres', return_value={'happy': ('disco', 'funk')}):
+            playlist = connector.create_mood_playlist('happy')
+        uris = connector.sp_user.playlist_add_items.call_args.args[1]
+        self.assertEqual(uris[0], 'spotify:track:shared')
+        self.assertEqual(len(uris), len(set(uris)))
+        self.assertEqual(playlist['tracks_added'], len(uris))
+        connector.sp_user.playlist_add_items.assert_called_once()
+        self.assertEqual(connector.sp_user.playlist_add_items.call_args.args[0], 'new')
+
+    def test_clients_share_one_pooled_session(self):
+        """Test that every Spotify client uses the shared keep-alive session"""
+        env = {'SPOTIFY_CLIENT_ID': 'id', 'SPOTIFY_CLIENT_SECRET': 'secret', 'SPOTIFY_POOL_PATH': ''}
+        with mock.patch.dict(os.environ, env):
+            first, second = SpotifyConnector(), SpotifyConnector()
+        session = spotify_connector.get_spotify_session()
+        self.assertIs(first.session, session)
+        self.assertIs(first.sp._session, session)
+        self.assertIs(first.sp_user._session, session)
+        self.assertIs(second.sp._session, session)
+        self.assertEqual(spotify_connector.session_stats()['in_flight'], 0)
+        self.assertNotIn('POST', session.get_adapter('https://api.spotify.com').max_retries.allowed_methods)
+
+    def test_delete_reuses_user_client(self):
+        """Test that deleting a playlist doesn't build a new client"""
+        connector = make_connector()
+        connector.get_user_token = mock.Mock(return_value={'access_token': 'token'})
+        connector.created_playlists = ['pl']
+        with mock.patch('spotify_connector.spotipy.Spotify') as client:
+            self.assertTrue(connector.delete_playlist('pl'))
+        client.assert_not_called()
+        connector.sp_user.current_user_unfollow_playlist.assert_called_once_with('pl')
+        self.assertEqual(connector.created_playlists, [])
+
+    def test_warm_pool_skips_live_search(self):
+        """Test that a warm candidate pool fills a playlist as large as a live search would, without searching"""
+        connector = make_connector()
+        connector.get_user_token = mock.Mock(return_value={'access_token': 'token'})
+        connector.sp_user.current_user.return_value = {'id': 'user'}
+        connector.sp_user.user_playlist_create.return_value = {'id': 'new'}
+        connector.sp_user.playlist_add_items.return_value = {'snapshot_id': 'snap'}
+        connector.candidate_pools.put('happy', [Track(f'spotify:track:{i}', str(i), '', (), 0, 0) for i in range(1000)])
+        live_size = len(connector.mood_genres['happy']) * connector.LIVE_PLAYLISTS_PER_GENRE * connector.LIVE_TRACKS_PER_PLAYLIST
+
+        playlist = connector.create_mood_playlist('happy')
+        connector.session.get.assert_not_called()
+        self.assertEqual(playlist['tracks_added'], live_size)
+
+        connector.playlist_size = 30
+        connector.sp_user.playlist_add_items.reset_mock()
+        self.assertEqual(connector.create_mood_playlist('happy')['tracks_added'], 30)
+        connector.sp_user.playlist_add_items.assert_called_once()
+
+    def test_warmer_builds_pools_in_background_priority(self):
+        """Test that warming a mood stores its candidates and uses background requests"""
+        connector = make_connector()
+        connector.search_playlists_by_genre = mock.Mock(return_value=[{'id': 'p1'}])
+        connector.get_playlist_tracks = mock.Mock(return_value=[Track('spotify:track:1', '1', '', (), 0, 0)])
+        with mock.patch('spotify_connector.load_mood_genres', return_value={'sad': ('blues',)}):
+            self.assertEqual(connector.warm_mood_pool('sad'), 1)
+        self.assertEqual(connector.search_playlists_by_genre.call_args.kwargs['priority'], RequestScheduler.BACKGROUND)
+        self.assertEqual(len(connector.candidate_pools.get('sad')), 1)
+
+    def test_pool_store_persists_to_disk(self):
+        """Test that pools written to disk are restored as Track records"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'pools.sqlite3')
+            track = Track('spotify:track:1', '1', 'Song', ('a1',), 1000, 5)
+            CandidatePoolStore(path).put('happy', [track])
+            self.assertEqual(CandidatePoolStore(path).get('happy'), (track,))
+            self.assertIsNone(CandidatePoolStore(path, max_age=-1).get('happy'))
+
+class TestUserToken(unittest.TestCase):
+    def make_oauth(self, cached):
+        oauth = mock.Mock()
+        oauth.cache_handler.get_cached_token.return_value = cached
+        oauth.refresh_access_token.side_effect = lambda refresh: {
+            'access_token': 'refreshed', 'refresh_token': refresh, 'expires_at': time.time() + 3600
+        }
+        return oauth
+
+    def test_valid_token_served_from_memory(self):
+        """Test that a valid token is loaded from disk once and then served from memory"""
+        oauth = self.make_oauth({'access_token': 'a', 'refresh_token': 'r', 'expires_at': time.time() + 3600})
+        manager = TokenManager(oauth)
+        self.assertEqual(manager.get()['access_token'], 'a')
+        self.assertEqual(manager.get_access_token(as_dict=False), 'a')
+        oauth.cache_handler.get_cached_token.assert_called_once()
+        oauth.refresh_access_token.assert_not_called()
+
+    def test_expired_token_is_refreshed(self):
+        """Test that an expired cached token is refreshed before use"""
+        oauth = self.make_oauth({'access_token': 'old', 'refresh_token': 'r', 'expires_at': time.time() - 10})
+        manager = TokenManager(oauth)
+        self.assertEqual(manager.get()['access_token'], 'refreshed')
+        self.assertEqual(manager.refreshes, 1)
+
+    def test_token_refreshed_in_background_before_expiry(self):
+        """Test that the background timer refreshes a token nearing expiry"""
+        oauth = self.make_oauth(None)
+        manager = TokenManager(oauth, refresh_margin=300)
+        manager.set({'access_token': 'a', 'refresh_token': 'r', 'expires_at': time.time() + 300.05})
+        deadline = time.monotonic() + 2
+        while manager.refreshes == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(manager.get()['access_token'], 'refreshed')
+
+    def test_callback_listener_returns_code_immediately(self):
+        """Test that authorization completes as soon as the redirect arrives"""
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        redirect_uri = f'http://127.0.0.1:{port}/callback'
+
+        def redirect():
+            for _ in range(50):
+                try:
+                    urllib.request.urlopen(redirect_uri + '?code=abc', timeout=1).read()
+                    return
+                except OSError:
+                    time.sleep(0.02)
+
+        threading.Thread(target=redirect, daemon=True).start()
+        start = time.monotonic()
+        self.assertEqual(wait_for_authorization_code(redirect_uri, timeout=5), 'abc')
+        self.assertLess(time.monotonic() - start, 3)
+
+    def test_callback_listener_ignores_stray_requests(self):
+        """Test that requests off the redirect path, without a code or with the wrong state, don't end the wait"""
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        redirect_uri = f'http://127.0.0.1:{port}/callback'
+        statuses = []
+
+        def redirect():
+            for path in ('/favicon.ico', '/callback', '/callback?code=forged&state=other', '/callback?code=abc&state=expected'):
+                for _ in range(50):
+                    try:
+                        statuses.append(urllib.request.urlopen(f'http://127.0.0.1:{port}{path}', timeout=1).status)
+                        break
+                    except urllib.error.HTTPError as e:
+                        statuses.append(e.code)
+                        break
+                    except OSError:
+                        time.sleep(0.02)
+
+        requests_thread = threading.Thread(target=redirect, daemon=True)
+        requests_thread.start()
+        self.assertEqual(wait_for_authorization_code(redirect_uri, timeout=5, state='expected'), 'abc')
+        requests_thread.join(5)
+        self.assertEqual(statuses, [404, 404, 400, 200])
+
+class TestRequestScheduler(unittest.TestCase):
+    def test_calls_are_metered_by_the_bucket(self):
+        """Test that calls beyond the burst wait for the bucket to refill"""
+        scheduler = RequestScheduler(rate=50, burst=2)
+        start = time.monotonic()
+        for _ in range(5):
+            scheduler.call(lambda: None)
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+        self.assertGreaterEqual(scheduler.stats()['delayed'], 2)
+
+    def test_retry_after_is_honored(self):
+        """Test that a 429 pauses the scheduler for Retry-After before retrying"""
+        scheduler = RequestScheduler(rate=1000, burst=10)
+        fn = mock.Mock(side_effect=[SpotifyException(429, -1, 'slow down', headers={'Retry-After': '0.2'}), 'ok'])
+        start = time.monotonic()
+        self.assertEqual(scheduler.call(fn), 'ok')
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+        self.assertEqual(scheduler.stats()['throttled'], 1)
+
+    def test_other_errors_are_not_retried(self):
+        """Test that non-429 errors are raised straight away"""
+        scheduler = RequestScheduler()
+        fn = mock.Mock(side_effect=SpotifyException(404, -1, 'missing'))
+        with self.assertRaises(SpotifyException):
+            scheduler.call(fn)
+        fn.assert_called_once()
+
+    def test_interactive_calls_go_first(self):
+        """Test that waiting interactive calls are served before background calls"""
+        scheduler = RequestScheduler(rate=20, burst=1)
+        scheduler.call(lambda: None)
+        order = []
+
+        def run(name, priority):
+            scheduler.call(order.append, name, priority=priority)
+
+        background = threading.Thread(target=run, args=('background', RequestScheduler.BACKGROUND))
+        background.start()
+        time.sleep(0.01)
+        interactive = [threading.Thread(target=run, args=(f'interactive{i}', RequestScheduler.INTERACTIVE)) for i in range(2)]
+        for thread in interactive:
+            thread.start()
+        for thread in [background] + interactive:
+            thread.join()
+        self.assertEqual(order[-1], 'background')
+
+class TestBenchmark(unittest.TestCase):
+    def setUp(self):
+        # benchmark sets hermetic defaults in os.environ on import; keep them out of other tests
+        with mock.patch.dict(os.environ):
+            import benchmark
+        self.benchmark = benchmark
+
+    def test_summary_percentiles(self):
+        """Test that latency percentiles use nearest rank and are reported in milliseconds"""
+        summary = self.benchmark.summarize([i / 1000 for i in range(1, 101)], 2048)
+        self.assertAlmostEqual(summary['p50_ms'], 50)
+        self.assertAlmostEqual(summary['p95_ms'], 95)
+        self.assertAlmostEqual(summary['p99_ms'], 99)
+        self.assertEqual(summary['peak_memory_kb'], 2)
+
+    def test_playlist_creation_runs_offline(self):
+        """Test that the stand-in transport serves a full playlist creation"""
+        session = self.benchmark.FakeSpotifySession(playlists_per_search=2, tracks_per_playlist=150)
+        env = {'SPOTIFY_CLIENT_ID': 'id', 'SPOTIFY_CLIENT_SECRET': 'secret', 'SPOTIFY_POOL_PATH': '', 'SPOTIFY_CACHE_PATH': ''}
+        with mock.patch.dict(os.environ, env):
+            connector = self.benchmark.make_connector(session)
+        playlist = connector.create_mood_playlist('happy')
+        self.assertEqual(playlist['tracks_added'], len(set(connector.collect_mood_tracks('happy', connector.mood_genres['happy']).uris())))
+        self.assertGreater(session.requests, 0)
+
+class TestStubServer(unittest.TestCase):
+    def setUp(self):
+        from spotify_stub_server import StubSpotifyServer, SyntheticCatalog
+        self.server = StubSpotifyServer(SyntheticCatalog(tracks=1000, playlists_per_genre=3, tracks_per_playlist=150)).start()
+        self.addCleanup(self.server.stop)
+        env = {
+            'SPOTIFY_CLIENT_ID': 'id',
+            'SPOTIFY_CLIENT_SECRET': 'secret',
+            'SPOTIFY_API_URL': self.server.api_url,
+            'SPOTIFY_ACCOUNTS_URL': self.server.accounts_url,
+            'SPOTIFY_POOL_PATH': '',
+            'SPOTIFY_TOKEN_CACHE_PATH': ''
+        }
+        with mock.patch.dict(os.environ, env):
+            self.connector = SpotifyConnector()
+        self.connector.scheduler = RequestScheduler(rate=1000, burst=1000)
+        self.connector.token_manager.set(self.connector.oauth_manager.get_access_token('code', as_dict=True, check_cache=False))
+
+    def test_playlist_creation_against_stand_in(self):
+        """Test that the connector searches, pages and writes against the local stand-in"""
+        tracks = self.connector.get_playlist_tracks(self.connector.search_playlists_by_genre('jazz')[0]['id'], limit=120)
+        self.assertEqual(len(tracks), 120)
+        playlist = self.connector.create_mood_playlist('happy')
+        self.assertGreater(playlist['tracks_added'], 100)
+        stored = self.server.user_playlists[playlist['id']]
+        self.assertEqual(len(stored['uris']), playlist['tracks_added'])
+
+    def test_write_cap_and_throttling(self):
+        """Test that writes over 100 items or to unknown playlists are rejected, and throttled requests carry Retry-After"""
+        user_client = self.connector.sp_user
+        created = user_client.user_playlist_create('stub-user', 'Cap test')
+        with self.assertRaises(SpotifyException) as raised:
+            user_client.playlist_add_items(created['id'], [f'spotify:track:t{i:09d}' for i in range(101)])
+        self.assertEqual(raised.exception.http_status, 400)
+
+        with self.assertRaises(SpotifyException) as raised:
+            user_client.playlist_add_items('missing', ['spotify:track:t000000001'])
+        self.assertEqual(raised.exception.http_status, 404)
+        self.assertIsNone(self.connector.get_track_preview('t000000001'))
+        self.assertEqual(self.server.counts['track'], 1)
+
+        self.server.rate_limit, self.server._tokens = 1, 0
+        response = self.connector.session.get(self.server.api_url + 'me', headers={'Authorization': 'Bearer token'})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '1')
+
+class TestAsyncSpotifyConnector(unittest.TestCase):
+    def setUp(self):
+        from async_spotify_connector import AsyncRequestScheduler, AsyncSpotifyConnector
+        from spotify_stub_server import StubSpotifyServer, SyntheticCatalog
+        self.server = StubSpotifyServer(SyntheticCatalog(tracks=1000, playlists_per_genre=3, tracks_per_playlist=150)).start()
+        self.addCleanup(self.server.stop)
+        env = {
+            'SPOTIFY_CLIENT_ID': 'id',
+            'SPOTIFY_CLIENT_SECRET': 'secret',
+            'SPOTIFY_API_URL': self.server.api_url,
+            'SPOTIFY_ACCOUNTS_URL': self.server.accounts_url,
+            'SPOTIFY_POOL_PATH': '',
+            'SPOTIFY_TOKEN_CACHE_PATH': ''
+        }
+        with mock.patch.dict(os.environ, env):
+            connector = SpotifyConnector()
+        connector.token_manager.set(connector.oauth_manager.get_access_token('code', as_dict=True, check_cache=False))
+        self.spotify = AsyncSpotifyConnector(connector)
+        self.spotify.scheduler = AsyncRequestScheduler(rate=10000, burst=10000)
+
+    def run_async(self, coroutine_fn):
+        async def run():
+            async with self.spotify:
+                return await coroutine_fn()
+        return asyncio.run(run())
+
+    def test_operations_against_stand_in(self):
+        """Test that every coroutine searches, pages, writes and deletes against the local stand-in"""
+        async def scenario():
+            playlists = await self.spotify.search_playlists_by_genre('jazz', mood='happy')
+            tracks = await self.spotify.get_playlist_tracks(playlists[0]['id'], limit=120)
+            preview = await self.spotify.get_track_preview(tracks[0].id)
+            created = await self.spotify.create_mood_playlist('happy')
+            stored = list(self.server.user_playlists[created['id']]['uris'])
+            deleted = await self.spotify.delete_playlist(created['id'])
+            return playlists, tracks, preview, created, stored, deleted
+
+        playlists, tracks, preview, created, stored, deleted = self.run_async(scenario)
+        self.assertEqual(playlists, self.spotify.connector.playlist_index.top('happy', 5, [p['id'] for p in playlists]))
+        self.assertEqual(len(tracks), 120)
+        self.assertIsNone(preview)
+        self.assertEqual(self.server.counts['track'], 1)
+        self.assertGreater(created['tracks_added'], 100)
+        self.assertEqual(len(stored), created['tracks_added'])
+        self.assertTrue(deleted)
+        self.assertNotIn(created['id'], self.server.user_playlists)
+        self.assertNotIn(created['id'], self.spotify.created_playlists)
+
+    def test_many_calls_share_one_loop_and_pool(self):
+        """Test that a thousand concurrent calls complete on one event loop over the shared pool"""
+        from async_spotify_connector import async_session_stats
+
+        async def scenario():
+            previews = await asyncio.gather(*(self.spotify.get_track_preview(f't{i:09d}') for i in range(1000)))
+            return previews, async_session_stats()
+
+        previews, pool = self.run_async(scenario)
+        self.assertEqual(previews, [None] * 1000)
+        self.assertEqual(self.server.counts['track'], 1000)
+        self.assertEqual(pool['requests'], 1000)
+        self.assertLessEqual(pool['connections_opened'], pool['pool_size'])
+        self.assertEqual(pool['connections_opened'] + pool['connections_reused'], 1000)
+        self.assertEqual(self.server.counts['token'], 2)
+
+    def test_connector_is_reusable_across_event_loops(self):
+        """Test that a connector keeps working when each batch of calls runs on a new event loop"""
+        for _ in range(2):
+            self.spotify._tokens.clear()
+            previews = self.run_async(lambda: asyncio.gather(*(self.spotify.get_track_preview(f't{i:09d}') for i in range(20))))
+            self.assertEqual(previews, [None] * 20)
+        self.assertEqual(self.server.counts['track'], 40)
+
+    def test_skipped_items_do_not_shorten_the_limit(self):
+        """Test that local or removed items in a full first page are made up from the next page"""
+        first = [{'track': {'uri': f'spotify:track:{i}'}} for i in range(8)]
+        pages = {
+            'playlists/p1/tracks': {'items': first + [{'track': None}, {'is_local': True, 'track': {'uri': 'spotify:local:x'}}], 'next': 'https://next/2'},
+            'https://next/2': {'items': [{'track': {'uri': f'spotify:track:{i}'}} for i in range(8, 18)], 'next': None}
+        }
+
+        async def cached_get(url, params=None, priority=None):
+            return pages[url]
+
+        self.spotify._cached_get = cached_get
+        tracks = self.run_async(lambda: self.spotify.get_playlist_tracks('p1', limit=10))
+        self.assertEqual([track.uri for track in tracks], [f'spotify:track:{i}' for i in range(10)])
+
+    def test_server_errors_do_not_resend_writes(self):
+        """Test that 5xx answers are retried for reads but never for POSTs"""
+        import async_spotify_connector
+        statuses = []
+
+        class Response:
+            status = 503
+            headers = {}
+            url = 'stub'
+
+            async def read(self):
+                return b''
+
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *exc):
+                return False
+
+        class Session:
+            def request(self, method, url, **kwargs):
+                statuses.append(method)
+                return Response()
+
+        async def scenario():
+            with mock.patch.object(async_spotify_connector, 'get_async_session', Session), \
+                 mock.patch.object(async_spotify_connector, 'RETRY_BACKOFF', 0):
+                for method in ('POST', 'GET'):
+                    with self.assertRaises(SpotifyException):
+                        await self.spotify._request(method, 'playlists/p1/items')
+
+        self.run_async(scenario)
+        self.assertEqual(statuses.count('POST'), 1)
+        self.assertEqual(statuses.count('GET'), async_spotify_connector.RETRY_ATTEMPTS + 1)
+
+    def test_background_calls_wait_for_interactive_ones(self):
+        """Test that a background call is only let through once queued interactive calls have gone"""
+        from async_spotify_connector import AsyncRequestScheduler
+        scheduler = AsyncRequestScheduler(rate=20, burst=1)
+        order = []
+
+        async def acquire(name, priority):
+            await scheduler.acquire(priority)
+            order.append(name)
+
+        async def scenario():
+            await asyncio.gather(
+                acquire('first', scheduler.INTERACTIVE),
+                acquire('second', scheduler.INTERACTIVE),
+                acquire('background', scheduler.BACKGROUND)
+            )
+
+        asyncio.run(scenario())
+        self.assertEqual(order, ['first', 'second', 'background'])
+
+    def test_throttled_calls_are_retried(self):
+        """Test that 429s pause the async scheduler and the calls succeed after Retry-After"""
+        self.server.rate_limit, self.server._tokens = 10, 10
+        previews = self.run_async(lambda: asyncio.gather(*(self.spotify.get_track_preview(f't{i:09d}') for i in range(15))))
+        self.assertEqual(self.server.counts['track'], 15)
+        self.assertGreater(self.spotify.scheduler.throttled, 0)
+
+class TestCassette(unittest.TestCase):
+    def make_connector(self, session, server_url):
+        env = {
+            'SPOTIFY_CLIENT_ID': 'id',
+            'SPOTIFY_CLIENT_SECRET': 'secret',
+            'SPOTIFY_API_URL': server_url + '/v1/',
+            'SPOTIFY_ACCOUNTS_URL': server_url,
+            'SPOTIFY_POOL_PATH': '',
+            'SPOTIFY_TOKEN_CACHE_PATH': ''
+        }
+        with mock.patch.object(spotify_connector, '_session', session), mock.patch.dict(os.environ, env):
+            connector = SpotifyConnector()
+        connector.scheduler = RequestScheduler(rate=1000, burst=1000)
+        connector.token_manager.set(connector.oauth_manager.get_access_token('code', as_dict=True, check_cache=False))
+        return connector
+
+    def test_spotify_calls_replay_without_the_server(self):
+        """Test that a recorded playlist creation replays offline with redacted tokens"""
+        from spotify_stub_server import StubSpotifyServer, SyntheticCatalog
+        from transport import Cassette, CassetteSession
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cassette.json.gz')
+            with StubSpotifyServer(SyntheticCatalog(tracks=1000, playlists_per_genre=2, tracks_per_playlist=20)) as server:
+                url = server.base_url
+                recording = Cassette(path, Cassette.RECORD)
+                connector = self.make_connector(CassetteSession(spotify_connector.requests.Session(), recording), url)
+                recorded = connector.create_mood_playlist('happy')
+                recording.save()
+
+            replaying = Cassette(path, Cassette.REPLAY, latency=0)
+            connector = self.make_connector(CassetteSession(spotify_connector.requests.Session(), replaying), url)
+            replayed = connector.create_mood_playlist('happy')
+            self.assertEqual(replayed['id'], recorded['id'])
+            self.assertEqual(replayed['tracks_added'], recorded['tracks_added'])
+            self.assertEqual(replaying.stats()['misses'], 0)
+            self.assertEqual(connector.token_manager.get()['access_token'], 'recorded')
+
+    def test_model_calls_replay(self):
+        """Test that generate_content answers are recorded and replayed by prompt"""
+        from transport import Cassette, CassetteMissError, CassetteModel
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cassette.json.gz')
+            model = mock.Mock()
+            model.generate_content.side_effect = lambda prompt: mock.Mock(text=f'answer to {prompt}')
+            recording = Cassette(path, Cassette.RECORD)
+            CassetteModel(model, recording, 'gemini').generate_content('one')
+            CassetteModel(model, recording, 'gemini').generate_content('two')
+            recording.save()
+
+            replayed = CassetteModel(None, Cassette(path, Cassette.REPLAY, latency=0), 'gemini')
+            self.assertEqual(replayed.generate_content('two').text, 'answer to two')
+            self.assertEqual(replayed.generate_content('one').text, 'answer to one')
+            with self.assertRaises(CassetteMissError):
+                CassetteModel(None, Cassette(path, Cassette.REPLAY), 'other-model').generate_content('one')
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        self.addCleanup(metrics.disable)
+
+    def test_disabled_metrics_record_nothing(self):
+        """Test that timers are shared no-ops while metrics are disabled"""
+        metrics.disable()
+        self.assertIs(metrics.timer('a'), metrics.timer('b'))
+        keyword_based_detection("I'm so happy today")
+        self.assertEqual(metrics.render(), '\n')
+
+    def test_stage_timings_and_errors_in_prometheus_format(self):
+        """Test that stage timings, calls, errors and counters render as Prometheus text"""
+        metrics.enable()
+        keyword_based_detection("I'm so happy today")
+        with self.assertRaises(ValueError):
+            with metrics.timer('failing'):
+                raise ValueError()
+        mood_mapper.get_genres_for_mood('happy')
+
+        text = metrics.render()
+        self.assertIn('# TYPE mood_stage_duration_seconds histogram', text)
+        self.assertIn('mood_stage_duration_seconds_bucket{stage="keyword_scoring",le="+Inf"} 1', text)
+        self.assertIn('mood_stage_calls_total{stage="genre_lookup"} 1', text)
+        self.assertIn('mood_stage_errors_total{stage="failing"} 1', text)
+        self.assertNotIn('mood_stage_errors_total{stage="keyword_scoring"}', text)
+
+    def test_metrics_endpoint_and_file(self):
+        """Test that metrics are served over HTTP and can be dumped to a file"""
+        metrics.enable()
+        metrics.inc('requests_total', help_text='Requests', route='search')
+        server = metrics.serve(port=0)
+        url = f'http://127.0.0.1:{server.server_address[1]}/metrics'
+        with urllib.request.urlopen(url) as response:
+            self.assertIn('requests_total{route="search"} 1', response.read().decode())
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'metrics.prom')
+            metrics.write(path)
+            with open(path) as file:
+                self.assertIn('# HELP requests_total Requests', file.read())
+
+    def test_settings_from_dotenv_apply_after_import(self):
+        """Test that METRICS_ENABLED and METRICS_FILE loaded from .env after import still take effect"""
+        from dotenv import load_dotenv
+        metrics.disable()
+        self.addCleanup(setattr, metrics, '_dump_path', metrics._dump_path)
+        metrics._dump_path = None
+        with tempfile.TemporaryDirectory() as directory:
+            env_file = os.path.join(directory, '.env')
+            dump = os.path.join(directory, 'metrics.prom')
+            with open(env_file, 'w') as file:
+                file.write(f'METRICS_ENABLED=1\nMETRICS_FILE={dump}\n')
+            with mock.patch.dict(os.environ, {}), mock.patch('metrics.atexit.register') as register:
+                for name in ('METRICS_ENABLED', 'METRICS_FILE', 'METRICS_PORT'):
+                    os.environ.pop(name, None)
+                load_dotenv(env_file)
+                metrics.start_from_env()
+                metrics.start_from_env()
+        self.assertTrue(metrics.enabled())
+        register.assert_called_once_with(metrics.write, dump)
+
+class TestTagMoods(unittest.TestCase):
+    def run_cli(self, *args):
+        import tag_moods
+        with mock.patch('sys.stderr'):
+            return tag_moods.main(list(args))
+
+    def test_jsonl_tagging_keeps_order_and_resumes(self):
+        """Test that records come back in order with genres, and a checkpoint resumes without duplicates"""
+        texts = ["I'm so happy and excited today!", "Feeling really sad and lonely", "I miss the good old days"] * 5
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, 'posts.jsonl')
+            with open(source, 'w') as file:
+                for i, text in enumerate(texts):
+                    file.write(json.dumps({'id': i, 'text': text}) + '\n')
+                file.write('not json\n')
+            full = os.path.join(directory, 'full.jsonl')
+            self.run_cli(source, '-o', full, '--keyword-only', '--workers', '2', '--chunk-size', '4')
+            with open(full) as file:
+                rows = [json.loads(line) for line in file]
+            self.assertEqual([row.get('id') for row in rows], list(range(len(texts))) + [None])
+            self.assertEqual(rows[0]['mood'], keyword_based_detection(texts[0])[0])
+            self.assertEqual(rows[0]['genres'], mood_mapper.get_genres_for_mood(rows[0]['mood']))
+            self.assertIsNone(rows[-1]['mood'])
+
+            # Simulate a run interrupted after two chunks, with a partial line written after the checkpoint
+            resumed = os.path.join(directory, 'resumed.jsonl')
+            checkpoint = os.path.join(directory, 'resumed.ckpt')
+            with open(full, 'rb') as file:
+                lines = file.readlines()
+            with open(resumed, 'wb') as file:
+                file.write(b''.join(lines[:8]) + lines[8][:10])
+            with open(checkpoint, 'w') as file:
+                json.dump({'records': 8, 'output_bytes': len(b''.join(lines[:8]))}, file)
+            self.run_cli(source, '-o', resumed, '--keyword-only', '--workers', '0', '--chunk-size', '4', '--checkpoint', checkpoint)
+            with open(full, 'rb') as expected, open(resumed, 'rb') as actual:
+                self.assertEqual(actual.read(), expected.read())
+
+            # A checkpoint whose output file is gone starts over instead of padding the gap
+            os.remove(resumed)
+            with open(checkpoint, 'w') as file:
+                json.dump({'records': 8, 'output_bytes': len(b''.join(lines[:8]))}, file)
+            self.run_cli(source, '-o', resumed, '--keyword-only', '--workers', '0', '--chunk-size', '4', '--checkpoint', checkpoint)
+            with open(full, 'rb') as expected, open(resumed, 'rb') as actual:
+                self.assertEqual(actual.read(), expected.read())
+
+    def test_csv_tagging(self):
+        """Test that CSV input gets mood and genre columns"""
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, 'posts.csv')
+            with open(source, 'w') as file:
+                file.write('id,text\n1,"I\'m so happy, truly happy"\n2,Feeling really sad\n')
+            output = os.path.join(directory, 'tagged.csv')
+            self.run_cli(source, '-o', output, '--keyword-only', '--workers', '0')
+            with open(output) as file:
+                rows = list(csv.DictReader(file))
+            self.assertEqual([row['id'] for row in rows], ['1', '2'])
+            self.assertEqual(rows[0]['mood'], 'happy')
+            self.assertEqual(rows[0]['genres'].split('|'), mood_mapper.get_genres_for_mood('happy'))
+
 if __name__ == '__main__':
     unittest.main() 
\ No newline at end of file
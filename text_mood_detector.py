@@ -4,6 +4,11 @@ import time
 from dotenv import load_dotenv
 from collections import Counter
 import re
+import numpy as np
+import threading
+import concurrent.futures
+from gemini_client import CircuitBreaker, RequestCoalescer, get_model_pool, get_verdict_cache, verdict_key
+import metrics
 
 # Load environment variables
 load_dotenv()
@@ -55,6 +60,58 @@ MOOD_KEYWORDS = {
     }
 }
 
+class KeywordMatcher:
+    """
+    Precompiled multi-pattern matcher built once from a MOOD_KEYWORDS-style mapping.
+
+    Every keyword and exclusion, single words and multi-word phrases alike, is
+    folded into one alternation regex with word boundaries, so a text is scanned
+    in a single linear pass no matter how many moods or keywords there are.
+    """
+
+    def __init__(self, mood_keywords):
+        self.moods = list(mood_keywords)
+        # Canonical term -> list of (mood index, is_exclusion)
+        self.targets = {}
+        for index, (mood, data) in enumerate(mood_keywords.items()):
+            for term, is_exclusion in [(k, False) for k in data['keywords']] + [(k, True) for k in data.get('exclude', [])]:
+                term = ' '.join(term.lower().split())
+                entries = self.targets.setdefault(term, [])
+                if (index, is_exclusion) not in entries:
+                    entries.append((index, is_exclusion))
+
+        # Longest terms first so phrases win over the words they contain
+        terms = sorted(self.targets, key=lambda term: (-len(term), term))
+        alternation = '|'.join(r'\s+'.join(re.escape(word) for word in term.split()) for term in terms)
+        self.pattern = re.compile(r'\b(?:' + alternation + r')\b')
+
+    def find_terms(self, text):
+        """Yield the canonical keyword/exclusion terms found in text, in order."""
+        for match in self.pattern.finditer(text.lower().replace('\u2019', "'")):
+            term = match.group()
+            yield term if ' ' not in term else ' '.join(term.split())
+
+    def count(self, text):
+        """
+        Count keyword hits and exclusion hits for every mood in one pass.
+
+        Returns:
+            Dict mapping mood -> (hits, exclusions)
+        """
+        hits = [0] * len(self.moods)
+        exclusions = [0] * len(self.moods)
+        for term in self.find_terms(text):
+            for index, is_exclusion in self.targets[term]:
+                if is_exclusion:
+                    exclusions[index] += 1
+                else:
+                    hits[index] += 1
+        return {mood: (hits[i], exclusions[i]) for i, mood in enumerate(self.moods)}
+
+# Built once at import time and shared by every detection call
+KEYWORD_MATCHER = KeywordMatcher(MOOD_KEYWORDS)
+
+@metrics.timed('keyword_scoring')
 def keyword_based_detection(text):
     """
     Detect mood using keyword matching with improved confidence scoring.
@@ -63,21 +120,15 @@ def keyword_based_detection(text):
     if not text or text.isspace():
         return 'neutral', 1.0
 
-    # Clean and normalize text
-    text = text.lower()
-    words = re.findall(r'\w+', text)
-    phrases = [text[i:i+3] for i in range(len(text)-2)]  # Look for 3-word phrases
+    # Count keyword and phrase matches for each mood in a single pass
+    counts = KEYWORD_MATCHER.count(text)
     
-    # Count keyword matches for each mood
     mood_scores = {}
     for mood, data in MOOD_KEYWORDS.items():
-        # Count positive matches (both words and phrases)
-        word_matches = sum(1 for word in words if word in data['keywords'])
-        phrase_matches = sum(1 for phrase in phrases if any(keyword in phrase for keyword in data['keywords']))
-        matches = word_matches + phrase_matches
+        matches, excluded = counts[mood]
         
         # Subtract points for excluded words (increased penalty)
-        excluded_matches = sum(3 for word in words if word in data.get('exclude', []))
+        excluded_matches = excluded * 3
         
         # Calculate final score with improved weighting
         base_score = matches * 2.5 - excluded_matches
@@ -111,19 +162,101 @@ def keyword_based_detection(text):
     
     return max_mood, confidence
 
-def ml_based_detection(text):
+# Vocabulary and term x mood score matrix for vectorized batch scoring
+KEYWORD_VOCABULARY = sorted(KEYWORD_MATCHER.targets)
+_TERM_INDEX = {term: i for i, term in enumerate(KEYWORD_VOCABULARY)}
+_TERM_SCORES = np.zeros((len(KEYWORD_VOCABULARY), len(KEYWORD_MATCHER.moods)))
+for _term, _entries in KEYWORD_MATCHER.targets.items():
+    for _index, _is_exclusion in _entries:
+        _TERM_SCORES[_TERM_INDEX[_term], _index] += -3 if _is_exclusion else 2.5
+_MOOD_WEIGHTS = np.array([MOOD_KEYWORDS[mood]['weight'] for mood in KEYWORD_MATCHER.moods])
+_NEUTRAL_INDEX = KEYWORD_MATCHER.moods.index('neutral')
+
+def _score_batch(texts):
+    """Score a list of texts with one sparse count matrix and one matrix product."""
+    # Tokenize the whole batch into (document, term) coordinates
+    rows, cols = [], []
+    for row, text in enumerate(texts):
+        if not text:
+            continue
+        for term in KEYWORD_MATCHER.find_terms(text):
+            rows.append(row)
+            cols.append(_TERM_INDEX[term])
+
+    # Document x keyword count matrix, accumulated from the sparse coordinates
+    n_docs, n_terms = len(texts), len(KEYWORD_VOCABULARY)
+    flat = np.asarray(rows, dtype=np.int64) * n_terms + np.asarray(cols, dtype=np.int64)
+    counts = np.bincount(flat, minlength=n_docs * n_terms).reshape(n_docs, n_terms)
+
+    base_scores = counts @ _TERM_SCORES
+    base_scores[:, _NEUTRAL_INDEX] = np.where(base_scores[:, _NEUTRAL_INDEX] <= 0, 1, base_scores[:, _NEUTRAL_INDEX])
+    scores = base_scores * _MOOD_WEIGHTS
+
+    best = np.argmax(scores, axis=1)
+    max_scores = scores[np.arange(n_docs), best]
+    # Accumulate in mood order so totals match the scalar sum() exactly
+    total_scores = np.zeros(n_docs)
+    for column in range(scores.shape[1]):
+        total_scores += np.abs(scores[:, column])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        confidences = np.where(total_scores > 0, np.abs(max_scores) / total_scores, 0.0)
+
+    # Same neutral fallbacks as keyword_based_detection
+    blank = np.array([not text or text.isspace() for text in texts], dtype=bool)
+    neutral = (
+        blank
+        | np.all(scores <= 0, axis=1)
+        | (max_scores < 1.5)
+        | ((confidences < 0.3) & ~np.any(scores > 2, axis=1))
+    )
+    moods = np.array(KEYWORD_MATCHER.moods, dtype=object)[best]
+    moods[neutral] = 'neutral'
+    confidences[neutral] = 1.0
+    return moods, confidences
+
+@metrics.timed('keyword_scoring_batch')
+def detect_moods(texts, batch_size=4096):
     """
-    Detect mood using the Gemini model with improved prompt.
+    Keyword-based mood detection for many texts at once.
+
+    Each chunk of texts is tokenized once into a document x keyword count
+    matrix and scored with a single matrix product. Results are identical
+    to calling keyword_based_detection on every text.
+
+    Args:
+        texts: Iterable of input strings
+        batch_size: Number of texts scored per matrix product
+
+    Returns:
+        (moods, confidences) as NumPy arrays aligned with the input order
     """
-    try:
-        model = genai.GenerativeModel(model_name="gemini-2.0-flash",
-                                    generation_config={
-                                        "temperature": 0.1,
-                                        "top_p": 0.1,
-                                        "top_k": 1
-                                    })
-
-        prompt = f"""
+    mood_chunks, confidence_chunks = [], []
+    chunk = []
+    for text in texts:
+        chunk.append(text)
+        if len(chunk) >= batch_size:
+            moods, confidences = _score_batch(chunk)
+            mood_chunks.append(moods)
+            confidence_chunks.append(confidences)
+            chunk = []
+    if chunk or not mood_chunks:
+        moods, confidences = _score_batch(chunk)
+        mood_chunks.append(moods)
+        confidence_chunks.append(confidences)
+    return np.concatenate(mood_chunks), np.concatenate(confidence_chunks)
+
+# Gemini model settings for the ML fallback
+ML_MODEL_NAME = "gemini-2.0-flash"
+ML_GENERATION_CONFIG = {
+    "temperature": 0.1,
+    "top_p": 0.1,
+    "top_k": 1
+}
+
+# Bump when ML_PROMPT changes so cached verdicts from the old prompt are ignored
+ML_PROMPT_VERSION = "mood-v1"
+
+ML_PROMPT = """
         Analyze the following text and determine the primary mood expressed.
         Consider the context and emotional tone carefully.
         Choose EXACTLY ONE mood from: happy, relaxed, neutral, sad, anxious, excited, nostalgic, romantic.
@@ -132,34 +265,178 @@ def ml_based_detection(text):
         Text: {text}
         """
 
-        response = model.generate_content(prompt)
-        detected_mood = response.text.strip().lower()
-        
-        # Validate the detected mood
-        valid_moods = set(MOOD_KEYWORDS.keys())
-        if detected_mood not in valid_moods:
-            return 'neutral'
+ML_BATCH_PROMPT = """
+        Analyze each of the following {count} numbered texts and determine the primary mood expressed in each.
+        Consider the context and emotional tone carefully.
+        Choose EXACTLY ONE mood per text from: happy, relaxed, neutral, sad, anxious, excited, nostalgic, romantic.
+        Respond with exactly {count} lines in the form "<number>: <mood>", nothing else.
         
-        return detected_mood
+        {items}
+        """
 
+def _validate_mood(label):
+    """Map a raw model answer to a known mood, or None if it isn't one."""
+    label = label.strip().lower()
+    return label if label in MOOD_KEYWORDS else None
+
+def _ml_classify_one(text):
+    """
+    Single-text Gemini call; the per-item fallback for batched requests.
+    Returns None if the answer is not a known mood.
+    """
+    with get_model_pool(ML_MODEL_NAME, ML_GENERATION_CONFIG).model() as model:
+        response = model.generate_content(ML_PROMPT.format(text=text))
+    return _validate_mood(response.text)
+
+def _ml_classify_batch(texts):
+    """
+    Classify several texts with one multi-item Gemini prompt.
+    Returns one mood per text, with None where the answer could not be parsed.
+    """
+    if len(texts) == 1:
+        return [_ml_classify_one(texts[0])]
+
+    items = '\n'.join(f"{i}. {' '.join(text.split())}" for i, text in enumerate(texts, 1))
+    with get_model_pool(ML_MODEL_NAME, ML_GENERATION_CONFIG).model() as model:
+        response = model.generate_content(ML_BATCH_PROMPT.format(count=len(texts), items=items))
+
+    labels = [None] * len(texts)
+    for number, label in re.findall(r'^\W*(\d+)\W+([a-z]+)', response.text.lower(), re.M):
+        index = int(number) - 1
+        if 0 <= index < len(texts) and label in MOOD_KEYWORDS:
+            labels[index] = label
+    return labels
+
+_ml_coalescer = None
+_ml_coalescer_lock = threading.Lock()
+
+def get_ml_coalescer():
+    """
+    Get the process-wide coalescer for ML fallback requests.
+
+    Batch size, collection window and concurrency come from ML_BATCH_SIZE,
+    ML_BATCH_WAIT_MS and ML_MAX_CONCURRENCY.
+    """
+    global _ml_coalescer
+    with _ml_coalescer_lock:
+        if _ml_coalescer is None:
+            _ml_coalescer = RequestCoalescer(
+                _ml_classify_batch,
+                _ml_classify_one,
+                max_batch_size=int(os.getenv('ML_BATCH_SIZE', '16')),
+                max_wait=float(os.getenv('ML_BATCH_WAIT_MS', '5')) / 1000,
+                max_concurrency=int(os.getenv('ML_MAX_CONCURRENCY', '4'))
+            )
+        return _ml_coalescer
+
+# Latency budget for the ML fallback in detect_mood_from_text
+ML_TIMEOUT = float(os.getenv('ML_TIMEOUT_MS', '2000')) / 1000
+
+# Stops calling Gemini after repeated failures or timeouts, then probes again later
+ML_BREAKER = CircuitBreaker(
+    failure_threshold=int(os.getenv('ML_BREAKER_FAILURES', '5')),
+    reset_timeout=float(os.getenv('ML_BREAKER_RESET_S', '30'))
+)
+
+_ml_stats = Counter()
+_ml_stats_lock = threading.Lock()
+
+def _count(name):
+    with _ml_stats_lock:
+        _ml_stats[name] += 1
+    metrics.inc('mood_ml_events_total', help_text='ML fallback calls by outcome', event=name)
+
+def ml_status():
+    """Snapshot of the ML fallback: breaker mode, call outcomes, coalescer and cache stats."""
+    with _ml_stats_lock:
+        counts = dict(_ml_stats)
+    return {
+        'mode': ML_BREAKER.state,
+        'calls': counts.get('calls', 0),
+        'cache_hits': counts.get('cache_hits', 0),
+        'timeouts': counts.get('timeouts', 0),
+        'failures': counts.get('failures', 0),
+        'short_circuits': counts.get('short_circuits', 0),
+        'breaker': ML_BREAKER.stats(),
+        'coalescer': get_ml_coalescer().stats(),
+        'cache': get_verdict_cache().stats()
+    }
+
+@metrics.timed('ml_fallback')
+def _ml_detect(text, timeout=None):
+    """
+    Cached, coalesced ML detection guarded by the circuit breaker.
+    Returns None if the model's answer was not a known mood; such answers
+    are not cached. Raises TimeoutError when the answer misses the deadline
+    and ConnectionError while the breaker is open.
+    """
+    _count('calls')
+    cache = get_verdict_cache()
+    key = verdict_key(text, ML_MODEL_NAME, ML_PROMPT_VERSION)
+    cached_mood = cache.get(key)
+    if cached_mood is not None:
+        _count('cache_hits')
+        return cached_mood
+
+    if not ML_BREAKER.allow():
+        _count('short_circuits')
+        raise ConnectionError("ML detection is unavailable (circuit open)")
+
+    def store(future):
+        # Late answers still warm the cache for the next request
+        if not future.cancelled() and future.exception() is None and future.result() is not None:
+            cache.set(key, future.result())
+
+    future = get_ml_coalescer().submit(text)
+    future.add_done_callback(store)
+    try:
+        detected_mood = future.result(timeout)
+    except concurrent.futures.TimeoutError:
+        _count('timeouts')
+        ML_BREAKER.record_failure()
+        raise TimeoutError(f"ML detection exceeded {timeout:.2f}s budget")
+    except Exception:
+        _count('failures')
+        ML_BREAKER.record_failure()
+        raise
+
+    ML_BREAKER.record_success()
+    return detected_mood
+
+def ml_based_detection(text, timeout=None):
+    """
+    Detect mood using the Gemini model with improved prompt.
+    Verdicts are cached, and cache misses go through the request coalescer so
+    concurrent callers share batched, pooled model calls. Returns 'neutral'
+    on failure, timeout, an answer that is not a mood, or while the circuit
+    breaker is open.
+    """
+    try:
+        return _ml_detect(text, timeout) or 'neutral'
     except Exception as e:
         print(f"Error in ML mood detection: {str(e)}")
         return 'neutral'
 
-def detect_mood_from_text(text):
+@metrics.timed('detect_mood')
+def detect_mood_from_text(text, timeout=None):
     """
     Hybrid mood detection that combines keyword-based and ML-based approaches
     with improved confidence thresholds and fallback logic.
+
+    The ML fallback gets `timeout` seconds (default ML_TIMEOUT); if it has not
+    answered by then, or the circuit breaker is open, the keyword verdict is used.
     """
     # First try keyword-based detection
     mood, confidence = keyword_based_detection(text)
+    metrics.inc('mood_detections_total', help_text='Texts run through hybrid detection')
     
     # If confidence is low or we hit certain edge cases, use ML
     if confidence < 0.4:  # Increased threshold for using ML
+        metrics.inc('mood_ml_fallbacks_total', help_text='Detections that fell back to the ML model')
         try:
-            ml_mood = ml_based_detection(text)
-            # Only use ML result if it's different and has high confidence
-            if ml_mood != mood and confidence < 0.3:
+            ml_mood = _ml_detect(text, ML_TIMEOUT if timeout is None else timeout)
+            # Only use ML result if it's a mood, different and has high confidence
+            if ml_mood and ml_mood != mood and confidence < 0.3:
                 return ml_mood
         except Exception as e:
             print(f"ML detection failed, using keyword result: {mood}")
@@ -0,0 +1,232 @@
+import atexit
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional
+from urllib.parse import urlparse
+import requests
+from requests.structures import CaseInsensitiveDict
+
+# Response headers worth keeping; everything else is dropped to keep cassettes small
+RECORDED_HEADERS = ('Content-Type', 'ETag', 'Retry-After', 'Location')
+
+# Token values are replaced in recorded accounts responses
+REDACTED_FIELDS = ('access_token', 'refresh_token')
+
+class CassetteMissError(LookupError):
+    """Raised in replay mode when a request has no recorded response."""
+
+class Cassette:
+    """
+    On-disk store of request/response pairs for Gemini and Spotify calls.
+
+    In record mode every interaction is captured with its latency and the
+    cassette is written (gzipped JSON) on save() or at exit. In replay mode
+    responses are served from the file, repeated requests returning their
+    recordings in order, after either the recorded latency or a fixed
+    `latency`. A request with no exact match falls back to one with the same
+    method and path, so varying bodies (timestamps, sampled tracks) still replay.
+    """
+
+    RECORD = 'record'
+    REPLAY = 'replay'
+
+    def __init__(self, path: str, mode: str = REPLAY, latency: Optional[float] = None):
+        if mode not in (self.RECORD, self.REPLAY):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self._lock = threading.Lock()
+        self._interactions = []
+        self._by_key = {}
+        self._by_route = {}
+        self._cursors = {}
+        self.hits = 0
+        self.misses = 0
+        if mode == self.REPLAY:
+            self._load()
+
+    def _load(self) -> None:
+        try:
+            with gzip.open(self.path, 'rt', encoding='utf-8') as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            raise CassetteMissError(f"No cassette at {self.path}; record one first")
+        for interaction in data['interactions']:
+            self._index(interaction)
+
+    def _index(self, interaction: Dict) -> None:
+        self._interactions.append(interaction)
+        self._by_key.setdefault(interaction['key'], []).append(interaction)
+        self._by_route.setdefault(interaction['route'], []).append(interaction)
+
+    def record(self, key: str, route: str, response: Dict, elapsed: float) -> None:
+        with self._lock:
+            self._index({'key': key, 'route': route, 'elapsed': round(elapsed, 4), 'response': response})
+
+    def replay(self, key: str, route: str) -> Dict:
+        """The next recorded response for a request, after its latency."""
+        with self._lock:
+            for index, lookup in (('key', key), ('route', route)):
+                recorded = (self._by_key if index == 'key' else self._by_route).get(lookup)
+                if recorded:
+                    cursor = self._cursors.get((index, lookup), 0)
+                    self._cursors[(index, lookup)] = cursor + 1
+                    interaction = recorded[min(cursor, len(recorded) - 1)]
+                    self.hits += 1
+                    break
+            else:
+                self.misses += 1
+                raise CassetteMissError(f"No recorded response for {route}")
+        delay = interaction['elapsed'] if self.latency is None else self.latency
+        if delay:
+            time.sleep(delay)
+        return interaction['response']
+
+    def save(self) -> None:
+        if self.mode != self.RECORD:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            data = {'version': 1, 'interactions': list(self._interactions)}
+        with gzip.open(self.path, 'wt', encoding='utf-8') as file:
+            json.dump(data, file, separators=(',', ':'))
+
+    def stats(self) -> Dict:
+        return {
+            'mode': self.mode,
+            'interactions': len(self._interactions),
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+def request_key(*parts) -> str:
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:32]
+
+class CassetteSession(requests.Session):
+    """
+    requests.Session that records or replays through a cassette.
+
+    Shares the wrapped session's adapters, so recording goes through the same
+    connection pool. Requests are keyed by method, path, query and body;
+    the host and auth headers are ignored so a cassette recorded against one
+    server replays for another, and credentials sent to the token endpoint
+    never reach the key.
+    """
+
+    def __init__(self, inner: requests.Session, cassette: Cassette):
+        super().__init__()
+        self.inner = inner
+        self.cassette = cassette
+        self.adapters = inner.adapters
+
+    def request(self, method, url, params=None, data=None, **kwargs):
+        parsed = urlparse(url)
+        query = sorted((params or {}).items()) if isinstance(params, dict) else params
+        path = parsed.path + (f'?{parsed.query}' if parsed.query else '')
+        route = f'{method.upper()} {parsed.path}'
+        body = data if not isinstance(data, dict) else sorted(data.items())
+        is_token = parsed.path.endswith('/api/token')
+        key = request_key(method.upper(), path, query, None if is_token else (body, kwargs.get('json')))
+
+        if self.cassette.mode == Cassette.REPLAY:
+            return self._build(self.cassette.replay(key, route), url)
+
+        start = time.perf_counter()
+        response = self.inner.request(method, url, params=params, data=data, **kwargs)
+        elapsed = time.perf_counter() - start
+        text = response.text
+        if is_token and response.ok:
+            token = response.json()
+            token.update({field: 'recorded' for field in REDACTED_FIELDS if field in token})
+            text = json.dumps(token)
+        self.cassette.record(key, route, {
+            'status': response.status_code,
+            'reason': response.reason,
+            'headers': {name: response.headers[name] for name in RECORDED_HEADERS if name in response.headers},
+            'body': text
+        }, elapsed)
+        return response
+
+    @staticmethod
+    def _build(recorded: Dict, url: str) -> requests.Response:
+        response = requests.Response()
+        response.status_code = recorded['status']
+        response.reason = recorded.get('reason') or ''
+        response.headers = CaseInsensitiveDict(recorded['headers'])
+        response._content = recorded['body'].encode('utf-8')
+        response.encoding = 'utf-8'
+        response.url = url
+        return response
+
+class RecordedResponse:
+    """The part of a genai response the callers read."""
+
+    def __init__(self, text: str):
+        self.text = text
+
+class CassetteModel:
+    """
+    Wraps a genai GenerativeModel so generate_content() is recorded or
+    replayed, keyed by model name, generation config and prompt.
+    """
+
+    def __init__(self, model, cassette: Cassette, model_name: str, generation_config: Optional[Dict] = None):
+        self.model = model
+        self.cassette = cassette
+        self.model_name = model_name
+        self.generation_config = generation_config or {}
+
+    def generate_content(self, contents, **kwargs):
+        route = f'GENAI {self.model_name}'
+        key = request_key('genai', self.model_name, self.generation_config, contents, kwargs)
+        if self.cassette.mode == Cassette.REPLAY:
+            return RecordedResponse(self.cassette.replay(key, route)['text'])
+
+        start = time.perf_counter()
+        response = self.model.generate_content(contents, **kwargs)
+        self.cassette.record(key, route, {'text': response.text}, time.perf_counter() - start)
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+_cassette = None
+_cassette_lock = threading.Lock()
+
+def get_cassette() -> Optional[Cassette]:
+    """
+    The process-wide cassette, or None when recording and replay are off.
+
+    CASSETTE_MODE selects 'record' or 'replay' (default off), CASSETTE_PATH
+    the file (default .cache/cassette.json.gz) and CASSETTE_LATENCY_MS a fixed
+    replay latency instead of the recorded one.
+    """
+    global _cassette
+    mode = os.getenv('CASSETTE_MODE', '').lower()
+    if mode not in (Cassette.RECORD, Cassette.REPLAY):
+        return None
+    with _cassette_lock:
+        if _cassette is None:
+            path = os.getenv('CASSETTE_PATH') or os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'cassette.json.gz')
+            latency = os.getenv('CASSETTE_LATENCY_MS')
+            _cassette = Cassette(path, mode, float(latency) / 1000 if latency else None)
+            if mode == Cassette.RECORD:
+                atexit.register(_cassette.save)
+        return _cassette
+
+def wrap_session(session: requests.Session) -> requests.Session:
+    """The session itself, or a recording/replaying wrapper when a cassette is active."""
+    cassette = get_cassette()
+    return CassetteSession(session, cassette) if cassette else session
+
+def wrap_model(model, model_name: str, generation_config: Optional[Dict] = None):
+    """The model itself, or a recording/replaying wrapper when a cassette is active."""
+    cassette = get_cassette()
+    return CassetteModel(model, cassette, model_name, generation_config) if cassette else model